@@ -0,0 +1,157 @@
+# for chat activity aggregates computed in Postgres, so only small result sets reach the app
+import logging
+from datetime import timedelta
+
+from app.cache.ttl_cache import MISSING, TTLCache
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+
+DEFAULT_ANALYTICS_DAYS = 30
+DEFAULT_BUSIEST_PERIODS = 5
+# Seconds after which every chat log below a read id has surely committed
+DEFAULT_ROLLUP_WATERMARK_LAG = 300.0
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# Aggregates only need to be roughly current, so admins flipping between
+# charts don't re-run the queries on every rerun
+analytics_cache = TTLCache(get_setting("ANALYTICS_CACHE_TTL", 60.0, float))
+
+
+# Bring chat_activity_hourly up to date by recomputing every hour that holds a
+# chat log above the rollup watermark. Going by id rather than by timestamp, a
+# row the writer inserted late (batched, retried) with an earlier timestamp is
+# counted however long it was delayed. The watermark moves like the summary one
+# (see app.chatlog.summary_store.advance_summary_watermark): to the largest id a
+# refresh read, once a refresh ANALYTICS_ROLLUP_LAG seconds later confirms it,
+# so rows committed out of id order are not skipped either.
+def refresh_activity_rollup(cur):
+    lag = get_setting("ANALYTICS_ROLLUP_LAG", DEFAULT_ROLLUP_WATERMARK_LAG, float)
+    # Also serializes concurrent refreshes
+    cur.execute("SELECT last_log_id, pending_log_id, pending_since FROM activity_rollup_watermark WHERE id = 1 FOR UPDATE")
+    last_log_id, pending_log_id, pending_since = cur.fetchone()
+    cur.execute("SELECT COALESCE(max(id), 0), now() FROM chat_logs")
+    max_log_id, read_at = cur.fetchone()
+    cur.execute("""
+        WITH touched AS (
+            SELECT DISTINCT date_trunc('hour', timestamp) AS hour FROM chat_logs WHERE id > %s
+        )
+        INSERT INTO chat_activity_hourly (hour, messages, conversations)
+        SELECT t.hour, count(*), count(DISTINCT l.conversation_id)
+        FROM touched t
+        JOIN chat_logs l ON l.timestamp >= t.hour AND l.timestamp < t.hour + interval '1 hour'
+        GROUP BY t.hour
+        ON CONFLICT (hour) DO UPDATE
+            SET messages = EXCLUDED.messages, conversations = EXCLUDED.conversations
+    """, (last_log_id,))
+    if pending_log_id is not None:
+        if pending_since > read_at - timedelta(seconds=lag):
+            # Too recent to settle; it waits for a later refresh
+            return
+        last_log_id = max(last_log_id, min(pending_log_id, max_log_id))
+    cur.execute(
+        "UPDATE activity_rollup_watermark SET last_log_id = %s, pending_log_id = %s, pending_since = %s WHERE id = 1",
+        (last_log_id, max_log_id, read_at),
+    )
+
+
+def _messages_per_day(cur, days):
+    cur.execute(
+        """
+        SELECT date_trunc('day', hour)::date AS day, sum(messages)::int
+        FROM chat_activity_hourly
+        WHERE hour >= date_trunc('day', localtimestamp) - make_interval(days => %s)
+        GROUP BY 1 ORDER BY 1
+        """,
+        (days - 1,),
+    )
+    return [{"day": day, "messages": messages} for day, messages in cur.fetchall()]
+
+
+def _conversations_per_hour(cur, hours):
+    cur.execute(
+        """
+        SELECT hour, conversations
+        FROM chat_activity_hourly
+        WHERE hour >= date_trunc('hour', localtimestamp) - make_interval(hours => %s)
+        ORDER BY hour
+        """,
+        (hours - 1,),
+    )
+    return [{"hour": hour, "conversations": conversations} for hour, conversations in cur.fetchall()]
+
+
+# Turns per conversation, over conversations with activity in the period
+def _turns_per_conversation(cur, days):
+    cur.execute(
+        """
+        SELECT count(*), avg(turns)::float, max(turns)
+        FROM (
+            SELECT conversation_id, count(*) AS turns
+            FROM chat_logs
+            WHERE conversation_id IS NOT NULL
+              AND timestamp >= localtimestamp - make_interval(days => %s)
+            GROUP BY conversation_id
+        ) per_conversation
+        """,
+        (days,),
+    )
+    conversations, average, longest = cur.fetchone()
+    return {"conversations": conversations, "average_turns": average or 0.0, "max_turns": longest or 0}
+
+
+# Weekday/hour slots with the most messages, e.g. a weekly Tuesday 10:00 class
+def _busiest_periods(cur, days, limit):
+    cur.execute(
+        """
+        SELECT extract(isodow FROM hour)::int, extract(hour FROM hour)::int, sum(messages)::int
+        FROM chat_activity_hourly
+        WHERE hour >= localtimestamp - make_interval(days => %s)
+        GROUP BY 1, 2 ORDER BY 3 DESC LIMIT %s
+        """,
+        (days, limit),
+    )
+    return [
+        {"weekday": WEEKDAYS[isodow - 1], "hour": f"{hour:02d}:00", "messages": messages}
+        for isodow, hour, messages in cur.fetchall()
+    ]
+
+
+# All dashboard aggregates for the last `days` days, cached for ANALYTICS_CACHE_TTL seconds.
+# Returns None if the database is unavailable.
+def get_activity_analytics(days=DEFAULT_ANALYTICS_DAYS):
+    cached = analytics_cache.get(days)
+    if cached is not MISSING:
+        return cached
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database for analytics.")
+            return None
+        try:
+            with conn, conn.cursor() as cur:
+                refresh_activity_rollup(cur)
+                analytics = {
+                    "messages_per_day": _messages_per_day(cur, days),
+                    "conversations_per_hour": _conversations_per_hour(cur, min(days * 24, 72)),
+                    "turns": _turns_per_conversation(cur, days),
+                    "busiest_periods": _busiest_periods(cur, days, DEFAULT_BUSIEST_PERIODS),
+                }
+        except Exception as e:
+            logging.error(f"Error computing chat analytics: {e}")
+            return None
+    analytics_cache.set(days, analytics)
+    return analytics
+
+
+# Empty the rollup after chat logs are deleted, so the charts start over with them
+def clear_activity_rollup():
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("TRUNCATE chat_activity_hourly")
+                cur.execute("UPDATE activity_rollup_watermark SET last_log_id = 0, pending_log_id = NULL, pending_since = NULL")
+        except Exception as e:
+            logging.error(f"Error clearing the activity rollup: {e}")
+    analytics_cache.invalidate()
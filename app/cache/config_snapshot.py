@@ -0,0 +1,62 @@
+# for a last-known-good copy of the app title, description and instructions on local
+# disk, so a page can render right away while a suspended database wakes up
+import json
+import logging
+import os
+import threading
+
+from app.cache.ttl_cache import MISSING
+from app.config.settings import get_setting
+
+DEFAULT_CONFIG_SNAPSHOT_PATH = os.path.join(".cache", "config_snapshot.json")
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _snapshot_path():
+    return get_setting("CONFIG_SNAPSHOT_PATH", DEFAULT_CONFIG_SNAPSHOT_PATH)
+
+
+def _load_locked():
+    global _snapshot
+    if _snapshot is None:
+        try:
+            with open(_snapshot_path(), encoding="utf-8") as f:
+                _snapshot = json.load(f)
+        except FileNotFoundError:
+            _snapshot = {}
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable config snapshot: {e}")
+            _snapshot = {}
+    return _snapshot
+
+
+# The snapshot as a dict; empty if none was saved yet
+def load_config_snapshot():
+    with _snapshot_lock:
+        return dict(_load_locked())
+
+
+def get_snapshot_value(key):
+    with _snapshot_lock:
+        return _load_locked().get(key, MISSING)
+
+
+# Record a value just read from the database. The file is only rewritten when
+# the value changed, and atomically, so a crash never leaves half a snapshot.
+def update_config_snapshot(key, value):
+    with _snapshot_lock:
+        snapshot = _load_locked()
+        if snapshot.get(key, MISSING) == value:
+            return
+        snapshot[key] = value
+        path = _snapshot_path()
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.warning(f"Could not save config snapshot: {e}")
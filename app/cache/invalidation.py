@@ -0,0 +1,127 @@
+# for dropping cached values on every replica when an admin changes them on one.
+# Updates send a Postgres NOTIFY (see notify_cache_invalidation); each process
+# LISTENs on a dedicated connection and invalidates its own metadata cache.
+import logging
+import select
+import threading
+
+import psycopg2
+
+from app.cache.ttl_cache import metadata_cache
+from app.config.settings import get_setting
+from app.db.database_connection import CACHE_INVALIDATION_CHANNEL, get_database_url, is_database_warm
+from app.db.warmup import in_class_hours
+from app.metrics.tracing import increment
+
+# While the listener is connected, changes arrive as notifications, so cached
+# values only expire as a safety net
+DEFAULT_LISTENER_CACHE_TTL = 3600.0
+# Seconds between checks for a dropped connection, a stop request or the end of class hours
+LISTENER_POLL_INTERVAL = 30.0
+MAX_RECONNECT_DELAY = 60.0
+
+
+class InvalidationListener(threading.Thread):
+    def __init__(self, database_url, listening_ttl):
+        super().__init__(name="cache-invalidation-listener", daemon=True)
+        self.database_url = database_url
+        self.listening_ttl = listening_ttl
+        self.base_ttl = metadata_cache.ttl
+        self.connected = False
+        # Latest version seen per cache key
+        self.versions = {}
+        self._stop_event = threading.Event()
+
+    # Listen during class hours, or while the app is using the database anyway.
+    # Otherwise the LISTEN session alone would keep Neon's compute from suspending,
+    # or wake it up to reconnect, so the listener lets go and cached values expire
+    # after the normal TTL instead.
+    def _should_listen(self):
+        return in_class_hours() or is_database_warm()
+
+    def run(self):
+        delay = 1.0
+        while not self._stop_event.is_set():
+            if not self._should_listen():
+                self._stop_event.wait(LISTENER_POLL_INTERVAL)
+                continue
+            conn = None
+            try:
+                # Not from the pool: LISTEN needs a session of its own for as long as
+                # the process runs (and a direct, not a transaction-pooled, endpoint)
+                conn = psycopg2.connect(self.database_url)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CACHE_INVALIDATION_CHANNEL};")
+                self._set_connected(True)
+                delay = 1.0
+                while not self._stop_event.is_set() and self._should_listen():
+                    select.select([conn], [], [], LISTENER_POLL_INTERVAL)
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logging.warning(f"Cache invalidation listener disconnected, retrying in {delay:.0f}s: {e}")
+            finally:
+                self._set_connected(False)
+                if conn is not None:
+                    conn.close()
+            self._stop_event.wait(delay)
+            delay = min(MAX_RECONNECT_DELAY, delay * 2)
+
+    # Notifications may have been missed while disconnected, so every state
+    # change starts from an empty cache
+    def _set_connected(self, connected):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        metadata_cache.ttl = self.listening_ttl if connected else self.base_ttl
+        metadata_cache.invalidate()
+        logging.info(f"Cache invalidation listener {'connected' if connected else 'stopped'}; cache TTL {metadata_cache.ttl:.0f}s.")
+
+    # Payloads are "<cache key>:<version>"; versions come from one sequence, so
+    # a repeated or older one has already been handled
+    def _handle(self, payload):
+        key, _, version = payload.rpartition(":")
+        try:
+            version = int(version)
+        except ValueError:
+            logging.warning(f"Ignoring malformed cache invalidation: {payload}")
+            return
+        if version <= self.versions.get(key, 0):
+            return
+        self.versions[key] = version
+        metadata_cache.invalidate(key)
+        increment("cache_invalidations_received", key=key)
+        logging.info(f"Cache key {key} invalidated (version {version}).")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+# Start this process's listener once; a no-op when CACHE_INVALIDATION_LISTENER is off.
+# CACHE_INVALIDATION_DB_URL can point it at a direct endpoint when the app
+# connects through a transaction pooler.
+def start_invalidation_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is not None or not get_setting("CACHE_INVALIDATION_LISTENER", True, bool):
+            return _listener
+        database_url = get_setting("CACHE_INVALIDATION_DB_URL") or get_database_url()
+        if not database_url:
+            return None
+        _listener = InvalidationListener(
+            database_url, get_setting("LISTENER_CACHE_TTL", DEFAULT_LISTENER_CACHE_TTL, float))
+        _listener.start()
+        return _listener
+
+
+# For the admin Performance panel
+def get_invalidation_listener_status():
+    if _listener is None:
+        return {"running": False, "connected": False, "versions": {}}
+    return {"running": _listener.is_alive(), "connected": _listener.connected, "versions": dict(_listener.versions)}
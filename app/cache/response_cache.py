@@ -0,0 +1,266 @@
+# for reusing answers to repeated (or nearly repeated) student questions
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+
+DEFAULT_RESPONSE_CACHE_TTL = 3600.0
+DEFAULT_RESPONSE_CACHE_MAX_ENTRIES = 1000
+DEFAULT_RESPONSE_CACHE_SIMILARITY = 0.85
+# How often (seconds) a replica trims the shared table after storing an answer
+DEFAULT_RESPONSE_CACHE_PRUNE_INTERVAL = 300.0
+
+# MinHash signature length and LSH banding (BANDS * ROWS_PER_BAND == NUM_PERMUTATIONS)
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = 4
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240521)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NUM_PERMUTATIONS)]
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+# Lower-case, collapse whitespace and drop trailing ?!., so trivially different
+# spellings of the same question share a key. Operators and other symbols are
+# kept: "2+2" and "2-2", or "a == b" and "a = b", are different questions.
+def normalize_prompt(prompt):
+    return _TRAILING_PUNCTUATION.sub("", _SPACES.sub(" ", prompt.lower())).strip()
+
+
+# Short fingerprint of the custom instructions; answers never cross versions
+def instructions_version(instructions):
+    return hashlib.sha256((instructions or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _cache_key(version, normalized):
+    return hashlib.sha256(f"{version}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+# Word 3-shingles, or character 4-shingles for very short prompts
+def _shingles(normalized):
+    words = normalized.split()
+    if len(words) >= 3:
+        return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+    return {normalized[i:i + 4] for i in range(max(1, len(normalized) - 3))}
+
+
+def minhash_signature(normalized):
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+              for s in _shingles(normalized)]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def estimated_similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERMUTATIONS
+
+
+def _band_keys(version, signature):
+    return [(version, band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]) for band in range(BANDS)]
+
+
+# In-process LRU/TTL cache of answers, with an optional MinHash LSH index for
+# near-duplicate lookups and an optional shared Postgres tier.
+class ResponseCache:
+    def __init__(self, ttl, max_entries, near_duplicates=False, similarity=DEFAULT_RESPONSE_CACHE_SIMILARITY,
+                 shared=False, prune_interval=DEFAULT_RESPONSE_CACHE_PRUNE_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.near_duplicates = near_duplicates
+        self.similarity = similarity
+        self.shared = shared
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        # key -> (response, expires_at, version, signature)
+        self._entries = OrderedDict()
+        self._bands = {}
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "near_hits": 0, "shared_hits": 0, "misses": 0}
+
+    # Cached answer for this prompt under these instructions, or None
+    def lookup(self, prompt, instructions):
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return None
+        version = instructions_version(instructions)
+        key = _cache_key(version, normalized)
+        signature = minhash_signature(normalized) if self.near_duplicates else None
+        with self._lock:
+            response = self._get_local(key)
+            if response is not None:
+                self.stats["exact_hits"] += 1
+                return response
+            if signature is not None:
+                response = self._get_near_duplicate(version, signature)
+                if response is not None:
+                    self.stats["near_hits"] += 1
+                    return response
+        if self.shared:
+            response = self._get_shared(key)
+            if response is not None:
+                with self._lock:
+                    self._put_local(key, response, version, signature)
+                    self.stats["shared_hits"] += 1
+                return response
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def store(self, prompt, instructions, response):
+        normalized = normalize_prompt(prompt)
+        if not normalized or not response:
+            return
+        version = instructions_version(instructions)
+        key = _cache_key(version, normalized)
+        signature = minhash_signature(normalized) if self.near_duplicates else None
+        with self._lock:
+            self._put_local(key, response, version, signature)
+        if self.shared:
+            self._put_shared(key, version, normalized, response)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _get_near_duplicate(self, version, signature):
+        candidates = set()
+        for band_key in _band_keys(version, signature):
+            candidates.update(self._bands.get(band_key, ()))
+        best_key, best_score = None, 0.0
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                continue
+            score = estimated_similarity(signature, entry[3])
+            if score > best_score:
+                best_key, best_score = key, score
+        if best_key is None or best_score < self.similarity:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key][0]
+
+    def _put_local(self, key, response, version, signature):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (response, time.monotonic() + self.ttl, version, signature)
+        if signature is not None:
+            for band_key in _band_keys(version, signature):
+                self._bands.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, _, version, signature = self._entries.pop(key)
+        if signature is not None:
+            for band_key in _band_keys(version, signature):
+                members = self._bands.get(band_key)
+                if members:
+                    members.discard(key)
+                    if not members:
+                        del self._bands[band_key]
+
+    def _get_shared(self, key):
+        with pooled_connection() as conn:
+            if conn is None:
+                return None
+            try:
+                with conn, conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE response_cache SET hits = hits + 1
+                        WHERE cache_key = %s AND created_at > now() - make_interval(secs => %s)
+                        RETURNING response
+                        """,
+                        (key, self.ttl),
+                    )
+                    row = cur.fetchone()
+                    return row[0] if row else None
+            except Exception as e:
+                logging.error(f"Error reading shared response cache: {e}")
+                return None
+
+    def _put_shared(self, key, version, normalized, response):
+        with pooled_connection() as conn:
+            if conn is None:
+                return
+            try:
+                with conn, conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        INSERT INTO response_cache (cache_key, instructions_version, normalized_prompt, response)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (cache_key) DO UPDATE SET
+                            response = EXCLUDED.response,
+                            created_at = now(),
+                            hits = 0
+                        """,
+                        (key, version, normalized, response),
+                    )
+                    if self._prune_due():
+                        self._prune_shared(cur)
+            except Exception as e:
+                logging.error(f"Error writing shared response cache: {e}")
+
+    def _prune_due(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_prune:
+                return False
+            self._next_prune = now + self.prune_interval
+            return True
+
+    # Drop expired answers and all but the newest max_entries, so the shared
+    # table stays as bounded as the in-process one
+    def _prune_shared(self, cur):
+        cur.execute(
+            """
+            DELETE FROM response_cache
+            WHERE created_at <= now() - make_interval(secs => %s)
+               OR cache_key IN (SELECT cache_key FROM response_cache ORDER BY created_at DESC OFFSET %s)
+            """,
+            (self.ttl, self.max_entries),
+        )
+        if cur.rowcount:
+            logging.info(f"Pruned {cur.rowcount} shared response cache entries.")
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+# The process-wide response cache, or None when RESPONSE_CACHE_ENABLED is off
+def get_response_cache():
+    global _response_cache
+    if not get_setting("RESPONSE_CACHE_ENABLED", True, bool):
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    ttl=get_setting("RESPONSE_CACHE_TTL", DEFAULT_RESPONSE_CACHE_TTL, float),
+                    max_entries=get_setting("RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_RESPONSE_CACHE_MAX_ENTRIES, int),
+                    near_duplicates=get_setting("RESPONSE_CACHE_NEAR_DUPLICATES", False, bool),
+                    similarity=get_setting("RESPONSE_CACHE_SIMILARITY", DEFAULT_RESPONSE_CACHE_SIMILARITY, float),
+                    shared=get_setting("RESPONSE_CACHE_SHARED", False, bool),
+                    prune_interval=get_setting("RESPONSE_CACHE_PRUNE_INTERVAL", DEFAULT_RESPONSE_CACHE_PRUNE_INTERVAL, float),
+                )
+    return _response_cache
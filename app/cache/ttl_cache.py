@@ -0,0 +1,64 @@
+# for caching rarely-changing values (title, description, instructions) in process memory
+import threading
+import time
+
+from app.config.settings import get_setting
+
+DEFAULT_METADATA_CACHE_TTL = 300.0
+
+# Sentinel so that cached falsy values (e.g. empty instructions) still count as hits
+MISSING = object()
+
+
+# Thread-safe key/value cache where every entry expires after ttl seconds
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Return the cached value, or MISSING if absent or expired
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    # Drop one key, or everything when no key is given
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "ttl": self.ttl,
+            }
+
+
+# Shared by every session in the process, so a rerun normally needs no config queries
+metadata_cache = TTLCache(get_setting("METADATA_CACHE_TTL", DEFAULT_METADATA_CACHE_TTL, float))
+
+
+# Hit/miss counters for the app title, description and instructions cache
+def get_metadata_cache_stats():
+    return metadata_cache.stats()
@@ -0,0 +1,112 @@
+# for keeping the conversation sent to Claude within a token budget
+import logging
+import threading
+
+from app.chat.generation import build_system_blocks
+from app.chat.scheduler import INTERACTIVE
+from app.chatlog.summarizer import TokenBudget, estimate_tokens, summarize_text
+from app.config.settings import get_setting
+
+# Tokens (estimated) allowed for instructions + rolling summary + recent turns
+DEFAULT_CONTEXT_TOKEN_BUDGET = 4000
+# Recent messages always sent verbatim (the last exchange plus the new question)
+DEFAULT_CONTEXT_MIN_RECENT_MESSAGES = 3
+
+ROLLING_SUMMARY_INSTRUCTION = ("Update the running summary of this tutoring conversation with the new turns. "
+                               "Keep what the student asked, what was explained and anything still unresolved.")
+
+
+# Session-scoped state: the rolling summary, how many messages it covers, and
+# up to where the last request wanted them folded (done after the reply)
+def new_context_state():
+    return {"summary": "", "folded": 0, "fold_to": 0, "folding": False, "last_stats": {}}
+
+
+def _message_tokens(message):
+    # A few tokens of overhead per message for the role and separators
+    return estimate_tokens(message["content"]) + 4
+
+
+def _format_turns(messages):
+    return "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+
+
+# Fold older messages into the rolling summary, then mark them folded (in that
+# order, so a reader never sees them as folded before the summary has them).
+# On failure the summary is left unchanged and folding is retried next turn.
+def _fold_into_summary(client, state, messages, folded_to, conversation_id):
+    text = _format_turns(messages)
+    if state["summary"]:
+        text = f"Summary so far:\n{state['summary']}\n\nNew turns:\n{text}"
+    try:
+        state["summary"] = summarize_text(client, ROLLING_SUMMARY_INSTRUCTION, text, TokenBudget(estimate_tokens(text) * 2 + 1000),
+                                          priority=INTERACTIVE, key=conversation_id)
+        state["folded"] = folded_to
+    except Exception as e:
+        logging.error(f"Failed to update rolling conversation summary: {e}")
+    finally:
+        state["folding"] = False
+
+
+# Call once the reply has been sent: fold the messages the last request left
+# out of its window into the summary, on a background thread so no reply waits
+# for it. `messages` and `offset` as for build_conversation_context.
+def fold_conversation_context(client, state, messages, offset=0, conversation_id=None):
+    folded, fold_to = state["folded"], state.get("fold_to", 0)
+    if fold_to <= folded or state.get("folding"):
+        return None
+    state["folding"] = True
+    # A copy, since the history may be trimmed while the thread runs
+    pending = list(messages[max(0, folded - offset):fold_to - offset])
+    thread = threading.Thread(target=_fold_into_summary, args=(client, state, pending, fold_to, conversation_id),
+                              name="context-fold", daemon=True)
+    thread.start()
+    return thread
+
+
+# Build the context for the next request: system blocks (instructions plus
+# the rolling summary of older turns) and as many recent messages as fit the
+# token budget, returned as (system, messages). Messages that fall out of the
+# window are folded into the summary incrementally, each one once, by
+# fold_conversation_context after the reply. Until they are folded (or if
+# folding fails) they are still sent verbatim, never dropped.
+# `messages` may be only the tail of the conversation, starting at position `offset`;
+# state["folded"] counts positions in the whole conversation.
+def build_conversation_context(instructions, messages, state, token_budget=None, offset=0):
+    if token_budget is None:
+        token_budget = get_setting("CONTEXT_TOKEN_BUDGET", DEFAULT_CONTEXT_TOKEN_BUDGET, int)
+    min_recent = get_setting("CONTEXT_MIN_RECENT_MESSAGES", DEFAULT_CONTEXT_MIN_RECENT_MESSAGES, int)
+    # Messages before the tail were dropped only after being folded
+    folded = max(0, state["folded"] - offset)
+    summary = state["summary"]
+
+    # Walk back from the newest message until the budget is used up
+    used = estimate_tokens(instructions) + estimate_tokens(summary)
+    window_start = len(messages)
+    while window_start > folded:
+        tokens = _message_tokens(messages[window_start - 1])
+        if used + tokens > token_budget and len(messages) - window_start >= min_recent:
+            break
+        used += tokens
+        window_start -= 1
+    # The window has to open with a student turn
+    while window_start < len(messages) - 1 and messages[window_start]["role"] != "user":
+        window_start += 1
+
+    if window_start > folded:
+        state["fold_to"] = max(state.get("fold_to", 0), offset + window_start)
+
+    summary_part = f"Summary of the earlier conversation:\n{summary}" if summary else ""
+    system = build_system_blocks(instructions, [summary_part])
+    window = [{"role": m["role"], "content": m["content"]} for m in messages[folded:]]
+
+    full_tokens = estimate_tokens(instructions) + sum(_message_tokens(m) for m in messages)
+    sent_tokens = sum(estimate_tokens(block["text"]) for block in system) + sum(_message_tokens(m) for m in window)
+    state["last_stats"] = {
+        "sent_tokens": sent_tokens,
+        "saved_tokens": max(0, full_tokens - sent_tokens),
+        "window_messages": len(window),
+        "summarized_messages": offset + folded,
+    }
+    logging.info(f"Conversation context: {sent_tokens} tokens sent, {state['last_stats']['saved_tokens']} saved.")
+    return system, window
@@ -0,0 +1,139 @@
+# for running the app, tests and benchmarks without calling the Anthropic API
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+DEFAULT_FAKE_REPLY = "This is a reply from the local fake Claude client."
+
+
+# Stand-in for anthropic.Anthropic that supports messages.create, with and
+# without stream=True, and messages.batches. Replies are deterministic; latency is configurable.
+# Cacheable prefixes (content up to a cache_control breakpoint) are
+# remembered, so usage reports cache writes on first use and reads after.
+class FakeAnthropicClient:
+    def __init__(self, reply=DEFAULT_FAKE_REPLY, first_token_latency=0.0, chunk_latency=0.0, chunk_size=8):
+        self.reply = reply
+        self.first_token_latency = first_token_latency
+        self.chunk_latency = chunk_latency
+        self.chunk_size = chunk_size
+        # Most recent requests only, since one client may serve a whole load test
+        self.requests = deque(maxlen=1000)
+        self.messages = _FakeMessages(self)
+        self._cached_prefixes = set()
+        self._lock = threading.Lock()
+
+    def reply_for(self, messages):
+        if callable(self.reply):
+            return self.reply(messages)
+        return self.reply
+
+    # Returns (cache_creation_input_tokens, cache_read_input_tokens, uncached input tokens)
+    def cache_usage(self, system, messages):
+        parts = []
+        if isinstance(system, str):
+            parts.append((system, None))
+        else:
+            parts.extend((block["text"], block.get("cache_control")) for block in system or [])
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, str):
+                parts.append((content, None))
+            else:
+                parts.extend((block["text"], block.get("cache_control")) for block in content)
+
+        written = read = total = 0
+        prefix = hashlib.sha256()
+        prefix_tokens = 0
+        for text, cache_control in parts:
+            tokens = _count_tokens(text)
+            total += tokens
+            prefix.update(text.encode("utf-8"))
+            prefix_tokens += tokens
+            if cache_control:
+                key = prefix.hexdigest()
+                with self._lock:
+                    if key in self._cached_prefixes:
+                        read = prefix_tokens
+                    else:
+                        self._cached_prefixes.add(key)
+                        written = prefix_tokens - read
+        return written, read, total - written - read
+
+
+class _FakeMessages:
+    def __init__(self, client):
+        self._client = client
+        self.batches = _FakeBatches(client)
+
+    def create(self, model, messages, max_tokens, system=None, stream=False, **kwargs):
+        client = self._client
+        client.requests.append({"model": model, "system": system, "messages": messages,
+                                "max_tokens": max_tokens, "stream": stream, **kwargs})
+        text = client.reply_for(messages)
+        written, read, uncached = client.cache_usage(system, messages)
+        usage = SimpleNamespace(input_tokens=uncached, output_tokens=_count_tokens(text),
+                                cache_creation_input_tokens=written, cache_read_input_tokens=read)
+        if stream:
+            return _stream_events(client, text, usage)
+        time.sleep(client.first_token_latency)
+        return SimpleNamespace(
+            id="msg_fake",
+            type="message",
+            role="assistant",
+            model=model,
+            content=[SimpleNamespace(type="text", text=text)],
+            stop_reason="end_turn",
+            usage=usage,
+        )
+
+
+# Stand-in for the Message Batches API: requests are answered as soon as the
+# batch is created, so the batch has ended by the first retrieve().
+class _FakeBatches:
+    def __init__(self, client):
+        self._client = client
+        self._results = {}
+
+    def create(self, requests):
+        results = []
+        for request in requests:
+            message = self._client.messages.create(**request["params"])
+            results.append(SimpleNamespace(custom_id=request["custom_id"],
+                                           result=SimpleNamespace(type="succeeded", message=message)))
+        with self._client._lock:
+            batch_id = f"msgbatch_fake_{len(self._results) + 1}"
+            self._results[batch_id] = results
+        return SimpleNamespace(id=batch_id, type="message_batch", processing_status="in_progress")
+
+    def retrieve(self, batch_id):
+        if batch_id not in self._results:
+            raise KeyError(f"Unknown batch {batch_id}")
+        return SimpleNamespace(id=batch_id, type="message_batch", processing_status="ended")
+
+    def results(self, batch_id):
+        return iter(self._results[batch_id])
+
+
+def _stream_events(client, text, usage):
+    yield SimpleNamespace(type="message_start", message=SimpleNamespace(
+        usage=SimpleNamespace(input_tokens=usage.input_tokens, output_tokens=1,
+                              cache_creation_input_tokens=usage.cache_creation_input_tokens,
+                              cache_read_input_tokens=usage.cache_read_input_tokens)))
+    yield SimpleNamespace(type="content_block_start", index=0, content_block=SimpleNamespace(type="text", text=""))
+    time.sleep(client.first_token_latency)
+    for start in range(0, len(text), client.chunk_size):
+        if start:
+            time.sleep(client.chunk_latency)
+        yield SimpleNamespace(type="content_block_delta", index=0,
+                              delta=SimpleNamespace(type="text_delta", text=text[start:start + client.chunk_size]))
+    yield SimpleNamespace(type="content_block_stop", index=0)
+    yield SimpleNamespace(type="message_delta", delta=SimpleNamespace(stop_reason="end_turn", stop_sequence=None),
+                          usage=SimpleNamespace(output_tokens=usage.output_tokens))
+    yield SimpleNamespace(type="message_stop")
+
+
+def _count_tokens(text):
+    return max(1, len(json.dumps(text)) // 4) if text else 0
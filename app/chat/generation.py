@@ -0,0 +1,143 @@
+# for generating replies with the streaming Messages API and prompt caching
+import logging
+import threading
+import time
+
+import anthropic
+import streamlit as st
+
+from app.chat.fake_client import FakeAnthropicClient
+from app.config.settings import get_setting
+from app.metrics.tracing import increment, observe, span
+
+# Any current model ID can be set with the CLAUDE_MODEL setting
+DEFAULT_CLAUDE_MODEL = "claude-sonnet-4-5"
+DEFAULT_REPLY_MAX_TOKENS = 1024
+
+CACHE_BREAKPOINT = {"type": "ephemeral"}
+
+
+def get_model():
+    return get_setting("CLAUDE_MODEL", DEFAULT_CLAUDE_MODEL)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# Anthropic client for the app, or the local fake when USE_FAKE_ANTHROPIC is set.
+# One client (and its HTTP connection pool) is shared by every session in the process.
+def get_claude_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _create_claude_client()
+        return _client
+
+
+def _create_claude_client():
+    if get_setting("USE_FAKE_ANTHROPIC", False, bool):
+        return FakeAnthropicClient(
+            first_token_latency=get_setting("FAKE_ANTHROPIC_FIRST_TOKEN_LATENCY", 0.0, float),
+            chunk_latency=get_setting("FAKE_ANTHROPIC_CHUNK_LATENCY", 0.0, float),
+        )
+    anthropic_api_key = get_setting("ANTHROPIC_API_KEY")
+    if not anthropic_api_key:
+        logging.error("Anthropic API key is missing in secrets.")
+        return None
+    return anthropic.Anthropic(api_key=anthropic_api_key)
+
+
+# System prompt as content blocks. The instructions rarely change, so they end
+# with a cache breakpoint; anything after them (e.g. a rolling summary) is not cached.
+def build_system_blocks(instructions, extra_parts=()):
+    blocks = []
+    if instructions:
+        blocks.append({"type": "text", "text": instructions, "cache_control": CACHE_BREAKPOINT})
+    for part in extra_parts:
+        if part:
+            blocks.append({"type": "text", "text": part})
+    return blocks
+
+
+# Messages with a cache breakpoint on the last message before the newest one,
+# so the unchanged conversation prefix is read from cache on the next turn.
+def build_message_params(messages):
+    params = []
+    prefix_end = len(messages) - 2
+    for idx, message in enumerate(messages):
+        if idx == prefix_end:
+            content = [{"type": "text", "text": message["content"], "cache_control": CACHE_BREAKPOINT}]
+        else:
+            content = message["content"]
+        params.append({"role": message["role"], "content": content})
+    return params
+
+
+def _usage_dict(usage):
+    return {
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+    }
+
+
+# Stream a reply, yielding text as it arrives. Token usage (including
+# cache reads and writes) and the stop reason are written into `usage`.
+def stream_reply(client, system, messages, usage=None, max_tokens=None):
+    if usage is None:
+        usage = {}
+    if max_tokens is None:
+        max_tokens = get_setting("REPLY_MAX_TOKENS", DEFAULT_REPLY_MAX_TOKENS, int)
+    start = time.perf_counter()
+    first_token_at = None
+    stream = client.messages.create(
+        model=get_model(),
+        system=system,
+        messages=build_message_params(messages),
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    for event in stream:
+        if event.type == "message_start":
+            usage.update(_usage_dict(event.message.usage))
+        elif event.type == "content_block_delta":
+            if event.delta.type == "text_delta":
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    observe("llm_ttft_seconds", first_token_at - start)
+                yield event.delta.text
+        elif event.type == "message_delta":
+            usage["output_tokens"] = event.usage.output_tokens
+            usage["stop_reason"] = event.delta.stop_reason
+    observe("llm_stream_seconds", time.perf_counter() - start)
+    for kind in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+        increment("llm_tokens", usage.get(kind, 0), kind=kind)
+    logging.info(
+        f"Claude usage: {usage.get('input_tokens', 0)} input, {usage.get('output_tokens', 0)} output, "
+        f"{usage.get('cache_read_input_tokens', 0)} cache read, "
+        f"{usage.get('cache_creation_input_tokens', 0)} cache write tokens."
+    )
+
+
+# Single non-streaming request returning the reply text
+def complete(client, system, prompt, max_tokens, usage=None):
+    with span("llm_request_seconds"):
+        response = client.messages.create(
+            model=get_model(),
+            system=system,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+        )
+    if usage is not None:
+        usage.update(_usage_dict(response.usage))
+    return "".join(block.text for block in response.content if block.type == "text")
+
+
+# Per-session running totals shown to admins
+def record_usage(usage):
+    totals = st.session_state.setdefault("claude_usage", {})
+    for key, value in usage.items():
+        if isinstance(value, int):
+            totals[key] = totals.get(key, 0) + value
@@ -0,0 +1,123 @@
+# for bounding the chat history held in session state. Only a recent tail of the
+# conversation stays in memory; older exchanges are already in chat_logs (by
+# conversation_id) and are read back from there on demand.
+import csv
+import logging
+import os
+import tempfile
+
+from app.chatlog.chatlog_handler import iter_chat_logs
+from app.chatlog.chatlog_writer import flush_chat_logs
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+
+# Messages kept in session state (not counting turns the context window still needs)
+DEFAULT_HISTORY_MAX_MESSAGES = 40
+# Messages rendered per rerun, and per "load earlier" page
+DEFAULT_HISTORY_PAGE_MESSAGES = 20
+# Seconds to wait for this conversation's queued chat logs before reading it back
+HISTORY_FLUSH_TIMEOUT = 2.0
+
+
+class ChatHistory:
+    def __init__(self, conversation_id, max_messages=None):
+        if max_messages is None:
+            max_messages = get_setting("HISTORY_MAX_MESSAGES", DEFAULT_HISTORY_MAX_MESSAGES, int)
+        self.conversation_id = conversation_id
+        self.max_messages = max_messages
+        # The in-memory tail, as {"role", "content"} dicts
+        self.messages = []
+        # Position of messages[0] in the whole conversation, for context_state["folded"]
+        self.offset = 0
+        # chat_logs rows (one per question and answer) no longer held in memory
+        self.spilled_rows = 0
+
+    # Number of messages in the whole conversation so far
+    def __len__(self):
+        return self.offset + len(self.messages)
+
+    def append(self, role, content):
+        self.messages.append({"role": role, "content": content})
+
+    # Drop the oldest messages beyond max_messages, but never anything at or after
+    # keep_from (a conversation position), which the context window still needs.
+    # Only whole question/answer pairs count as spilled rows; a question without
+    # an answer was never logged and is simply dropped.
+    def trim(self, keep_from):
+        limit = min(len(self) - self.max_messages, keep_from)
+        while self.offset < limit and self.messages:
+            pair = self.messages[:2]
+            if len(pair) == 2 and pair[0]["role"] == "user" and pair[1]["role"] == "assistant":
+                if self.offset + 2 > limit:
+                    break
+                del self.messages[:2]
+                self.offset += 2
+                self.spilled_rows += 1
+            else:
+                del self.messages[0]
+                self.offset += 1
+
+    # The messages to render when `count` are requested: the end of the tail,
+    # preceded by as many spilled exchanges from chat_logs as needed.
+    # Returns (messages, whether even earlier ones exist).
+    def visible(self, count):
+        shown = self.messages[-count:] if count else []
+        earlier_rows = min(self.spilled_rows, -(-(count - len(shown)) // 2))
+        more = len(shown) < len(self.messages) or earlier_rows < self.spilled_rows
+        if earlier_rows <= 0:
+            return shown, more
+        return fetch_conversation_messages(self.conversation_id, self.spilled_rows - earlier_rows, earlier_rows) + shown, more
+
+
+# Wait (briefly) only for this conversation's queued rows, never for other sessions
+def _flush_conversation(conversation_id):
+    if not flush_chat_logs(timeout=HISTORY_FLUSH_TIMEOUT, conversation_id=conversation_id):
+        logging.warning(f"Chat logs of conversation {conversation_id} are still queued or were dropped; reading without them.")
+
+
+# Messages from `limit` chat_logs rows of a conversation, starting `start` rows in
+def fetch_conversation_messages(conversation_id, start, limit):
+    # Rows still queued in the background writer are not visible yet
+    _flush_conversation(conversation_id)
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database for fetching the conversation.")
+            return []
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(
+                    "SELECT prompt, response FROM chat_logs WHERE conversation_id = %s ORDER BY id LIMIT %s OFFSET %s",
+                    (conversation_id, limit, start),
+                )
+                messages = []
+                for prompt, response in cur.fetchall():
+                    messages.append({"role": "user", "content": prompt})
+                    messages.append({"role": "assistant", "content": response})
+                return messages
+        except Exception as e:
+            logging.error(f"Error fetching conversation history: {e}")
+            return []
+
+
+# Write a whole conversation, streamed from chat_logs, to a Role/Message CSV file.
+# Returns the file path, or None if there was nothing to export.
+def export_conversation_csv(conversation_id):
+    _flush_conversation(conversation_id)
+    fd, path = tempfile.mkstemp(prefix="conversation_", suffix=".csv")
+    row_count = 0
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8-sig", newline="") as output:
+            writer = csv.writer(output)
+            writer.writerow(["Role", "Message"])
+            for _, _, prompt, response, _, _ in iter_chat_logs(conversation_id=conversation_id):
+                writer.writerow(["user", prompt])
+                writer.writerow(["assistant", response])
+                row_count += 1
+    except Exception as e:
+        logging.error(f"Error exporting conversation: {e}")
+        os.remove(path)
+        return None
+    if row_count == 0:
+        os.remove(path)
+        return None
+    return path
@@ -0,0 +1,329 @@
+# for sharing the Claude rate limits fairly between every session in the process
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import anthropic
+
+from app.config.settings import get_setting
+from app.metrics.tracing import increment, observe
+
+# Requests in flight to the API at once, across all sessions
+DEFAULT_LLM_MAX_CONCURRENCY = 8
+# Tokens (input, cache writes and output) per minute, across all sessions
+DEFAULT_LLM_TOKENS_PER_MINUTE = 80000
+# Tokens per minute one conversation may use, so a single student can't starve the class
+DEFAULT_LLM_SESSION_TOKENS_PER_MINUTE = 20000
+# Seconds a request may wait for a slot before giving up
+DEFAULT_LLM_QUEUE_TIMEOUT = 120.0
+DEFAULT_LLM_MAX_RETRIES = 3
+
+# Lanes: student replies are always dispatched before admin summarization work
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Errors worth retrying: rate limits, overload and transient network problems
+RETRYABLE_API_ERRORS = (
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,
+    anthropic.APIConnectionError,
+)
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+# Tokens a finished request counts against the rate limit (cache reads are not counted)
+def billable_tokens(usage):
+    return usage.get("input_tokens", 0) + usage.get("cache_creation_input_tokens", 0) + usage.get("output_tokens", 0)
+
+
+# Exponential backoff with jitter, or the server's retry-after if that is longer
+def backoff_delay(error, attempt):
+    delay = min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+    retry_after = _retry_after(error)
+    return max(delay, retry_after) if retry_after else delay
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after) if retry_after else None
+    except ValueError:
+        return None
+
+
+# Refills continuously at per_minute / 60 tokens a second, up to one minute's worth.
+# Not thread-safe on its own; the scheduler calls it under its lock.
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # A request larger than the whole bucket is let through once the bucket is full
+    def can_take(self, tokens, now):
+        self._refill(now)
+        return self.level >= min(tokens, self.capacity)
+
+    def take(self, tokens):
+        self.level -= tokens
+
+    def refund(self, tokens):
+        self.level = min(self.capacity, self.level + tokens)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.level >= self.capacity
+
+
+class _Ticket:
+    def __init__(self, key, tokens, priority, seq):
+        self.key = key
+        self.tokens = tokens
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+        # Actual tokens used, when known; the unused part of the estimate is refunded
+        self.used = None
+
+
+# Process-wide queue in front of the API. A request waits for a concurrency slot
+# and for room in the global and per-conversation token buckets. Within a lane,
+# conversations take turns (round-robin), so one conversation with many queued
+# requests does not hold up the others.
+class LLMScheduler:
+    def __init__(self, max_concurrency, tokens_per_minute, session_tokens_per_minute, queue_timeout):
+        self.max_concurrency = max_concurrency
+        self.session_tokens_per_minute = session_tokens_per_minute
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        # Per lane: waiting tickets by key, and the order in which keys take turns
+        self._queues = ({}, {})
+        self._rotation = (deque(), deque())
+        self._running = 0
+        self._seq = 0
+        self._paused_until = 0.0
+        self._global_bucket = TokenBucket(tokens_per_minute)
+        self._session_buckets = {}
+        self.stats = {"granted": 0, "timeouts": 0, "rate_limited": 0, "peak_waiting": 0}
+
+    def _session_bucket(self, key, now):
+        bucket = self._session_buckets.get(key)
+        if bucket is None:
+            # Forget conversations whose buckets have refilled completely
+            if len(self._session_buckets) >= 1000:
+                for idle_key in [k for k, b in self._session_buckets.items() if b.is_full(now)]:
+                    del self._session_buckets[idle_key]
+            bucket = self._session_buckets[key] = TokenBucket(self.session_tokens_per_minute)
+        return bucket
+
+    def _waiting(self):
+        return sum(len(tickets) for queues in self._queues for tickets in queues.values())
+
+    def _enqueue(self, ticket):
+        queues = self._queues[ticket.priority]
+        if ticket.key not in queues:
+            queues[ticket.key] = deque()
+            self._rotation[ticket.priority].append(ticket.key)
+        queues[ticket.key].append(ticket)
+        self.stats["peak_waiting"] = max(self.stats["peak_waiting"], self._waiting())
+
+    def _remove(self, ticket):
+        queues = self._queues[ticket.priority]
+        queues[ticket.key].remove(ticket)
+        if not queues[ticket.key]:
+            del queues[ticket.key]
+            self._rotation[ticket.priority].remove(ticket.key)
+
+    # Grant as many waiting tickets as the limits allow. Background work only
+    # runs when no student request is able to.
+    def _dispatch(self, now):
+        if now < self._paused_until:
+            return
+        for priority in (INTERACTIVE, BACKGROUND):
+            queues, rotation = self._queues[priority], self._rotation[priority]
+            skipped = 0
+            while rotation and skipped < len(rotation):
+                if self._running >= self.max_concurrency:
+                    return
+                key = rotation[0]
+                ticket = queues[key][0]
+                # Everyone waits for the global bucket, so background work can't jump ahead
+                if not self._global_bucket.can_take(ticket.tokens, now):
+                    return
+                session_bucket = self._session_bucket(key, now) if priority == INTERACTIVE else None
+                if session_bucket is not None and not session_bucket.can_take(ticket.tokens, now):
+                    # This conversation is over its own limit; let the next one go
+                    rotation.rotate(-1)
+                    skipped += 1
+                    continue
+                queues[key].popleft()
+                rotation.popleft()
+                if queues[key]:
+                    rotation.append(key)
+                else:
+                    del queues[key]
+                self._global_bucket.take(ticket.tokens)
+                if session_bucket is not None:
+                    session_bucket.take(ticket.tokens)
+                ticket.granted = True
+                self._running += 1
+                self.stats["granted"] += 1
+                skipped = 0
+
+    # Take a ticket that will not be used out of the queue, or give back its
+    # slot and tokens if it was granted in the meantime
+    def _cancel(self, ticket):
+        with self._cond:
+            if not ticket.granted:
+                self._remove(ticket)
+                return
+            self._running -= 1
+            self._global_bucket.refund(ticket.tokens)
+            if ticket.priority == INTERACTIVE:
+                self._session_bucket(ticket.key, time.monotonic()).refund(ticket.tokens)
+            self._cond.notify_all()
+
+    # Requests ahead of this ticket: earlier ones in its lane plus any student requests
+    def _position(self, ticket):
+        ahead = 0
+        for priority in range(ticket.priority + 1):
+            for tickets in self._queues[priority].values():
+                ahead += sum(1 for t in tickets if priority < ticket.priority or t.seq < ticket.seq)
+        return ahead
+
+    # Hold a slot for one request. `tokens` is the estimated cost; set ticket.used
+    # to the actual cost to refund the difference. on_wait(ahead) is called from
+    # the waiting thread whenever the number of requests ahead changes.
+    # Raises SchedulerBusy if no slot frees up within the queue timeout.
+    @contextmanager
+    def slot(self, key, tokens, priority=INTERACTIVE, on_wait=None, timeout=None):
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        start = time.monotonic()
+        last_position = None
+        with self._cond:
+            self._seq += 1
+            ticket = _Ticket(key, tokens, priority, self._seq)
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._cond:
+                    self._dispatch(time.monotonic())
+                    if ticket.granted:
+                        break
+                    if time.monotonic() >= deadline:
+                        self.stats["timeouts"] += 1
+                        increment("llm_queue_timeouts")
+                        raise SchedulerBusy("No Claude request slot became free in time.")
+                    position = self._position(ticket)
+                if on_wait is not None and position != last_position:
+                    on_wait(position)
+                    last_position = position
+                with self._cond:
+                    if not ticket.granted:
+                        # Woken on every release; the timeout covers token buckets refilling
+                        self._cond.wait(timeout=0.25)
+        except BaseException:
+            # Timed out, or the caller gave up (on_wait may raise Streamlit's
+            # rerun/stop exceptions): never leave the ticket behind
+            self._cancel(ticket)
+            raise
+        observe("llm_queue_wait_seconds", time.monotonic() - start, lane="interactive" if priority == INTERACTIVE else "background")
+        try:
+            yield ticket
+        finally:
+            with self._cond:
+                self._running -= 1
+                if ticket.used is not None and ticket.used < ticket.tokens:
+                    unused = ticket.tokens - ticket.used
+                    self._global_bucket.refund(unused)
+                    if priority == INTERACTIVE:
+                        self._session_bucket(key, time.monotonic()).refund(unused)
+                self._cond.notify_all()
+
+    # On a 429, hold back every request for as long as the API asked
+    def _note_error(self, error):
+        if isinstance(error, anthropic.RateLimitError):
+            increment("llm_rate_limited")
+            retry_after = _retry_after(error)
+            with self._cond:
+                self.stats["rate_limited"] += 1
+                if retry_after:
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    # Run fn() in a slot. Errors are re-raised; retries are up to the caller.
+    # usage_tokens() gives the actual cost once fn() has returned.
+    def call(self, fn, key, tokens, priority=INTERACTIVE, usage_tokens=None, on_wait=None):
+        with self.slot(key, tokens, priority, on_wait) as ticket:
+            try:
+                result = fn()
+            except RETRYABLE_API_ERRORS as e:
+                self._note_error(e)
+                raise
+            if usage_tokens is not None:
+                ticket.used = usage_tokens()
+            return result
+
+    # Yield from make_stream() in a slot. A request that fails before any text
+    # arrived is retried with jittered backoff, outside the slot.
+    # usage_tokens() gives the actual cost once the stream is done.
+    def stream(self, make_stream, key, tokens, usage_tokens=None, on_wait=None, max_retries=None):
+        if max_retries is None:
+            max_retries = get_setting("LLM_MAX_RETRIES", DEFAULT_LLM_MAX_RETRIES, int)
+        for attempt in range(max_retries + 1):
+            started = False
+            try:
+                with self.slot(key, tokens, INTERACTIVE, on_wait) as ticket:
+                    try:
+                        for text in make_stream():
+                            started = True
+                            yield text
+                    finally:
+                        if usage_tokens is not None:
+                            ticket.used = usage_tokens()
+                return
+            except RETRYABLE_API_ERRORS as e:
+                self._note_error(e)
+                if started or attempt == max_retries:
+                    raise
+                delay = backoff_delay(e, attempt)
+                logging.warning(f"Anthropic API error (attempt {attempt + 1}), retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def size(self):
+        with self._cond:
+            return {
+                "running": self._running,
+                "waiting": self._waiting(),
+                "max_concurrency": self.max_concurrency,
+                "paused": time.monotonic() < self._paused_until,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# The scheduler shared by every session in this process
+def get_llm_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(
+                max_concurrency=get_setting("LLM_MAX_CONCURRENCY", DEFAULT_LLM_MAX_CONCURRENCY, int),
+                tokens_per_minute=get_setting("LLM_TOKENS_PER_MINUTE", DEFAULT_LLM_TOKENS_PER_MINUTE, int),
+                session_tokens_per_minute=get_setting("LLM_SESSION_TOKENS_PER_MINUTE", DEFAULT_LLM_SESSION_TOKENS_PER_MINUTE, int),
+                queue_timeout=get_setting("LLM_QUEUE_TIMEOUT", DEFAULT_LLM_QUEUE_TIMEOUT, float),
+            )
+        return _scheduler
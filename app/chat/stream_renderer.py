@@ -0,0 +1,59 @@
+# for rendering streamed assistant output without re-sending markdown on every chunk
+import time
+
+from app.config.settings import get_setting
+
+# At most this many re-renders per second while streaming
+DEFAULT_STREAM_MAX_FPS = 10.0
+# ...unless this much new text has piled up since the last frame
+DEFAULT_STREAM_FLUSH_BYTES = 2048
+
+
+# Buffers chunks in a list and updates a Streamlit placeholder at a capped
+# frame rate. finish() renders the complete text exactly once.
+class StreamRenderer:
+    def __init__(self, placeholder, max_fps=None, flush_bytes=None, cursor="▌"):
+        if max_fps is None:
+            max_fps = get_setting("STREAM_MAX_FPS", DEFAULT_STREAM_MAX_FPS, float)
+        if flush_bytes is None:
+            flush_bytes = get_setting("STREAM_FLUSH_BYTES", DEFAULT_STREAM_FLUSH_BYTES, int)
+        self.placeholder = placeholder
+        self.frame_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.flush_bytes = flush_bytes
+        self.cursor = cursor
+        self.frames = 0
+        self._chunks = []
+        self._pending_bytes = 0
+        # The first chunk is shown straight away so time-to-first-token isn't delayed
+        self._last_frame = float("-inf")
+        self._finished = False
+
+    def write(self, text):
+        if not text:
+            return
+        self._chunks.append(text)
+        self._pending_bytes += len(text)
+        now = time.monotonic()
+        if now - self._last_frame >= self.frame_interval or self._pending_bytes >= self.flush_bytes:
+            self._render(self.text + self.cursor)
+            self._last_frame = now
+            self._pending_bytes = 0
+
+    # Everything written so far; joins the buffer once and keeps the result
+    @property
+    def text(self):
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    # Render the final text (without the cursor) and return it; safe to call twice
+    def finish(self):
+        text = self.text
+        if not self._finished:
+            self._finished = True
+            self._render(text)
+        return text
+
+    def _render(self, text):
+        self.placeholder.markdown(text)
+        self.frames += 1
@@ -1,36 +1,49 @@
 import csv
-import io
+import gzip
 import logging
+import os
+import sys
+import tempfile
+import threading
+import time
 import uuid
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import date, datetime, timedelta
 from zoneinfo import ZoneInfo
 
-import streamlit as st
-import psycopg2
-import anthropic
+from app.chat.generation import get_claude_client
+from app.chatlog.chatlog_writer import get_chatlog_writer
+from app.chatlog.summarizer import new_token_budget, reduce_summaries, summarize_conversation
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+from app.metrics.tracing import increment, observe
 
 # Configure logging to output INFO level messages.
 logging.basicConfig(level=logging.INFO)
 
-# Establish a connection to the database using Streamlit Secrets
-def connect_to_db():
-    neon_db_link = st.secrets.get("NEON_DB_LINK")
-    if not neon_db_link:
-        logging.error("NEON_DB_LINK not found in Streamlit secrets.")
-        return None
-    try:
-        conn = psycopg2.connect(neon_db_link)
-        return conn
-    except Exception as e:
-        logging.error(f"Failed to connect to the database: {e}")
-        return None
+# Rows fetched per round trip when streaming chat logs out of the database
+EXPORT_BATCH_SIZE = 2000
 
-# Insert a chat log into the database
-def insert_chat_log(prompt, response, conversation_id):
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return
+# Results per page in the admin chat log search
+SEARCH_PAGE_SIZE = 20
+
+# Searched document; must match the expression of the chat_logs_search_idx index
+SEARCH_DOCUMENT = "to_tsvector('english', coalesce(prompt, '') || ' ' || coalesce(response, ''))"
+
+# Monthly chat_logs partitions kept ready ahead of the current month
+DEFAULT_PARTITION_MONTHS_AHEAD = 3
+
+# Summarization defaults: parallel API calls, overall time limit (seconds) and retries per call
+DEFAULT_SUMMARY_MAX_WORKERS = 8
+DEFAULT_SUMMARY_DEADLINE = 120.0
+DEFAULT_SUMMARY_MAX_RETRIES = 4
+
+# Insert a chat log into the database.
+# The row is queued for the background writer, which inserts in batches,
+# so this returns immediately instead of waiting on the database.
+# cache_hit marks answers served from the response cache.
+def insert_chat_log(prompt, response, conversation_id, cache_hit=False):
     # If no conversation_id is provided, create a new one.
     if not conversation_id:
         conversation_id = str(uuid.uuid4())
@@ -42,183 +55,390 @@ def insert_chat_log(prompt, response, conversation_id):
     except Exception as e:
         logging.error(f"Invalid conversation_id format '{conversation_id}': {e}")
         conversation_uuid = str(uuid.uuid4())
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO chat_logs (prompt, response, timestamp, conversation_id)
-                VALUES (%s, %s, %s, %s)
-                """,
-                (prompt, response, now_in_sgt, conversation_uuid)
-            )
-            conn.commit()
-            logging.info("Chat log inserted successfully.")
-    except Exception as e:
-        logging.error(f"Error inserting chat log: {e}")
-    finally:
-        if conn:
-            conn.close()
-
-# Initialize the chat logs table
-def initialize_chatlog_table():
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
+    _maybe_roll_partitions(now_in_sgt)
+    get_chatlog_writer().enqueue((prompt, response, now_in_sgt, conversation_uuid, cache_hit))
+
+# Month for which partitions were last ensured by this process
+_partitions_ensured_month = None
+
+# When the month changes in a long-running process, create the next partitions
+# in the background so inserts never wait on DDL.
+def _maybe_roll_partitions(now):
+    global _partitions_ensured_month
+    month = (now.year, now.month)
+    if _partitions_ensured_month == month or not get_setting("CHATLOG_PARTITIONING", False, bool):
         return
+    _partitions_ensured_month = month
+    threading.Thread(target=ensure_chatlog_partitions, name="chatlog-partitions", daemon=True).start()
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS chat_logs (
-                    id SERIAL PRIMARY KEY,
-                    timestamp TIMESTAMP DEFAULT current_timestamp,
-                    prompt TEXT,
-                    response TEXT,
-                    conversation_id UUID
-                );
-                """
-            )
+# Whether chat_logs is a partitioned table
+def is_chatlog_partitioned(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('chat_logs')")
+    row = cur.fetchone()
+    return bool(row) and row[0] == "p"
+
+# First day of the month that is `offset` months after the month of `day`
+def _month_start(day, offset=0):
+    month_index = day.year * 12 + day.month - 1 + offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+# Create one monthly partition. Rows for that month already caught by the default
+# partition would make CREATE ... PARTITION OF fail, so they are moved first:
+# detach the default, create the month, move its rows over, reattach the default.
+def _create_month_partition(cur, start, end):
+    name = f"chat_logs_y{start:%Y}m{start:%m}"
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL, to_regclass('chat_logs_default') IS NOT NULL", (name,))
+    exists, has_default = cur.fetchone()
+    if exists:
+        return
+    conflicting = False
+    if has_default:
+        cur.execute('SELECT EXISTS (SELECT 1 FROM chat_logs_default WHERE "timestamp" >= %s AND "timestamp" < %s)', (start, end))
+        conflicting = cur.fetchone()[0]
+    if not conflicting:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF chat_logs FOR VALUES FROM (%s) TO (%s);", (start, end))
+        return
+    # Generated columns are recomputed on insert and can't be copied
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'chat_logs' AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """)
+    columns = ", ".join(f'"{row[0]}"' for row in cur.fetchall())
+    cur.execute("ALTER TABLE chat_logs DETACH PARTITION chat_logs_default;")
+    cur.execute(f"CREATE TABLE {name} PARTITION OF chat_logs FOR VALUES FROM (%s) TO (%s);", (start, end))
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM chat_logs_default WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING {columns}
+        )
+        INSERT INTO chat_logs ({columns}) SELECT {columns} FROM moved;
+        """,
+        (start, end),
+    )
+    moved = cur.rowcount
+    cur.execute("ALTER TABLE chat_logs ATTACH PARTITION chat_logs_default DEFAULT;")
+    logging.info(f"Moved {moved} chat log(s) from the default partition into {name}.")
+
+# Create monthly partitions from the current month up to months_ahead months
+# into the future. Safe to call repeatedly; existing partitions are skipped.
+# Each month runs in its own savepoint, so one failing month doesn't stop the
+# others; with commit_each every month is also committed (and its locks freed) on its own.
+def create_chatlog_partitions(cur, months_ahead, commit_each=False):
+    today = datetime.now(ZoneInfo("Asia/Singapore")).date()
+    created = 0
+    for offset in range(months_ahead + 1):
+        start = _month_start(today, offset)
+        cur.execute("SAVEPOINT chatlog_partition;")
+        try:
+            _create_month_partition(cur, start, _month_start(today, offset + 1))
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT chatlog_partition;")
+            logging.error(f"Error creating chatlog partition for {start:%Y-%m}: {e}")
+            continue
+        cur.execute("RELEASE SAVEPOINT chatlog_partition;")
+        if commit_each:
+            cur.connection.commit()
+        created += 1
+    logging.info(f"Chatlog partitions ensured for {created} of {months_ahead + 1} months "
+                 f"through {_month_start(today, months_ahead):%Y-%m}.")
+    return created == months_ahead + 1
+
+# Partition maintenance on its own connection; a no-op for an unpartitioned table
+def ensure_chatlog_partitions(months_ahead=None):
+    if months_ahead is None:
+        months_ahead = get_setting("CHATLOG_PARTITION_MONTHS_AHEAD", DEFAULT_PARTITION_MONTHS_AHEAD, int)
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
+        try:
+            with conn.cursor() as cur:
+                if not is_chatlog_partitioned(cur):
+                    logging.info("chat_logs is not partitioned; skipping partition maintenance.")
+                    return
+                create_chatlog_partitions(cur, months_ahead, commit_each=True)
             conn.commit()
-            logging.info("Chatlog table (re)created successfully.")
-    except Exception as e:
-        logging.error(f"Error (re)creating chatlog table: {e}")
-    finally:
-        if conn:
-            conn.close()
+        except Exception as e:
+            logging.error(f"Error creating chatlog partitions: {e}")
 
 # Fetch all chat logs from the database
 def fetch_chat_logs():
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database for fetching logs.")
-        return []
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute("SELECT * FROM chat_logs")
-            chat_logs = cur.fetchall()
-            logging.info(f"Fetched {len(chat_logs)} chat log records.")
-            return chat_logs
-    except Exception as e:
-        logging.error(f"Error fetching chat logs: {e}")
-        return []
-    finally:
-        if conn:
-            conn.close()
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database for fetching logs.")
+            return []
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("SELECT id, timestamp, prompt, response, conversation_id FROM chat_logs ORDER BY id")
+                chat_logs = cur.fetchall()
+                logging.info(f"Fetched {len(chat_logs)} chat log records.")
+                return chat_logs
+        except Exception as e:
+            logging.error(f"Error fetching chat logs: {e}")
+            return []
 
 # Batch chat logs by conversation ID
 def fetch_and_batch_chatlogs():
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database for fetching logs.")
-        return {}
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database for fetching logs.")
+            return {}
 
+        try:
+            with conn, conn.cursor() as cur:
+                # Walks the (conversation_id, id) index, so each conversation comes back in order
+                cur.execute("SELECT conversation_id, prompt, response FROM chat_logs ORDER BY conversation_id, id")
+                chat_logs = cur.fetchall()
+                batches = {}
+                for log in chat_logs:
+                    # Rename the variable to avoid shadowing the uuid module.
+                    conv_id = str(log[0])
+                    if conv_id not in batches:
+                        batches[conv_id] = []
+                    # Combine prompt and response (you might add a separator if desired)
+                    batches[conv_id].append(log[1] + " " + log[2])
+                return batches
+        except Exception as e:
+            logging.error(f"Error fetching and batching chat logs: {e}")
+            return {}
+
+# Build the WHERE clause shared by the export and other filtered reads.
+# end_date is inclusive: everything logged on that day is included.
+def _chat_log_filters(start_date=None, end_date=None, conversation_id=None):
+    clauses = []
+    params = []
+    if start_date:
+        clauses.append("timestamp >= %s")
+        params.append(start_date)
+    if end_date:
+        clauses.append("timestamp < %s")
+        params.append(end_date + timedelta(days=1))
+    if conversation_id:
+        clauses.append("conversation_id = %s")
+        params.append(str(uuid.UUID(str(conversation_id))))
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+# Stream chat log rows from a named (server-side) cursor, batch_size rows at a time,
+# so only one batch is ever held in memory.
+def iter_chat_logs(start_date=None, end_date=None, conversation_id=None, batch_size=EXPORT_BATCH_SIZE):
+    where, params = _chat_log_filters(start_date, end_date, conversation_id)
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database for fetching logs.")
+            return
+        with conn.cursor(name=f"chat_log_export_{uuid.uuid4().hex}") as cur:
+            cur.itersize = batch_size
+            cur.execute(
+                "SELECT id, timestamp, prompt, response, conversation_id, cache_hit FROM chat_logs"
+                + where + " ORDER BY timestamp, id",
+                params,
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        conn.rollback()
+
+# One page of chat logs, newest first, optionally matching a full-text query
+# (web-search syntax: "quoted phrases", or, -exclude). Pages are addressed by
+# keyset: pass the previous page's next_cursor, a (timestamp, id) pair, as
+# `after` instead of an offset, so deep pages cost the same as the first one.
+# Returns {"rows": [...], "next_cursor": cursor or None}, or None on error.
+def search_chat_logs(query=None, start_date=None, end_date=None, conversation_id=None, after=None, page_size=SEARCH_PAGE_SIZE):
     try:
-        with conn, conn.cursor() as cur:
-            cur.execute("SELECT conversation_id, prompt, response FROM chat_logs")
-            chat_logs = cur.fetchall()
-            batches = {}
-            for log in chat_logs:
-                # Rename the variable to avoid shadowing the uuid module.
-                conv_id = str(log[0])
-                if conv_id not in batches:
-                    batches[conv_id] = []
-                # Combine prompt and response (you might add a separator if desired)
-                batches[conv_id].append(log[1] + " " + log[2])
-            return batches
-    except Exception as e:
-        logging.error(f"Error fetching and batching chat logs: {e}")
-        return {}
-    finally:
-        if conn:
-            conn.close()
+        where, params = _chat_log_filters(start_date, end_date, conversation_id)
+    except ValueError:
+        logging.error(f"Invalid conversation id for chat log search: {conversation_id}")
+        return None
+    clauses = [where[len(" WHERE "):]] if where else []
+    query = (query or "").strip()
+    if query:
+        clauses.append(SEARCH_DOCUMENT + " @@ websearch_to_tsquery('english', %s)")
+        params.append(query)
+    if after:
+        clauses.append("(timestamp, id) < (%s, %s)")
+        params.extend(after)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    # Highlighting is expensive, so it only runs on the rows of this page
+    if query:
+        snippets = """
+            ts_headline('english', coalesce(prompt, ''), websearch_to_tsquery('english', %s), %s),
+            ts_headline('english', coalesce(response, ''), websearch_to_tsquery('english', %s), %s)"""
+        highlight = "StartSel=**, StopSel=**, MaxWords=25, MinWords=8, MaxFragments=2"
+        snippet_params = [query, highlight, query, highlight]
+    else:
+        snippets = "left(prompt, 200), left(response, 200)"
+        snippet_params = []
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database for searching logs.")
+            return None
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(
+                    "SELECT id, timestamp, conversation_id, " + snippets + " FROM ("
+                    "SELECT id, timestamp, conversation_id, prompt, response FROM chat_logs"
+                    + where + " ORDER BY timestamp DESC, id DESC LIMIT %s"
+                    ") page ORDER BY timestamp DESC, id DESC",
+                    snippet_params + params + [page_size + 1],
+                )
+                rows = cur.fetchall()
+        except Exception as e:
+            logging.error(f"Error searching chat logs: {e}")
+            return None
+    # The extra row only tells whether another page exists
+    next_cursor = (rows[page_size - 1][1], rows[page_size - 1][0]) if len(rows) > page_size else None
+    return {
+        "rows": [
+            {"id": log_id, "timestamp": timestamp, "conversation_id": str(conv_id) if conv_id else None,
+             "prompt": prompt, "response": response}
+            for log_id, timestamp, conv_id, prompt, response in rows[:page_size]
+        ],
+        "next_cursor": next_cursor,
+    }
 
-# Export chat logs to CSV
-def export_chat_logs_to_csv(filename='chat_logs.csv'):
-    chat_logs = fetch_chat_logs()
-    if not chat_logs:
+# Export chat logs to a CSV file, optionally gzip-compressed.
+# Rows are streamed straight from the database into the file, so memory use
+# does not grow with the size of the table. Returns the file path, or None
+# if there was nothing to export.
+def export_chat_logs_to_csv(path=None, start_date=None, end_date=None, conversation_id=None, compress=False):
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="chat_logs_", suffix=".csv.gz" if compress else ".csv")
+        os.close(fd)
+    row_count = 0
+    try:
+        if compress:
+            output = gzip.open(path, "wt", encoding="utf-8-sig", newline="")
+        else:
+            output = open(path, "w", encoding="utf-8-sig", newline="")
+        with output:
+            writer = csv.writer(output)
+            # Write headers matching the database columns.
+            writer.writerow(['ID', 'Timestamp', 'Prompt', 'Response', 'ConversationID', 'CacheHit'])
+            for log in iter_chat_logs(start_date, end_date, conversation_id):
+                writer.writerow(log)
+                row_count += 1
+    except Exception as e:
+        logging.error(f"Error exporting chat logs: {e}")
+        os.remove(path)
+        return None
+    if row_count == 0:
         logging.info("No chat logs to export.")
-        return
-    # Create a CSV in memory with UTF-8 encoding
-    output = io.StringIO()
-    writer = csv.writer(output)
-    # Write headers matching the database columns.
-    writer.writerow(['ID', 'Timestamp', 'Prompt', 'Response', 'ConversationID'])
-    for log in chat_logs:
-        writer.writerow(log)
-    return output.getvalue().encode('utf-8-sig')
+        os.remove(path)
+        return None
+    logging.info(f"Exported {row_count} chat log records to {path}.")
+    return path
 
 # Delete all chat logs
 def delete_all_chatlogs():
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute("DELETE FROM chat_logs")
-            conn.commit()
-            logging.info("All chat logs deleted successfully.")
-    except Exception as e:
-        logging.error(f"Error deleting chat logs: {e}")
-    finally:
-        if conn:
-            conn.close()
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
+        try:
+            with conn, conn.cursor() as cur:
+                # TRUNCATE frees the space at once instead of scanning and marking every row
+                cur.execute("TRUNCATE chat_logs")
+                conn.commit()
+                logging.info("All chat logs deleted successfully.")
+        except Exception as e:
+            logging.error(f"Error deleting chat logs: {e}")
 
 # Drop the chat logs table
 def drop_chatlog_table():
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return
-    try:
-        with conn.cursor() as cur:
-            cur.execute("DROP TABLE IF EXISTS chat_logs;")
-            conn.commit()
-            logging.info("Chatlog table dropped successfully.")
-    except Exception as e:
-        logging.error(f"Error dropping chatlog table: {e}")
-    finally:
-        if conn:
-            conn.close()
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS chat_logs;")
+                conn.commit()
+                logging.info("Chatlog table dropped successfully.")
+        except Exception as e:
+            logging.error(f"Error dropping chatlog table: {e}")
 
-# Generate summaries for chat logs using Anthropics API
-def generate_summary_for_each_group(batches):
+# Generate summaries for chat logs using Anthropics API.
+# Conversations are summarized concurrently (at most max_workers in flight);
+# long ones are chunked and reduced, all within one shared token budget.
+# Whatever has finished when the deadline (in seconds) passes is returned;
+# on_progress(done, total) is called from the calling thread as results arrive.
+# If an errors dict is passed, failures are recorded there instead of in the result.
+# on_result(conv_id, summary, error) is called likewise for each conversation as it
+# finishes, so callers can checkpoint as they go.
+def generate_summary_for_each_group(batches, max_workers=None, deadline=None, on_progress=None, errors=None, budget=None, on_result=None):
     summaries = {}
-    anthropic_api_key = st.secrets.get("ANTHROPIC_API_KEY")
-    if not anthropic_api_key:
-        logging.error("Anthropic API key is missing in secrets.")
+    client = get_claude_client()
+    if client is None:
         return summaries
+    if not batches:
+        return summaries
+    job_start = time.perf_counter()
 
-    client = anthropic.Client(api_key=anthropic_api_key)
-    for idx, (conv_id, logs) in enumerate(batches.items(), start=1):
-        combined_logs = "\n".join(logs)
-        messages = [
-            {"role": "system", "content": "Summarize the following conversation."},
-            {"role": "user", "content": combined_logs}
-        ]
-        try:
-            response = client.completions.create(
-                model="claude-3.5-sonnet",
-                messages=messages,
-                max_tokens_to_sample=300
-            )
-            summaries[conv_id] = response["completion"].strip()
-        except Exception as e:
-            summaries[conv_id] = f"Failed to generate summary: {e}"
+    if max_workers is None:
+        max_workers = get_setting("SUMMARY_MAX_WORKERS", DEFAULT_SUMMARY_MAX_WORKERS, int)
+    if deadline is None:
+        deadline = get_setting("SUMMARY_DEADLINE", DEFAULT_SUMMARY_DEADLINE, float)
+    max_retries = get_setting("SUMMARY_MAX_RETRIES", DEFAULT_SUMMARY_MAX_RETRIES, int)
+    deadline_at = time.monotonic() + deadline
+    if budget is None:
+        budget = new_token_budget()
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summary")
+    futures = {
+        executor.submit(summarize_conversation, client, logs, budget, max_retries, deadline_at): conv_id
+        for conv_id, logs in batches.items()
+    }
+    total = len(futures)
+    try:
+        for future in as_completed(futures, timeout=max(0.0, deadline_at - time.monotonic())):
+            conv_id = futures[future]
+            try:
+                summaries[conv_id] = future.result()
+                if on_result:
+                    on_result(conv_id, summaries[conv_id], None)
+            except Exception as e:
+                if errors is not None:
+                    errors[conv_id] = str(e)
+                else:
+                    summaries[conv_id] = f"Failed to generate summary: {e}"
+                if on_result:
+                    on_result(conv_id, None, str(e))
+            if on_progress:
+                on_progress(len(summaries) + len(errors or {}), total)
+    except FuturesTimeoutError:
+        logging.warning(f"Summary deadline of {deadline}s reached; returning {len(summaries)} of {total} summaries.")
+    finally:
+        # Don't wait for stragglers: queued work is cancelled, running calls finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+        observe("summary_job_seconds", time.perf_counter() - job_start)
+        increment("summary_conversations", len(summaries), outcome="summarized")
+        increment("summary_conversations", total - len(summaries), outcome="missing")
     return summaries
 
-# Compile summaries into a structured output string
-def compile_summaries(summaries):
-    compiled_output = "Top-level summary:\n"
+# Compile summaries into a structured output string, led by a class-level
+# digest that is reduced from the per-group summaries.
+def compile_summaries(summaries, budget=None):
+    digest = "No summaries available."
+    client = get_claude_client() if summaries else None
+    if client is not None:
+        if budget is None:
+            budget = new_token_budget()
+        try:
+            digest = reduce_summaries(client, list(summaries.values()), budget)
+        except Exception as e:
+            logging.error(f"Failed to generate top-level summary: {e}")
+            digest = f"Failed to generate top-level summary: {e}"
+    compiled_output = f"Top-level summary:\n{digest}\n"
     for idx, (conv_id, summary) in enumerate(summaries.items(), start=1):
         compiled_output += f"\nGroup {idx} summary (UUID {conv_id}):\n{summary}\n"
     return compiled_output
 
 # Fetch, summarize, and compile chat logs
 if __name__ == "__main__":
-    batches = fetch_and_batch_chatlogs()
-    group_summaries = generate_summary_for_each_group(batches)
-    final_summary_output = compile_summaries(group_summaries)
-    # For demonstration, print the final summary output
-    print(final_summary_output)
+    # Kept for existing scripts; the job runner checkpoints progress as it goes
+    from app.jobs.job_runner import main
+    sys.exit(main(["enqueue", "--run"]))
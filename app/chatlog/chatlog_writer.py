@@ -0,0 +1,209 @@
+# for writing chat logs in the background, in batches, off the request path
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_SHUTDOWN_TIMEOUT = 10.0
+
+
+# Insert many chat log rows in a single multi-row INSERT and commit.
+# Raises on failure so the writer can retry the whole batch.
+def write_chat_log_batch(records):
+    with pooled_connection() as conn:
+        if conn is None:
+            raise ConnectionError("Failed to connect to the database.")
+        with conn, conn.cursor() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO chat_logs (prompt, response, timestamp, conversation_id, cache_hit) VALUES %s",
+                records,
+                page_size=len(records),
+            )
+    logging.info(f"Inserted {len(records)} chat log(s).")
+
+
+# Process-wide write-behind queue. Records are flushed when batch_size is
+# reached or flush_interval seconds have passed since the first queued record.
+class ChatLogWriter:
+    def __init__(self, write_batch, batch_size, flush_interval, queue_size, max_retries):
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        # Queued records are numbered; flushes wait for a number, not for an empty queue
+        self._cond = threading.Condition()
+        self._seq = 0
+        # Every record up to this number has been written (or given up on)
+        self._done_seq = 0
+        # Highest number a flush is waiting for; the batch holding it is sent right away
+        self._flush_through = 0
+        self._last_seq_by_conversation = {}
+        # seq -> conversation_id of records given up on, until a flush reports them
+        self._dropped = {}
+        self._thread = threading.Thread(target=self._run, name="chatlog-writer", daemon=True)
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "retries": 0, "dropped": 0}
+        self._thread.start()
+
+    # Queue a (prompt, response, timestamp, conversation_id, cache_hit) tuple.
+    # If the queue is full the record is written inline so nothing is lost.
+    def enqueue(self, record):
+        self._count("enqueued")
+        if self._stopping.is_set():
+            self._write_with_retry([record])
+            return
+        with self._cond:
+            try:
+                self._queue.put_nowait((self._seq + 1, record))
+            except queue.Full:
+                full = True
+            else:
+                full = False
+                self._seq += 1
+                self._last_seq_by_conversation[record[3]] = self._seq
+        if full:
+            logging.warning("Chat log queue is full; writing record inline.")
+            self._write_with_retry([record])
+
+    # Block until the records queued before this call (only those of
+    # conversation_id, if given) have been written. Records queued later by
+    # other sessions are not waited for. Returns False on timeout, or if any of
+    # those records were given up on after the last retry; each dropped record
+    # is reported to one flush only.
+    def flush(self, timeout=None, conversation_id=None):
+        with self._cond:
+            if conversation_id is None:
+                target = self._seq
+            else:
+                target = self._last_seq_by_conversation.get(conversation_id, 0)
+            covered = max(target, self._done_seq)
+            if target > self._done_seq:
+                self._flush_through = max(self._flush_through, target)
+                if not self._cond.wait_for(lambda: self._done_seq >= target, timeout):
+                    return False
+            dropped = [seq for seq, conv_id in self._dropped.items()
+                       if seq <= covered and conversation_id in (None, conv_id)]
+            for seq in dropped:
+                del self._dropped[seq]
+        if dropped:
+            logging.error(f"{len(dropped)} chat log(s) were dropped before they could be written.")
+        return not dropped
+
+    # Stop accepting background work and drain the queue
+    def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Chat log writer did not drain within {timeout}s; "
+                          f"{self._queue.qsize()} record(s) left unwritten.")
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                written = self._write_with_retry([record for _, record in batch])
+                for _ in batch:
+                    self._queue.task_done()
+                self._mark_done(batch[-1][0], dropped=() if written else batch)
+            elif self._stopping.is_set():
+                return
+
+    def _mark_done(self, seq, dropped=()):
+        with self._cond:
+            self._done_seq = seq
+            for dropped_seq, record in dropped:
+                self._dropped[dropped_seq] = record[3]
+            for conversation_id in [c for c, s in self._last_seq_by_conversation.items() if s <= seq]:
+                del self._last_seq_by_conversation[conversation_id]
+            self._cond.notify_all()
+
+    # Stats are updated from request threads (enqueue, inline writes) and the writer thread
+    def _count(self, name, n=1):
+        with self._cond:
+            self.stats[name] += n
+
+    # Wait for the first record, then keep taking records until the batch
+    # is full or the flush interval since that first record has elapsed.
+    # A batch holding a record someone is flushing for is sent right away.
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=0.2)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if self._stopping.is_set() or batch[-1][0] <= self._flush_through:
+                remaining = 0
+            try:
+                # Short waits, so a flush requested meanwhile is noticed
+                batch.append(self._queue.get(timeout=min(remaining, 0.05)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                if remaining <= 0.05:
+                    break
+        return batch
+
+    def _write_with_retry(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write_batch(batch)
+                self._count("written", len(batch))
+                self._count("batches")
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self._count("dropped", len(batch))
+                    logging.error(f"Giving up on {len(batch)} chat log(s) after {attempt + 1} attempts: {e}")
+                    return False
+                self._count("retries")
+                # Exponential backoff with jitter, capped at 30 seconds
+                delay = min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+                logging.warning(f"Error inserting chat logs (attempt {attempt + 1}), retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+        return False
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+# The shared writer, started on first use and drained at interpreter exit
+def get_chatlog_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ChatLogWriter(
+                    write_chat_log_batch,
+                    batch_size=get_setting("CHATLOG_BATCH_SIZE", DEFAULT_BATCH_SIZE, int),
+                    flush_interval=get_setting("CHATLOG_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL, float),
+                    queue_size=get_setting("CHATLOG_QUEUE_SIZE", DEFAULT_QUEUE_SIZE, int),
+                    max_retries=get_setting("CHATLOG_MAX_RETRIES", DEFAULT_MAX_RETRIES, int),
+                )
+                atexit.register(_writer.shutdown)
+    return _writer
+
+
+# Wait for queued chat logs (only one conversation's, if given) to reach the
+# database, e.g. before reading them back. False if they did not all get there.
+def flush_chat_logs(timeout=None, conversation_id=None):
+    if _writer is None:
+        return True
+    return _writer.flush(timeout, conversation_id)
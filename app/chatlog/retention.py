@@ -0,0 +1,218 @@
+# for the chat log retention policy: archive expired rows to compressed files, then delete them
+#
+# Usage from the repository root:
+#   python -m app.chatlog.retention                  archive and delete logs older than CHATLOG_RETENTION_DAYS
+#   python -m app.chatlog.retention --keep-days 30   use a different policy for this run
+#   python -m app.chatlog.retention --dry-run        only report what would be removed
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from app.chatlog.chatlog_handler import is_chatlog_partitioned, iter_chat_logs
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_ARCHIVE_DIR = "chatlog_archive"
+# Rows per DELETE transaction; small enough that locks and WAL per batch stay short
+DEFAULT_DELETE_BATCH_SIZE = 5000
+# Pause between delete batches so replicas and autovacuum can keep up
+DEFAULT_DELETE_BATCH_PAUSE = 0.05
+
+PARTITION_NAME = re.compile(r"^chat_logs_y(\d{4})m(\d{2})$")
+
+
+# First day that is kept: everything logged before it has expired
+def retention_cutoff(keep_days):
+    return datetime.now(ZoneInfo("Asia/Singapore")).date() - timedelta(days=keep_days)
+
+
+# Start the new version of a monthly archive in a temp file: copy over what the
+# archive already holds and return the ids it covers, so reruns skip them
+def _open_month_archive(path):
+    output = gzip.open(path + ".tmp", "wt", encoding="utf-8")
+    archived = set()
+    if os.path.exists(path):
+        with gzip.open(path, "rt", encoding="utf-8") as existing:
+            for line in existing:
+                archived.add(json.loads(line)["id"])
+                output.write(line)
+    return output, archived
+
+
+# Stream expired rows into one gzip JSONL file per month, e.g. chat_logs_2024-05.jsonl.gz.
+# Each month is rebuilt in a temp file that replaces the archive only once every
+# row has been written, and rows already in the archive are not written again,
+# so a rerun after a failed run never duplicates or truncates it.
+# Returns (expired rows now in the archive, file paths).
+def archive_expired_chat_logs(cutoff, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    files = {}
+    row_count = 0
+    try:
+        # end_date is inclusive, so this selects timestamp < cutoff
+        for log_id, timestamp, prompt, response, conv_id, cache_hit in iter_chat_logs(end_date=cutoff - timedelta(days=1)):
+            month = f"{timestamp:%Y-%m}"
+            if month not in files:
+                path = os.path.join(archive_dir, f"chat_logs_{month}.jsonl.gz")
+                files[month] = (path, *_open_month_archive(path))
+            path, output, archived = files[month]
+            row_count += 1
+            if log_id in archived:
+                continue
+            record = {
+                "id": log_id,
+                "timestamp": timestamp.isoformat(),
+                "prompt": prompt,
+                "response": response,
+                "conversation_id": str(conv_id) if conv_id else None,
+                "cache_hit": cache_hit,
+            }
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except BaseException:
+        for path, output, _ in files.values():
+            output.close()
+            os.remove(path + ".tmp")
+        raise
+    for path, output, _ in files.values():
+        output.close()
+        os.replace(path + ".tmp", path)
+    return row_count, [path for path, _, _ in files.values()]
+
+
+# Monthly partitions (named by create_chatlog_partitions) that lie entirely before the cutoff
+def _expired_partitions(cur, cutoff):
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'chat_logs'::regclass
+    """)
+    expired = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            year, month = int(match.group(1)), int(match.group(2))
+            partition_end = date(year + month // 12, month % 12 + 1, 1)
+            if partition_end <= cutoff:
+                expired.append(name)
+    return sorted(expired)
+
+
+# Detach and drop whole expired partitions; much cheaper than deleting their rows
+def drop_expired_partitions(cutoff):
+    dropped = []
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return dropped
+        with conn.cursor() as cur:
+            if not is_chatlog_partitioned(cur):
+                conn.rollback()
+                return dropped
+            partitions = _expired_partitions(cur, cutoff)
+        conn.rollback()
+        for name in partitions:
+            with conn, conn.cursor() as cur:
+                cur.execute(f"ALTER TABLE chat_logs DETACH PARTITION {name}")
+                cur.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+            logging.info(f"Dropped expired chat log partition {name}.")
+    return dropped
+
+
+# Delete the remaining expired rows in id ranges of batch_size, one short
+# transaction per range, instead of one long DELETE. Returns rows deleted.
+def delete_expired_chat_logs(cutoff, batch_size=None, pause=None):
+    if batch_size is None:
+        batch_size = get_setting("CHATLOG_RETENTION_BATCH_SIZE", DEFAULT_DELETE_BATCH_SIZE, int)
+    if pause is None:
+        pause = get_setting("CHATLOG_RETENTION_BATCH_PAUSE", DEFAULT_DELETE_BATCH_PAUSE, float)
+    deleted = 0
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return deleted
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT min(id), max(id) FROM chat_logs WHERE timestamp < %s", (cutoff,))
+            low, high = cur.fetchone()
+        if low is None:
+            return deleted
+        for start in range(low, high + 1, batch_size):
+            with conn, conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM chat_logs WHERE id >= %s AND id < %s AND timestamp < %s",
+                    (start, start + batch_size, cutoff),
+                )
+                deleted += cur.rowcount
+            time.sleep(pause)
+    logging.info(f"Deleted {deleted} expired chat logs.")
+    return deleted
+
+
+def count_expired_chat_logs(cutoff):
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return None
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM chat_logs WHERE timestamp < %s", (cutoff,))
+            return cur.fetchone()[0]
+
+
+# Apply the retention policy: archive (unless archive=False), then delete.
+# Nothing is deleted if archiving fails. Returns a summary dict, or None on error.
+def apply_retention(keep_days=None, archive_dir=None, archive=True, dry_run=False):
+    if keep_days is None:
+        keep_days = get_setting("CHATLOG_RETENTION_DAYS", DEFAULT_RETENTION_DAYS, int)
+    if archive_dir is None:
+        archive_dir = get_setting("CHATLOG_ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)
+    cutoff = retention_cutoff(keep_days)
+    result = {"cutoff": cutoff, "expired": None, "archived": 0, "files": [], "partitions_dropped": [], "deleted": 0}
+    try:
+        result["expired"] = count_expired_chat_logs(cutoff)
+        if result["expired"] is None:
+            return None
+        if dry_run or not result["expired"]:
+            return result
+        if archive:
+            result["archived"], result["files"] = archive_expired_chat_logs(cutoff, archive_dir)
+            if result["archived"] < result["expired"]:
+                logging.error(f"Only {result['archived']} of {result['expired']} expired chat logs were archived; nothing deleted.")
+                return None
+        result["partitions_dropped"] = drop_expired_partitions(cutoff)
+        result["deleted"] = delete_expired_chat_logs(cutoff)
+    except Exception as e:
+        logging.error(f"Error applying chat log retention: {e}")
+        return None
+    logging.info(f"Chat log retention applied: {result}")
+    return result
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Archive and delete expired CherGPT chat logs.")
+    parser.add_argument("--keep-days", type=int, help="days of chat logs to keep (default: CHATLOG_RETENTION_DAYS)")
+    parser.add_argument("--archive-dir", help="where monthly archives are written (default: CHATLOG_ARCHIVE_DIR)")
+    parser.add_argument("--no-archive", action="store_true", help="delete without archiving")
+    parser.add_argument("--dry-run", action="store_true", help="only count the expired chat logs")
+    args = parser.parse_args(argv)
+
+    result = apply_retention(args.keep_days, args.archive_dir, archive=not args.no_archive, dry_run=args.dry_run)
+    if result is None:
+        return 1
+    print(f"Chat logs before {result['cutoff']}: {result['expired']} expired")
+    if not args.dry_run:
+        print(f"Archived {result['archived']} to {', '.join(result['files']) or '-'}")
+        print(f"Dropped partitions: {', '.join(result['partitions_dropped']) or '-'}; deleted {result['deleted']} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+# for token-budgeted, hierarchical (map-reduce) summarization of chat logs
+import logging
+import math
+import re
+import threading
+import time
+
+from app.chat.generation import complete
+from app.chat.scheduler import BACKGROUND, RETRYABLE_API_ERRORS, backoff_delay, billable_tokens, get_llm_scheduler
+from app.config.settings import get_setting
+
+# Largest prompt (in estimated tokens) sent in a single summarization request
+DEFAULT_SUMMARY_CHUNK_TOKENS = 6000
+# max_tokens for every summarization request
+DEFAULT_SUMMARY_OUTPUT_TOKENS = 300
+# Total tokens (input estimate + output allowance) one summary job may spend
+DEFAULT_SUMMARY_TOKEN_BUDGET = 500000
+# Safety net on the number of reduce rounds
+MAX_REDUCE_ROUNDS = 10
+
+CONVERSATION_INSTRUCTION = "Summarize the following conversation."
+CHUNK_INSTRUCTION = "Summarize this part of a longer conversation between a student and a teaching assistant."
+REDUCE_INSTRUCTION = ("Combine these summaries of student conversations into one digest for the teacher: "
+                      "common topics, misconceptions and notable questions.")
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+class TokenBudgetExceeded(Exception):
+    pass
+
+
+# Rough local token count: no network call, errs on the high side.
+# English averages ~4 characters or ~0.75 words per token.
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), math.ceil(len(_WORD_PATTERN.findall(text)) * 4 / 3))
+
+
+# Shared, thread-safe running total of tokens spent by one summary job
+class TokenBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        with self._lock:
+            if self.spent + tokens > self.limit:
+                raise TokenBudgetExceeded(f"Token budget of {self.limit} exhausted ({self.spent} spent).")
+            self.spent += tokens
+
+    def remaining(self):
+        with self._lock:
+            return self.limit - self.spent
+
+
+# Default budget for a new summary job, from settings
+def new_token_budget():
+    return TokenBudget(get_setting("SUMMARY_TOKEN_BUDGET", DEFAULT_SUMMARY_TOKEN_BUDGET, int))
+
+
+# Split one text into pieces of at most max_tokens (estimated), breaking on lines where possible
+def _split_text(text, max_tokens):
+    pieces = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        if current and estimate_tokens(current + line) > max_tokens:
+            pieces.append(current)
+            current = ""
+        # A single line that is still too long gets cut by characters
+        while estimate_tokens(line) > max_tokens:
+            cut = max(1, max_tokens * 3)
+            pieces.append(line[:cut])
+            line = line[cut:]
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+# Pack texts, in order, into chunks whose estimated size stays within max_tokens
+def chunk_texts(texts, max_tokens, separator="\n"):
+    chunks = []
+    current = []
+    current_tokens = 0
+    separator_tokens = estimate_tokens(separator)
+    for text in texts:
+        for piece in _split_text(text, max_tokens) if estimate_tokens(text) > max_tokens else [text]:
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + separator_tokens + piece_tokens > max_tokens:
+                chunks.append(separator.join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += piece_tokens + separator_tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+# Call fn(), retrying retryable API errors with jittered exponential backoff.
+# Honours the server's retry-after header and never sleeps past the deadline.
+def call_with_backoff(fn, max_retries, deadline=None):
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except RETRYABLE_API_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(e, attempt)
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise
+            logging.warning(f"Anthropic API error (attempt {attempt + 1}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+# One summarization request, charged against the budget before it is sent.
+# It goes through the shared scheduler: admin summaries in the background lane
+# by default, a conversation's rolling summary in the interactive lane under its key.
+def summarize_text(client, instruction, text, budget, max_retries=0, deadline=None, priority=BACKGROUND, key="summaries"):
+    output_tokens = get_setting("SUMMARY_OUTPUT_TOKENS", DEFAULT_SUMMARY_OUTPUT_TOKENS, int)
+    estimated_tokens = estimate_tokens(instruction) + estimate_tokens(text) + output_tokens
+    budget.reserve(estimated_tokens)
+    usage = {}
+    response = call_with_backoff(
+        lambda: get_llm_scheduler().call(
+            lambda: complete(client, instruction, text, output_tokens, usage),
+            key, estimated_tokens, priority, usage_tokens=lambda: billable_tokens(usage)),
+        max_retries,
+        deadline,
+    )
+    return response.strip()
+
+
+# Map step for one conversation: send it whole if it fits the chunk budget,
+# otherwise summarize each chunk and reduce the chunk summaries.
+def summarize_conversation(client, logs, budget, max_retries=0, deadline=None):
+    chunk_tokens = get_setting("SUMMARY_CHUNK_TOKENS", DEFAULT_SUMMARY_CHUNK_TOKENS, int)
+    chunks = chunk_texts(logs, chunk_tokens)
+    if len(chunks) == 1:
+        return summarize_text(client, CONVERSATION_INSTRUCTION, chunks[0], budget, max_retries, deadline)
+    chunk_summaries = [
+        summarize_text(client, CHUNK_INSTRUCTION, chunk, budget, max_retries, deadline)
+        for chunk in chunks
+    ]
+    return reduce_summaries(client, chunk_summaries, budget, CONVERSATION_INSTRUCTION, max_retries, deadline)
+
+
+# Reduce step: repeatedly summarize groups of summaries that fit the chunk
+# budget until a single summary is left. If the budget runs out part-way,
+# the current level is returned joined together rather than failing.
+def reduce_summaries(client, summaries, budget, instruction=REDUCE_INSTRUCTION, max_retries=0, deadline=None):
+    chunk_tokens = get_setting("SUMMARY_CHUNK_TOKENS", DEFAULT_SUMMARY_CHUNK_TOKENS, int)
+    level = [summary for summary in summaries if summary]
+    if not level:
+        return ""
+    rounds = 0
+    # A single summary still goes through one round so the output is a digest, not a copy
+    while len(level) > 1 or rounds == 0:
+        if rounds >= MAX_REDUCE_ROUNDS:
+            logging.warning(f"Stopped reducing summaries after {rounds} rounds.")
+            break
+        try:
+            level = [
+                summarize_text(client, instruction, chunk, budget, max_retries, deadline)
+                for chunk in chunk_texts(level, chunk_tokens, separator="\n\n")
+            ]
+        except TokenBudgetExceeded as e:
+            logging.warning(f"Stopping summary reduction early: {e}")
+            break
+        rounds += 1
+    logging.info(f"Reduced {len(summaries)} summaries in {rounds} round(s); {budget.spent} tokens spent.")
+    return "\n\n".join(level)
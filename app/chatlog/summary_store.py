@@ -0,0 +1,229 @@
+# for persisting per-conversation summaries and refreshing only what changed
+import hashlib
+import logging
+from datetime import timedelta
+
+from psycopg2.extras import execute_values
+
+from app.chatlog.chatlog_handler import generate_summary_for_each_group
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+
+# Seconds before a proposed global watermark may take effect; must be longer
+# than any transaction that writes chat logs (see advance_summary_watermark)
+DEFAULT_SUMMARY_WATERMARK_LAG = 300.0
+
+
+# Hash chained over every exchange a summary covers: hash(previous hash + new rows)
+def _chain_hash(previous_hash, texts):
+    digest = hashlib.sha256((previous_hash or "").encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Highest chat_logs id and the database clock, read before fetching what changed
+# and handed to advance_summary_watermark afterwards. None on error.
+def read_log_position():
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return None
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(max(id), 0), now() FROM chat_logs")
+                max_log_id, read_at = cur.fetchone()
+                return {"max_log_id": max_log_id, "read_at": read_at}
+        except Exception as e:
+            logging.error(f"Error reading the chat log position: {e}")
+            return None
+
+
+# Fetch only the chat log rows newer than each conversation's watermark,
+# grouped by conversation together with the summary stored so far.
+# Only rows past the global watermark are read, through the primary key,
+# so a refresh with nothing new does not scan chat_logs.
+def fetch_changed_conversations():
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database for fetching logs.")
+            return {}
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT c.conversation_id, c.id, c.timestamp, c.prompt, c.response,
+                           s.summary, s.content_hash
+                    FROM chat_logs c
+                    LEFT JOIN conversation_summaries s ON s.conversation_id = c.conversation_id
+                    WHERE c.id > (SELECT last_log_id FROM summary_watermark WHERE id = 1)
+                      AND c.conversation_id IS NOT NULL
+                      AND c.id > COALESCE(s.last_log_id, 0)
+                    ORDER BY c.conversation_id, c.id
+                    """
+                )
+                changed = {}
+                for conv_id, log_id, timestamp, prompt, response, summary, content_hash in cur:
+                    conv_id = str(conv_id)
+                    if conv_id not in changed:
+                        changed[conv_id] = {
+                            "previous_summary": summary,
+                            "previous_hash": content_hash,
+                            "first_log_id": log_id,
+                            "logs": [],
+                        }
+                    changed[conv_id]["logs"].append(f"{prompt or ''} {response or ''}")
+                    changed[conv_id]["last_log_id"] = log_id
+                    changed[conv_id]["last_timestamp"] = timestamp
+                return changed
+        except Exception as e:
+            logging.error(f"Error fetching changed conversations: {e}")
+            return {}
+
+
+# Upsert refreshed summaries and move their watermarks forward.
+# Returns whether they were saved.
+def save_conversation_summaries(rows):
+    if not rows:
+        return True
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return False
+        try:
+            with conn, conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO conversation_summaries
+                        (conversation_id, summary, last_log_id, last_timestamp, content_hash)
+                    VALUES %s
+                    ON CONFLICT (conversation_id) DO UPDATE SET
+                        summary = EXCLUDED.summary,
+                        last_log_id = EXCLUDED.last_log_id,
+                        last_timestamp = EXCLUDED.last_timestamp,
+                        content_hash = EXCLUDED.content_hash,
+                        updated_at = current_timestamp
+                    """,
+                    rows,
+                )
+            logging.info(f"Saved {len(rows)} conversation summaries.")
+            return True
+        except Exception as e:
+            logging.error(f"Error saving conversation summaries: {e}")
+            return False
+
+
+# Move the global watermark forward after a refresh, without ever passing a chat
+# log row that commits out of id order: writers on several replicas commit their
+# batches in any order, so a row can appear below ids that were already read.
+# Each refresh proposes the highest id it covers: the largest id when it started
+# (position, from read_log_position), held back before the first new row of any
+# changed conversation it did not summarize. A proposal only becomes the
+# watermark at a refresh that started SUMMARY_WATERMARK_LAG seconds after it.
+# By then every row with a lower id has committed and was read by that refresh,
+# which caps the new watermark at its own proposal.
+def advance_summary_watermark(position, changed, summarized):
+    if position is None:
+        return
+    proposal = position["max_log_id"]
+    for conv_id, info in changed.items():
+        if conv_id not in summarized:
+            proposal = min(proposal, info["first_log_id"] - 1)
+    lag = get_setting("SUMMARY_WATERMARK_LAG", DEFAULT_SUMMARY_WATERMARK_LAG, float)
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("SELECT last_log_id, pending_log_id, pending_since FROM summary_watermark WHERE id = 1 FOR UPDATE")
+                last_log_id, pending_log_id, pending_since = cur.fetchone()
+                if pending_log_id is not None:
+                    if pending_since > position["read_at"] - timedelta(seconds=lag):
+                        # Too recent to settle; it waits for a later refresh
+                        return
+                    last_log_id = max(last_log_id, min(pending_log_id, proposal))
+                cur.execute(
+                    "UPDATE summary_watermark SET last_log_id = %s, pending_log_id = %s, pending_since = %s WHERE id = 1",
+                    (last_log_id, proposal, position["read_at"]),
+                )
+        except Exception as e:
+            logging.error(f"Error advancing the summary watermark: {e}")
+
+
+# Texts to summarize for a changed conversation: its summary so far, then the new exchanges
+def summary_input(info):
+    logs = list(info["logs"])
+    if info["previous_summary"]:
+        logs.insert(0, f"Summary of the conversation so far: {info['previous_summary']}")
+    return logs
+
+
+# conversation_summaries row for a new summary of a changed conversation
+def summary_row(conv_id, summary, info):
+    return (
+        conv_id,
+        summary,
+        info["last_log_id"],
+        info["last_timestamp"],
+        _chain_hash(info["previous_hash"], info["logs"]),
+    )
+
+
+# Summarize only conversations with activity since their watermark.
+# A conversation that already has a summary is summarized from that summary
+# plus its new exchanges, so the cost tracks new activity, not total history.
+# Returns (conversations refreshed, conversations that needed a refresh);
+# any left over keep their old watermark and are picked up next time.
+def refresh_conversation_summaries(on_progress=None, budget=None):
+    position = read_log_position()
+    changed = fetch_changed_conversations()
+    if not changed:
+        logging.info("No conversations changed since the last summary refresh.")
+        advance_summary_watermark(position, changed, {})
+        return 0, 0
+
+    batches = {conv_id: summary_input(info) for conv_id, info in changed.items()}
+
+    errors = {}
+    summaries = generate_summary_for_each_group(batches, on_progress=on_progress, errors=errors, budget=budget)
+    for conv_id, error in errors.items():
+        logging.error(f"Failed to summarize conversation {conv_id}: {error}")
+
+    rows = [summary_row(conv_id, summary, changed[conv_id]) for conv_id, summary in summaries.items()]
+    if save_conversation_summaries(rows):
+        advance_summary_watermark(position, changed, summaries)
+    return len(rows), len(changed)
+
+
+# All stored summaries, keyed by conversation id
+def fetch_conversation_summaries():
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return {}
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("SELECT conversation_id, summary FROM conversation_summaries ORDER BY last_timestamp")
+                return {str(conv_id): summary for conv_id, summary in cur.fetchall()}
+        except Exception as e:
+            logging.error(f"Error fetching conversation summaries: {e}")
+            return {}
+
+
+# Forget every stored summary, e.g. after the chat logs themselves are deleted,
+# and rewind the global watermark so every conversation is summarized again
+def clear_conversation_summaries():
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("DELETE FROM conversation_summaries")
+                cur.execute("UPDATE summary_watermark SET last_log_id = 0, pending_log_id = NULL, pending_since = NULL WHERE id = 1")
+            logging.info("Conversation summaries cleared.")
+        except Exception as e:
+            logging.error(f"Error clearing conversation summaries: {e}")
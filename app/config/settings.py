@@ -0,0 +1,29 @@
+# for reading configuration from Streamlit secrets, falling back to environment variables
+import logging
+import os
+
+import streamlit as st
+
+
+# Look up a setting in Streamlit secrets first, then in the environment.
+# Works outside a Streamlit run (CLIs, benchmarks) where no secrets.toml exists.
+def get_setting(name, default=None, cast=None):
+    value = None
+    try:
+        value = st.secrets.get(name)
+    except Exception:
+        # No secrets file available (e.g. running from the command line)
+        value = None
+    if value is None:
+        value = os.environ.get(name)
+    if value is None:
+        return default
+    if cast is None:
+        return value
+    try:
+        if cast is bool and isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        return cast(value)
+    except (TypeError, ValueError) as e:
+        logging.error(f"Invalid value for setting {name!r}: {e}")
+        return default
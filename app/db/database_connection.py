@@ -1,167 +1,374 @@
 # for database connection and initialization
-import psycopg2
 import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import psycopg2
+import psycopg2.extensions
 import streamlit as st
 
+from app.cache.config_snapshot import get_snapshot_value, update_config_snapshot
+from app.cache.ttl_cache import MISSING, metadata_cache
+from app.config.settings import get_setting
+from app.metrics.tracing import increment, observe, span
+
+# Pool defaults, overridable through secrets or environment variables
+DEFAULT_POOL_MAX_SIZE = 10
+DEFAULT_POOL_CHECKOUT_TIMEOUT = 10.0
+DEFAULT_POOL_HEALTH_CHECK_INTERVAL = 30.0
+# Neon suspends an idle compute after 5 minutes; treat the database as awake a bit less long
+DEFAULT_DB_WARM_WINDOW = 240.0
+
+
+# Connection string for the app database.
+# NEON_DB_LINK is preferred; DB_CONNECTION is still honoured for older deployments.
+def get_database_url():
+    return get_setting("NEON_DB_LINK") or get_setting("DB_CONNECTION")
+
+
+# Channel on which cache invalidations reach every replica (see app.cache.invalidation)
+CACHE_INVALIDATION_CHANNEL = "chergpt_cache_invalidation"
+
+
+# Announce that a cached value changed, as "<cache key>:<version>". Postgres only
+# delivers the notification if and when the surrounding transaction commits.
+def notify_cache_invalidation(cur, key):
+    cur.execute(
+        "SELECT pg_notify(%s, %s || ':' || nextval('cache_invalidation_version'))",
+        (CACHE_INVALIDATION_CHANNEL, key),
+    )
+
+
+_query_count = 0
+_query_count_lock = threading.Lock()
+
+
+# Total statements sent to the database by this process (one round trip each)
+def get_query_count():
+    return _query_count
+
+
+def _count_query():
+    global _query_count
+    with _query_count_lock:
+        _query_count += 1
+
+
+_TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|JOIN)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([A-Za-z_][\w.]*)", re.IGNORECASE)
+
+
+# Metric labels for a statement: its leading keyword and first table named.
+# Handler queries are constant strings, so the parse is cached.
+@lru_cache(maxsize=512)
+def _query_labels(query):
+    if not isinstance(query, str):
+        return "OTHER", "unknown"
+    words = query.split(None, 1)
+    table = _TABLE_PATTERN.search(query)
+    return (words[0].upper() if words else "OTHER"), (table.group(1).lower() if table else "none")
+
+
+# Cursor that counts and times every statement it sends
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        _count_query()
+        operation, table = _query_labels(query)
+        with span("db_query_seconds", operation=operation, table=table):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        _count_query()
+        operation, table = _query_labels(query)
+        with span("db_query_seconds", operation=operation, table=table):
+            return super().executemany(query, vars_list)
+
+
+# Open a brand-new connection to the database. Only the pool should call this.
 def connect_to_db():
+    database_url = get_database_url()
+    if not database_url:
+        logging.error("NEON_DB_LINK not found in Streamlit secrets.")
+        return None
     try:
-        conn = psycopg2.connect(st.secrets["DB_CONNECTION"])
+        with span("db_connect_seconds"):
+            conn = psycopg2.connect(database_url, cursor_factory=CountingCursor)
         logging.info("Successfully connected to the database. This is NeonDB if you followed the setup instructions")
         return conn
     except Exception as e:
+        increment("db_connect_errors")
         logging.error(f"Failed to connect to the database: {e}")
         return None
 
-def drop_instructions_table():
-    conn = connect_to_db()
-    if conn is None:
-        st.error("Failed to connect to the database.")
-        return
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute("DROP TABLE IF EXISTS instructions;")
-            conn.commit()
-            st.success("Instructions table dropped successfully.")
-    except Exception as e:
-        logging.error(f"Error dropping instructions table: {e}")
-        st.error(f"Error dropping instructions table: {e}")
-    finally:
-        if conn:
+# Process-wide pool of psycopg2 connections shared by every Streamlit session.
+class ConnectionPool:
+    def __init__(self, connect, max_size, checkout_timeout, health_check_interval):
+        self._connect = connect
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # Idle connections as (connection, time it was returned to the pool)
+        self._idle = []
+        self._in_use = 0
+        # When a connection last came back in working order, i.e. the database last answered
+        self.last_activity = None
+        self.stats = {"checkouts": 0, "connects": 0, "discarded": 0, "timeouts": 0, "peak_in_use": 0}
+
+    # Borrow a connection, waiting up to checkout_timeout for a free slot.
+    # Returns None if the pool is exhausted or the database is unreachable.
+    def checkout(self):
+        wait_start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.checkout_timeout)
+        observe("db_checkout_wait_seconds", time.perf_counter() - wait_start)
+        if not acquired:
+            with self._lock:
+                self.stats["timeouts"] += 1
+            logging.error(f"Timed out after {self.checkout_timeout}s waiting for a database connection.")
+            return None
+
+        conn = self._take_idle()
+        if conn is None:
+            conn = self._connect()
+            if conn is None:
+                self._slots.release()
+                return None
+            with self._lock:
+                self.stats["connects"] += 1
+
+        with self._lock:
+            self._in_use += 1
+            self.stats["checkouts"] += 1
+            self.stats["peak_in_use"] = max(self.stats["peak_in_use"], self._in_use)
+        return conn
+
+    # Give a connection back, resetting any transaction left open by the caller.
+    def release(self, conn, discard=False):
+        try:
+            if not discard and not conn.closed:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            else:
+                discard = True
+        except Exception as e:
+            logging.warning(f"Discarding broken database connection: {e}")
+            discard = True
+
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self.stats["discarded"] += 1
+            else:
+                self.last_activity = time.monotonic()
+                self._idle.append((conn, self.last_activity))
+        if discard:
+            self._close_quietly(conn)
+        self._slots.release()
+
+    # Close every idle connection; busy ones are closed when they come back.
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def size(self):
+        with self._lock:
+            return {"idle": len(self._idle), "in_use": self._in_use, "max_size": self.max_size}
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                # Most recently used first, so idle extras can age out on the server side
+                conn, returned_at = self._idle.pop()
+            if self._is_healthy(conn, returned_at):
+                return conn
+            with self._lock:
+                self.stats["discarded"] += 1
+            self._close_quietly(conn)
+
+    # Cheap liveness probe; only round-trips if the connection sat idle for a while.
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logging.warning(f"Database connection failed health check: {e}")
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
             conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# The shared pool, created on first use and reused across reruns and sessions.
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    connect_to_db,
+                    max_size=get_setting("DB_POOL_MAX_SIZE", DEFAULT_POOL_MAX_SIZE, int),
+                    checkout_timeout=get_setting("DB_POOL_CHECKOUT_TIMEOUT", DEFAULT_POOL_CHECKOUT_TIMEOUT, float),
+                    health_check_interval=get_setting("DB_POOL_HEALTH_CHECK_INTERVAL", DEFAULT_POOL_HEALTH_CHECK_INTERVAL, float),
+                )
+    return _pool
 
-def initialize_db():
-    conn = connect_to_db()
-    if conn is None:
-        return
+
+# Whether the database answered recently enough that it should not be suspended.
+# While it isn't, config reads are served from the local snapshot instead of
+# waiting on a cold start (see app.db.warmup).
+def is_database_warm():
+    last_activity = get_pool().last_activity
+    warm_window = get_setting("DB_WARM_WINDOW", DEFAULT_DB_WARM_WINDOW, float)
+    return last_activity is not None and time.monotonic() - last_activity < warm_window
+
+
+# Borrow a pooled connection for the duration of a with-block.
+# Yields None when no connection is available so callers can fall back gracefully.
+@contextmanager
+def pooled_connection():
+    pool = get_pool()
+    conn = pool.checkout()
+    broken = False
     try:
-        with conn.cursor() as cur:
-            # Initialize instructions table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS instructions (
-                    id SERIAL PRIMARY KEY,
-                    content TEXT,
-                    timestamp TIMESTAMP DEFAULT current_timestamp
-                );
-            """)
-
-            # Initialize app_info table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS app_info (
-                    id SERIAL PRIMARY KEY,
-                    description TEXT
-                );
-            """)
-            
-            # Ensure there is always one row in app_info to update
-            cur.execute("""
-                INSERT INTO app_info (id, description)
-                VALUES (1, 'Chatbot to support teaching and learning.')
-                ON CONFLICT (id) DO NOTHING;
-            """)
-
-            # Initialize app_title table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS app_title (
-                    id SERIAL PRIMARY KEY,
-                    description TEXT
-                );
-            """)
-            
-            # Ensure there is always one row in app_title to update
-            cur.execute("""
-                INSERT INTO app_title (id, description)
-                VALUES (1, 'CherGPT')
-                ON CONFLICT (id) DO NOTHING;
-            """)
-
-
-        conn.commit()
-    except Exception as e:
-        logging.error(f"Error initializing database: {e}")
+        yield conn
+    except psycopg2.OperationalError:
+        broken = True
+        raise
     finally:
-        if conn:
-            conn.close()
+        if conn is not None:
+            pool.release(conn, discard=broken or conn.closed)
 
+def drop_instructions_table():
+    with pooled_connection() as conn:
+        if conn is None:
+            st.error("Failed to connect to the database.")
+            return
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS instructions;")
+                notify_cache_invalidation(cur, "instructions")
+                conn.commit()
+                metadata_cache.invalidate("instructions")
+                st.success("Instructions table dropped successfully.")
+        except Exception as e:
+            logging.error(f"Error dropping instructions table: {e}")
+            st.error(f"Error dropping instructions table: {e}")
 
 def get_app_description():
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return "Default app description here."
+    cached = metadata_cache.get("app_description")
+    if cached is not MISSING:
+        return cached
+    # While the database wakes up, answer with the last value seen
+    snapshot = get_snapshot_value("app_description")
+    if snapshot is not MISSING and not is_database_warm():
+        return snapshot
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT description FROM app_info WHERE id = 1;")
-            description = cur.fetchone()
-            if description:
-                return description[0]
-            else:
-                return "Chatbot to support teaching and learning."
-    except Exception as e:
-        logging.error(f"Error fetching app description: {e}")
-        return "Chatbot to support teaching and learning."
-    finally:
-        if conn:
-            conn.close()
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return "Default app description here." if snapshot is MISSING else snapshot
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT description FROM app_info WHERE id = 1;")
+                description = cur.fetchone()
+                if description:
+                    description = description[0]
+                else:
+                    description = "Chatbot to support teaching and learning."
+                metadata_cache.set("app_description", description)
+                update_config_snapshot("app_description", description)
+                return description
+        except Exception as e:
+            logging.error(f"Error fetching app description: {e}")
+            return "Chatbot to support teaching and learning." if snapshot is MISSING else snapshot
 
 def get_app_title():
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return "Default app title here."
+    cached = metadata_cache.get("app_title")
+    if cached is not MISSING:
+        return cached
+    # While the database wakes up, answer with the last value seen
+    snapshot = get_snapshot_value("app_title")
+    if snapshot is not MISSING and not is_database_warm():
+        return snapshot
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT description FROM app_title WHERE id = 1;")
-            description = cur.fetchone()
-            if description:
-                return description[0]
-            else:
-                return "CherGPT"
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return "Default app title here." if snapshot is MISSING else snapshot
 
-    except Exception as e:
-        logging.error(f"Error fetching app title: {e}")
-        return "CherGPT"
-    finally:
-        if conn:
-            conn.close()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT description FROM app_title WHERE id = 1;")
+                description = cur.fetchone()
+                if description:
+                    title = description[0]
+                else:
+                    title = "CherGPT"
+                metadata_cache.set("app_title", title)
+                update_config_snapshot("app_title", title)
+                return title
+
+        except Exception as e:
+            logging.error(f"Error fetching app title: {e}")
+            return "CherGPT" if snapshot is MISSING else snapshot
 
 def update_app_title(new_title):
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE app_title SET description = %s WHERE id = 1;
-            """, (new_title,))
-            conn.commit()
-            logging.info("App description updated successfully.")
-    except Exception as e:
-        logging.error(f"Error updating app title: {e}")
-    finally:
-        if conn:
-            conn.close()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE app_title SET description = %s WHERE id = 1;
+                """, (new_title,))
+                notify_cache_invalidation(cur, "app_title")
+                conn.commit()
+                metadata_cache.invalidate("app_title")
+                logging.info("App description updated successfully.")
+        except Exception as e:
+            logging.error(f"Error updating app title: {e}")
 
 
 def update_app_description(new_description):
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE app_info SET description = %s WHERE id = 1;
-            """, (new_description,))
-            conn.commit()
-            logging.info("App description updated successfully.")
-    except Exception as e:
-        logging.error(f"Error updating app description: {e}")
-    finally:
-        if conn:
-            conn.close()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE app_info SET description = %s WHERE id = 1;
+                """, (new_description,))
+                notify_cache_invalidation(cur, "app_description")
+                conn.commit()
+                metadata_cache.invalidate("app_description")
+                logging.info("App description updated successfully.")
+        except Exception as e:
+            logging.error(f"Error updating app description: {e}")
@@ -0,0 +1,441 @@
+# for versioned schema migrations, applied once per process instead of on every rerun
+#
+# Usage from the repository root:
+#   python -m app.db.migrations            apply pending migrations
+#   python -m app.db.migrations --status   list applied and pending migrations
+import argparse
+import logging
+import sys
+import threading
+
+from app.chatlog.chatlog_handler import DEFAULT_PARTITION_MONTHS_AHEAD, create_chatlog_partitions, is_chatlog_partitioned
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+
+# Arbitrary constant shared by every replica, so only one of them migrates at a time
+MIGRATION_LOCK_KEY = 72631001
+
+
+def _create_app_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS instructions (
+            id SERIAL PRIMARY KEY,
+            content TEXT,
+            timestamp TIMESTAMP DEFAULT current_timestamp
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS app_info (
+            id SERIAL PRIMARY KEY,
+            description TEXT
+        );
+    """)
+    # Ensure there is always one row in app_info to update
+    cur.execute("""
+        INSERT INTO app_info (id, description)
+        VALUES (1, 'Chatbot to support teaching and learning.')
+        ON CONFLICT (id) DO NOTHING;
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS app_title (
+            id SERIAL PRIMARY KEY,
+            description TEXT
+        );
+    """)
+    # Ensure there is always one row in app_title to update
+    cur.execute("""
+        INSERT INTO app_title (id, description)
+        VALUES (1, 'CherGPT')
+        ON CONFLICT (id) DO NOTHING;
+    """)
+
+
+# With CHATLOG_PARTITIONING enabled, a newly created chat_logs is range-partitioned
+# by month on timestamp; an existing plain table is left as it is.
+def _create_chatlog_table(cur):
+    cur.execute("SELECT to_regclass('chat_logs') IS NOT NULL")
+    table_exists = cur.fetchone()[0]
+    if get_setting("CHATLOG_PARTITIONING", False, bool) and not table_exists:
+        # The partition key has to be part of the primary key
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chat_logs (
+                id SERIAL,
+                timestamp TIMESTAMP NOT NULL DEFAULT current_timestamp,
+                prompt TEXT,
+                response TEXT,
+                conversation_id UUID,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp);
+        """)
+        # Catches rows outside every monthly partition instead of rejecting them
+        cur.execute("CREATE TABLE IF NOT EXISTS chat_logs_default PARTITION OF chat_logs DEFAULT;")
+    else:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chat_logs (
+                id SERIAL PRIMARY KEY,
+                timestamp TIMESTAMP DEFAULT current_timestamp,
+                prompt TEXT,
+                response TEXT,
+                conversation_id UUID
+            );
+        """)
+    # (conversation_id, id) serves both per-conversation lookups and
+    # in-order reads of a conversation; timestamp serves date ranges.
+    cur.execute("CREATE INDEX IF NOT EXISTS chat_logs_conversation_id_id_idx ON chat_logs (conversation_id, id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS chat_logs_timestamp_idx ON chat_logs (timestamp);")
+    if is_chatlog_partitioned(cur):
+        create_chatlog_partitions(
+            cur, get_setting("CHATLOG_PARTITION_MONTHS_AHEAD", DEFAULT_PARTITION_MONTHS_AHEAD, int))
+
+
+# One summary per conversation, with the watermark (last chat_logs id/timestamp
+# covered) and a content hash
+def _create_summary_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            conversation_id UUID PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_log_id INTEGER NOT NULL,
+            last_timestamp TIMESTAMP,
+            content_hash TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT current_timestamp
+        );
+    """)
+
+
+# Shared tier of the response cache, so replicas reuse each other's answers
+def _create_response_cache_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache (
+            cache_key TEXT PRIMARY KEY,
+            instructions_version TEXT NOT NULL,
+            normalized_prompt TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT now(),
+            hits INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+
+
+# Flags chat logs whose answer came from the response cache
+def _add_chatlog_cache_hit(cur):
+    cur.execute("ALTER TABLE chat_logs ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN NOT NULL DEFAULT false;")
+
+
+# Related-resources topics (seeded once by _seed_resources)
+def _create_resources_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resources (
+            id SERIAL PRIMARY KEY,
+            topic TEXT UNIQUE NOT NULL,
+            keywords TEXT[] NOT NULL DEFAULT '{}',
+            links TEXT[] NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP DEFAULT current_timestamp
+        );
+    """)
+
+
+# The topics that used to be hard-coded in main.py. Data, not schema: it only
+# runs when migration 6 is first applied, so topics an admin deleted stay deleted.
+def _seed_resources(cur):
+    cur.execute("""
+        INSERT INTO resources (topic, keywords, links) VALUES
+            ('Python', ARRAY['python'], ARRAY[
+                'Python Official Docs: https://docs.python.org',
+                'W3Schools Python Tutorial: https://www.w3schools.com/python/']),
+            ('Machine Learning', ARRAY['machine learning'], ARRAY[
+                'ML Crash Course by Google: https://developers.google.com/machine-learning/crash-course',
+                'Scikit-learn User Guide: https://scikit-learn.org/stable/user_guide.html']),
+            ('Web Development', ARRAY['web'], ARRAY[
+                'MDN Web Docs: https://developer.mozilla.org',
+                'FreeCodeCamp: https://www.freecodecamp.org/'])
+        ON CONFLICT (topic) DO NOTHING;
+    """)
+
+
+# Hourly message and conversation counts, kept up to date incrementally by
+# app.analytics.analytics_handler.refresh_activity_rollup
+def _create_activity_rollup_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS chat_activity_hourly (
+            hour TIMESTAMP PRIMARY KEY,
+            messages INTEGER NOT NULL,
+            conversations INTEGER NOT NULL
+        );
+    """)
+
+
+# Drop an index left INVALID by an interrupted CREATE INDEX CONCURRENTLY, so that
+# IF NOT EXISTS does not mistake it for a finished one
+def _drop_invalid_index(cur, name):
+    cur.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid AND c.relkind = 'i'
+    """, (name,))
+    if cur.fetchone():
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+# Build an index on chat_logs without blocking inserts while it runs. CONCURRENTLY
+# is not allowed on a partitioned table, so there the index is created on the
+# parent only, built concurrently on each partition that lacks it, and attached.
+def _create_chatlog_index_concurrently(cur, name, definition):
+    if not is_chatlog_partitioned(cur):
+        _drop_invalid_index(cur, name)
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON chat_logs {definition}")
+        return
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY chat_logs {definition}")
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'chat_logs'::regclass
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_inherits ii JOIN pg_index x ON x.indexrelid = ii.inhrelid
+              WHERE ii.inhparent = %s::regclass AND x.indrelid = c.oid
+          )
+    """, (name,))
+    for (partition,) in cur.fetchall():
+        partition_index = f"{partition}_{name[len('chat_logs_'):]}"
+        _drop_invalid_index(cur, partition_index)
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} {definition}")
+        cur.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+
+# Full-text search over prompts and responses, plus
+# a (timestamp, id) index for keyset pagination that supersedes the timestamp one.
+# The search index is on an expression rather than a stored column, so adding it
+# never rewrites chat_logs; search_chat_logs must query the same expression.
+# Runs outside a transaction (see NON_TRANSACTIONAL) so that both indexes are
+# built concurrently instead of locking chat_logs against writes.
+def _add_chatlog_search(cur):
+    _create_chatlog_index_concurrently(
+        cur,
+        "chat_logs_search_idx",
+        "USING GIN (to_tsvector('english', coalesce(prompt, '') || ' ' || coalesce(response, '')))",
+    )
+    _create_chatlog_index_concurrently(cur, "chat_logs_timestamp_id_idx", "(timestamp, id)")
+    cur.execute("DROP INDEX IF EXISTS chat_logs_timestamp_idx;")
+
+
+# Version numbers for the cache invalidation notifications sent by
+# app.db.database_connection.notify_cache_invalidation
+def _create_cache_invalidation_sequence(cur):
+    cur.execute("CREATE SEQUENCE IF NOT EXISTS cache_invalidation_version;")
+
+
+# Offline summary jobs (app.jobs.job_runner) and their per-conversation checkpoints
+def _create_summary_job_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS summary_jobs (
+            id SERIAL PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'queued',
+            use_batch_api BOOLEAN NOT NULL DEFAULT false,
+            total INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            worker TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT now(),
+            started_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS summary_jobs_status_idx ON summary_jobs (status, id);")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS summary_job_items (
+            job_id INTEGER NOT NULL REFERENCES summary_jobs (id) ON DELETE CASCADE,
+            conversation_id UUID NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            batch_id TEXT,
+            error TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (job_id, conversation_id)
+        );
+    """)
+
+
+# Global summary watermark (app.chatlog.summary_store): every conversation's
+# chat logs up to last_log_id are summarized, so refreshes only read newer rows.
+# pending_log_id is the next watermark, proposed at pending_since.
+def _create_summary_watermark_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS summary_watermark (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_log_id INTEGER NOT NULL DEFAULT 0,
+            pending_log_id INTEGER,
+            pending_since TIMESTAMPTZ
+        );
+    """)
+    # Ensure there is always one row in summary_watermark to update
+    cur.execute("""
+        INSERT INTO summary_watermark (id, last_log_id)
+        VALUES (1, 0)
+        ON CONFLICT (id) DO NOTHING;
+    """)
+
+
+# Ordered (version, description, step) list. Steps must be idempotent so they
+# can be re-applied after a table is dropped from the admin sidebar.
+# Append new migrations at the end; never renumber existing ones.
+# A migration's data step in SEEDS runs only when it is first applied, never on reapply.
+# Watermark of chat_activity_hourly (app.analytics.analytics_handler): hours
+# holding chat logs above last_log_id are recomputed on the next refresh.
+# pending_log_id is the next watermark, proposed at pending_since.
+def _create_activity_rollup_watermark_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS activity_rollup_watermark (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_log_id INTEGER NOT NULL DEFAULT 0,
+            pending_log_id INTEGER,
+            pending_since TIMESTAMPTZ
+        );
+    """)
+    cur.execute("""
+        INSERT INTO activity_rollup_watermark (id, last_log_id)
+        VALUES (1, 0)
+        ON CONFLICT (id) DO NOTHING;
+    """)
+
+
+MIGRATIONS = [
+    (1, "instructions, app_info and app_title tables", _create_app_tables),
+    (2, "chat_logs table and indexes", _create_chatlog_table),
+    (3, "conversation_summaries table", _create_summary_table),
+    (4, "response_cache table", _create_response_cache_table),
+    (5, "chat_logs.cache_hit column", _add_chatlog_cache_hit),
+    (6, "resources table", _create_resources_table),
+    (7, "chat_activity_hourly rollup table", _create_activity_rollup_table),
+    (8, "chat_logs full-text search and pagination indexes", _add_chatlog_search),
+    (9, "cache_invalidation_version sequence", _create_cache_invalidation_sequence),
+    (10, "summary_jobs and summary_job_items tables", _create_summary_job_tables),
+    (11, "summary_watermark table", _create_summary_watermark_table),
+    (12, "activity_rollup_watermark table", _create_activity_rollup_watermark_table),
+]
+SEEDS = {
+    6: _seed_resources,
+}
+# Migrations whose step runs in autocommit mode rather than in one transaction,
+# because CREATE INDEX CONCURRENTLY refuses to run inside a transaction block.
+# Such steps must be safe to resume after failing halfway.
+NON_TRANSACTIONAL = {8}
+
+
+def _ensure_version_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT current_timestamp
+        );
+    """)
+
+
+# Versions already recorded in schema_version
+def get_applied_versions():
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return set()
+        try:
+            with conn, conn.cursor() as cur:
+                _ensure_version_table(cur)
+                cur.execute("SELECT version FROM schema_version")
+                return {row[0] for row in cur.fetchall()}
+        except Exception as e:
+            logging.error(f"Error reading schema version: {e}")
+            return set()
+
+
+# Apply every pending migration, each in its own transaction, while holding an
+# advisory lock so concurrent replicas wait instead of racing.
+# With reapply=True every schema step runs again (used after dropping a table);
+# seed data is not inserted again.
+# Returns True if the schema is up to date afterwards.
+def run_migrations(reapply=False):
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database; migrations not applied.")
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+            try:
+                with conn.cursor() as cur:
+                    _ensure_version_table(cur)
+                    cur.execute("SELECT version FROM schema_version")
+                    applied = {row[0] for row in cur.fetchall()}
+                conn.commit()
+                for version, description, step in MIGRATIONS:
+                    if version in applied and not reapply:
+                        continue
+                    conn.autocommit = version in NON_TRANSACTIONAL
+                    try:
+                        with conn.cursor() as cur:
+                            step(cur)
+                            if version not in applied and version in SEEDS:
+                                SEEDS[version](cur)
+                    finally:
+                        if conn.autocommit:
+                            conn.autocommit = False
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            """
+                            INSERT INTO schema_version (version, description)
+                            VALUES (%s, %s)
+                            ON CONFLICT (version) DO NOTHING
+                            """,
+                            (version, description),
+                        )
+                    conn.commit()
+                    logging.info(f"Applied migration {version}: {description}")
+            finally:
+                conn.rollback()
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.commit()
+            return True
+        except Exception as e:
+            logging.error(f"Error applying migrations: {e}")
+            return False
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+# Called from the app: migrates at most once per process (set AUTO_MIGRATE to
+# false to leave migrations to the CLI), so reruns do no DDL at all.
+def ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        if not get_setting("AUTO_MIGRATE", True, bool):
+            _schema_ready = True
+            return
+        _schema_ready = run_migrations()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Apply CherGPT database schema migrations.")
+    parser.add_argument("--status", action="store_true", help="show applied and pending migrations and exit")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        applied = get_applied_versions()
+        for version, description, _ in MIGRATIONS:
+            state = "applied" if version in applied else "pending"
+            print(f"{version:>4}  {state:<8} {description}")
+        return 0
+    return 0 if run_migrations() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
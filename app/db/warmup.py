@@ -0,0 +1,124 @@
+# for hiding Neon cold starts: warm the pool in the background, keep the compute
+# awake during class hours, and measure how long waking it up takes
+import logging
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from app.config.settings import get_setting
+from app.db.database_connection import get_app_description, get_app_title, get_pool, is_database_warm
+from app.db.migrations import ensure_schema
+from app.instructions.instructions_handler import get_latest_instructions
+from app.metrics.tracing import increment, observe
+
+# Connections opened ahead of the first students
+DEFAULT_DB_WARMUP_CONNECTIONS = 2
+# Pings during class hours; under Neon's default 5 minute suspend timeout
+DEFAULT_DB_KEEPALIVE_INTERVAL = 240.0
+# When to keep the database awake, in Singapore time like the chat logs
+DEFAULT_DB_KEEPALIVE_HOURS = "07:00-18:00"
+DEFAULT_DB_KEEPALIVE_DAYS = "Mon,Tue,Wed,Thu,Fri"
+# A first round trip slower than this counts as a cold start
+COLD_START_THRESHOLD = 1.0
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+# Whether `now` falls inside the configured class hours, e.g. "07:00-18:00" on "Mon,Tue,Wed"
+def in_class_hours(now=None):
+    now = now or datetime.now(ZoneInfo("Asia/Singapore"))
+    days = [d.strip() for d in get_setting("DB_KEEPALIVE_DAYS", DEFAULT_DB_KEEPALIVE_DAYS).split(",")]
+    if WEEKDAYS[now.weekday()] not in days:
+        return False
+    start, _, end = get_setting("DB_KEEPALIVE_HOURS", DEFAULT_DB_KEEPALIVE_HOURS).partition("-")
+    return start.strip() <= f"{now:%H:%M}" < end.strip()
+
+
+def _ping(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    conn.rollback()
+
+
+# Wake the database and fill the pool: open a few connections, migrate if needed,
+# then refresh the cached config (and with it the local snapshot).
+# Returns the seconds until the first round trip succeeded, or None on failure.
+def warm_up_database(connections=None):
+    if connections is None:
+        connections = get_setting("DB_WARMUP_CONNECTIONS", DEFAULT_DB_WARMUP_CONNECTIONS, int)
+    pool = get_pool()
+    start = time.perf_counter()
+    first_round_trip = None
+    held = []
+    try:
+        for _ in range(max(1, min(connections, pool.max_size))):
+            conn = pool.checkout()
+            if conn is None:
+                break
+            held.append(conn)
+            _ping(conn)
+            if first_round_trip is None:
+                first_round_trip = time.perf_counter() - start
+        # Still holding the warm connections, so no session sees the database
+        # as warm before pending migrations are applied
+        if held:
+            ensure_schema()
+    except Exception as e:
+        logging.warning(f"Database warm-up failed: {e}")
+    finally:
+        for conn in held:
+            pool.release(conn)
+    if first_round_trip is None:
+        increment("db_warmup_failures")
+        return None
+
+    observe("db_warmup_seconds", first_round_trip)
+    if first_round_trip >= COLD_START_THRESHOLD:
+        increment("db_cold_starts")
+        observe("db_cold_start_seconds", first_round_trip)
+    logging.info(f"Database warm after {first_round_trip:.2f}s with {len(held)} connections ready.")
+    get_app_title()
+    get_app_description()
+    get_latest_instructions()
+    return first_round_trip
+
+
+_warmup_thread = None
+_keepalive_thread = None
+_warmup_lock = threading.Lock()
+
+
+# Non-blocking: True if the database is warm, otherwise start a background
+# warm-up (unless one is already running) and return False
+def ensure_database_warm():
+    global _warmup_thread
+    if is_database_warm():
+        return True
+    with _warmup_lock:
+        if _warmup_thread is None or not _warmup_thread.is_alive():
+            _warmup_thread = threading.Thread(target=warm_up_database, name="db-warmup", daemon=True)
+            _warmup_thread.start()
+    return False
+
+
+def _keepalive_loop():
+    interval = get_setting("DB_KEEPALIVE_INTERVAL", DEFAULT_DB_KEEPALIVE_INTERVAL, float)
+    while True:
+        time.sleep(interval)
+        if not in_class_hours():
+            # Let Neon suspend the compute outside class hours
+            continue
+        try:
+            warm_up_database(connections=1)
+        except Exception as e:
+            logging.warning(f"Database keepalive failed: {e}")
+
+
+# Start the class-hours keepalive once per process; off when DB_KEEPALIVE is false
+def start_database_keepalive():
+    global _keepalive_thread
+    with _warmup_lock:
+        if _keepalive_thread is None and get_setting("DB_KEEPALIVE", True, bool):
+            _keepalive_thread = threading.Thread(target=_keepalive_loop, name="db-keepalive", daemon=True)
+            _keepalive_thread.start()
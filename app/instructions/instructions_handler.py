@@ -1,41 +1,52 @@
 import logging
-from app.db.database_connection import connect_to_db
+from app.cache.config_snapshot import get_snapshot_value, update_config_snapshot
+from app.cache.ttl_cache import MISSING, metadata_cache
+from app.db.database_connection import is_database_warm, notify_cache_invalidation, pooled_connection
 
 def get_latest_instructions():
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return ""
+    cached = metadata_cache.get("instructions")
+    if cached is not MISSING:
+        return cached
+    # While the database wakes up, answer with the last instructions seen
+    snapshot = get_snapshot_value("instructions")
+    if snapshot is not MISSING and not is_database_warm():
+        return snapshot
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT content FROM instructions ORDER BY id DESC LIMIT 1")
-            latest_instructions = cur.fetchone()
-            return latest_instructions[0] if latest_instructions else ""
-    except Exception as e:
-        logging.error(f"Error fetching latest instructions: {e}")
-        return ""
-    finally:
-        conn.close()
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return "" if snapshot is MISSING else snapshot
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT content FROM instructions ORDER BY id DESC LIMIT 1")
+                latest_instructions = cur.fetchone()
+                instructions = latest_instructions[0] if latest_instructions else ""
+                metadata_cache.set("instructions", instructions)
+                update_config_snapshot("instructions", instructions)
+                return instructions
+        except Exception as e:
+            logging.error(f"Error fetching latest instructions: {e}")
+            return "" if snapshot is MISSING else snapshot
 
 def update_instructions(new_instructions):
-    conn = connect_to_db()
-    if conn is None:
-        logging.error("Failed to connect to the database.")
-        return
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO instructions (content)
-                VALUES (%s)
-                ON CONFLICT (id)
-                DO UPDATE SET content = EXCLUDED.content;
-            """, (new_instructions,))
-            conn.commit()
-            logging.info("Instructions updated successfully.")
-    except Exception as e:
-        logging.error(f"Error updating instructions: {e}")
-    finally:
-        conn.close()
\ No newline at end of file
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO instructions (content)
+                    VALUES (%s)
+                    ON CONFLICT (id)
+                    DO UPDATE SET content = EXCLUDED.content;
+                """, (new_instructions,))
+                notify_cache_invalidation(cur, "instructions")
+                conn.commit()
+                metadata_cache.invalidate("instructions")
+                logging.info("Instructions updated successfully.")
+        except Exception as e:
+            logging.error(f"Error updating instructions: {e}")
\ No newline at end of file
@@ -0,0 +1,476 @@
+# for running chat log summary jobs outside the page that asked for them, with a
+# checkpoint per conversation so a failed or interrupted job resumes where it stopped
+#
+# Usage from the repository root:
+#   python -m app.jobs.job_runner enqueue [--batch-api] [--run]   queue a summary job (and run it now)
+#   python -m app.jobs.job_runner run [--workers N] [--loop]      run queued jobs; --loop waits for more
+#   python -m app.jobs.job_runner resume JOB_ID                   continue a failed or interrupted job
+#   python -m app.jobs.job_runner status [JOB_ID]                 show recent jobs and their progress
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+from app.chat.generation import get_claude_client, get_model
+from app.chatlog.chatlog_handler import compile_summaries, generate_summary_for_each_group
+from app.chatlog.summarizer import (
+    CONVERSATION_INSTRUCTION,
+    DEFAULT_SUMMARY_CHUNK_TOKENS,
+    DEFAULT_SUMMARY_OUTPUT_TOKENS,
+    TokenBudgetExceeded,
+    chunk_texts,
+    estimate_tokens,
+    new_token_budget,
+)
+from app.chatlog.summary_store import (
+    advance_summary_watermark,
+    fetch_changed_conversations,
+    fetch_conversation_summaries,
+    read_log_position,
+    save_conversation_summaries,
+    summary_input,
+    summary_row,
+)
+from app.config.settings import get_setting
+from app.db.database_connection import pooled_connection
+from app.metrics.tracing import increment
+
+DEFAULT_SUMMARY_JOB_WORKERS = 8
+# Time one run of a job may take; whatever is left stays pending for a resume
+DEFAULT_SUMMARY_JOB_DEADLINE = 3600.0
+# A running job whose heartbeat is older than this was interrupted and may be taken over
+DEFAULT_SUMMARY_JOB_STALE_AFTER = 300.0
+DEFAULT_SUMMARY_BATCH_POLL_INTERVAL = 30.0
+# How often `run --loop` looks for newly queued jobs
+LOOP_POLL_INTERVAL = 10.0
+
+JOB_COLUMNS = "id, status, use_batch_api, total, done, failed, result, error, created_at, started_at, heartbeat_at, finished_at"
+
+
+def _job_dict(row):
+    return dict(zip([c.strip() for c in JOB_COLUMNS.split(",")], row))
+
+
+def _worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Arbitrary constant, so only one replica at a time decides whether a job is already active
+SUMMARY_JOB_LOCK_KEY = 72631002
+
+
+# Whether queued jobs run on a background thread of the app. Off by default: a
+# job can take minutes of model calls, which belong in a separate
+# `job_runner run --loop` worker rather than the web process serving the page.
+def summary_jobs_in_process():
+    return get_setting("SUMMARY_JOBS_IN_PROCESS", False, bool)
+
+
+# The job that is queued or running, if any. Takes the enqueue lock, so it must be
+# called inside the transaction that may add a job.
+def _active_job_id(cur):
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (SUMMARY_JOB_LOCK_KEY,))
+    cur.execute("SELECT id FROM summary_jobs WHERE status IN ('queued', 'running') ORDER BY id LIMIT 1")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+# Queue a summary job and return its id (None on error). While another job is
+# queued or running no new one is added and that job's id is returned instead, so
+# repeated clicks never summarize the same conversations twice. With
+# run_in_process (default: summary_jobs_in_process()) a background thread of
+# this process runs it; otherwise a `job_runner run --loop` worker picks it up.
+def enqueue_summary_job(use_batch_api=False, run_in_process=None):
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return None
+        try:
+            with conn, conn.cursor() as cur:
+                job_id = _active_job_id(cur)
+                queued = job_id is None
+                if queued:
+                    cur.execute("INSERT INTO summary_jobs (use_batch_api) VALUES (%s) RETURNING id", (use_batch_api,))
+                    job_id = cur.fetchone()[0]
+        except Exception as e:
+            logging.error(f"Error queueing summary job: {e}")
+            return None
+    if queued:
+        logging.info(f"Summary job {job_id} queued.")
+    else:
+        logging.info(f"Summary job {job_id} is already queued or running; not queueing another.")
+    if run_in_process is None:
+        run_in_process = summary_jobs_in_process()
+    if run_in_process:
+        start_background_runner()
+    return job_id
+
+
+# Put a failed job back in the queue; its finished conversations are kept. Refused
+# while another job is queued or running.
+def requeue_summary_job(job_id, run_in_process=None):
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return False
+        try:
+            with conn, conn.cursor() as cur:
+                active = _active_job_id(cur)
+                if active is not None:
+                    logging.info(f"Summary job {active} is already queued or running; not requeueing job {job_id}.")
+                    return False
+                cur.execute("UPDATE summary_jobs SET status = 'queued', error = NULL WHERE id = %s AND status = 'failed'", (job_id,))
+                requeued = cur.rowcount == 1
+        except Exception as e:
+            logging.error(f"Error requeueing summary job {job_id}: {e}")
+            return False
+    if run_in_process is None:
+        run_in_process = summary_jobs_in_process()
+    if requeued and run_in_process:
+        start_background_runner()
+    return requeued
+
+
+# One job as a dict (the latest when no id is given), or None
+def get_summary_job(job_id=None):
+    jobs = list_summary_jobs(limit=1, job_id=job_id)
+    return jobs[0] if jobs else None
+
+
+def list_summary_jobs(limit=10, job_id=None):
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return []
+        try:
+            with conn, conn.cursor() as cur:
+                if job_id is None:
+                    cur.execute(f"SELECT {JOB_COLUMNS} FROM summary_jobs ORDER BY id DESC LIMIT %s", (limit,))
+                else:
+                    cur.execute(f"SELECT {JOB_COLUMNS} FROM summary_jobs WHERE id = %s", (job_id,))
+                return [_job_dict(row) for row in cur.fetchall()]
+        except Exception as e:
+            logging.error(f"Error fetching summary jobs: {e}")
+            return []
+
+
+# Mark a job as running by this worker: the given one if it is queued, failed or
+# interrupted, otherwise the oldest queued or interrupted job. SKIP LOCKED keeps
+# two workers from claiming the same job. Returns (id, use_batch_api) or None.
+def _claim_job(job_id=None):
+    stale_after = get_setting("SUMMARY_JOB_STALE_AFTER", DEFAULT_SUMMARY_JOB_STALE_AFTER, float)
+    claimable = ("(status = 'queued' OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => %s))"
+                 + (" OR status = 'failed') AND id = %s" if job_id is not None else ")"))
+    params = [stale_after] + ([job_id] if job_id is not None else [])
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return None
+        with conn, conn.cursor() as cur:
+            cur.execute(
+                f"""
+                UPDATE summary_jobs
+                SET status = 'running', worker = %s, error = NULL,
+                    started_at = COALESCE(started_at, now()), heartbeat_at = now()
+                WHERE id = (
+                    SELECT id FROM summary_jobs WHERE {claimable}
+                    ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, use_batch_api
+                """,
+                [_worker_name()] + params,
+            )
+            return cur.fetchone()
+
+
+# Record the conversations a job covers, the first time it runs
+def _plan_job(job_id, conversation_ids):
+    with pooled_connection() as conn:
+        if conn is None:
+            raise RuntimeError("Failed to connect to the database.")
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM summary_job_items WHERE job_id = %s", (job_id,))
+            if cur.fetchone()[0]:
+                return
+            cur.executemany(
+                "INSERT INTO summary_job_items (job_id, conversation_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                [(job_id, conv_id) for conv_id in conversation_ids],
+            )
+            cur.execute("UPDATE summary_jobs SET total = %s WHERE id = %s", (len(conversation_ids), job_id))
+
+
+# Conversations of a job that are not done yet, with the batch they were submitted in (if any)
+def _pending_items(job_id):
+    with pooled_connection() as conn:
+        if conn is None:
+            raise RuntimeError("Failed to connect to the database.")
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT conversation_id, batch_id FROM summary_job_items WHERE job_id = %s AND status <> 'done'", (job_id,))
+            return {str(conv_id): batch_id for conv_id, batch_id in cur.fetchall()}
+
+
+def _update_job(job_id, sql, params=()):
+    with pooled_connection() as conn:
+        if conn is None:
+            raise RuntimeError("Failed to connect to the database.")
+        with conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+
+
+# Checkpoint one conversation. A failed one forgets its batch, so a resume submits it again.
+def _checkpoint(job_id, conv_id, error=None):
+    _update_job(
+        job_id,
+        """
+        UPDATE summary_job_items
+        SET status = %s, error = %s, attempts = attempts + 1, updated_at = now(),
+            batch_id = CASE WHEN %s THEN NULL ELSE batch_id END
+        WHERE job_id = %s AND conversation_id = %s;
+        UPDATE summary_jobs SET
+            done = (SELECT count(*) FROM summary_job_items WHERE job_id = %s AND status = 'done'),
+            failed = (SELECT count(*) FROM summary_job_items WHERE job_id = %s AND status = 'failed'),
+            heartbeat_at = now()
+        WHERE id = %s;
+        """,
+        ("failed" if error else "done", error, error is not None, job_id, conv_id, job_id, job_id, job_id),
+    )
+    increment("summary_job_conversations", outcome="failed" if error else "done")
+
+
+def _finish(job_id, status, result=None, error=None):
+    _update_job(
+        job_id,
+        "UPDATE summary_jobs SET status = %s, result = COALESCE(%s, result), error = %s, finished_at = now() WHERE id = %s",
+        (status, result, error, job_id),
+    )
+    logging.info(f"Summary job {job_id} {status}." + (f" {error}" if error else ""))
+
+
+# Send conversations that fit in one request through the Message Batches API and
+# collect the results, checkpointing each one. Batches submitted by an earlier
+# run of the job are collected rather than submitted again.
+# Returns the conversations left for the regular path: those needing chunking,
+# and any not submitted because the token budget ran out.
+def _run_batch(job_id, todo, pending, budget, on_result):
+    client = get_claude_client()
+    chunk_tokens = get_setting("SUMMARY_CHUNK_TOKENS", DEFAULT_SUMMARY_CHUNK_TOKENS, int)
+    output_tokens = get_setting("SUMMARY_OUTPUT_TOKENS", DEFAULT_SUMMARY_OUTPUT_TOKENS, int)
+    poll_interval = get_setting("SUMMARY_BATCH_POLL_INTERVAL", DEFAULT_SUMMARY_BATCH_POLL_INTERVAL, float)
+
+    single = {}
+    for conv_id, info in todo.items():
+        chunks = chunk_texts(summary_input(info), chunk_tokens)
+        if len(chunks) == 1:
+            single[conv_id] = chunks[0]
+    # Submitted by an earlier run of this job, still to be collected
+    submitted = {conv_id: pending[conv_id] for conv_id in single if pending[conv_id]}
+    requests = []
+    for conv_id, text in single.items():
+        if conv_id in submitted:
+            continue
+        try:
+            budget.reserve(estimate_tokens(CONVERSATION_INSTRUCTION) + estimate_tokens(text) + output_tokens)
+        except TokenBudgetExceeded as e:
+            logging.warning(f"Not submitting further conversations: {e}")
+            break
+        requests.append({
+            "custom_id": conv_id,
+            "params": {
+                "model": get_model(),
+                "max_tokens": output_tokens,
+                "system": CONVERSATION_INSTRUCTION,
+                "messages": [{"role": "user", "content": text}],
+            },
+        })
+    if requests:
+        batch = client.messages.batches.create(requests=requests)
+        conv_ids = [request["custom_id"] for request in requests]
+        _update_job(job_id, "UPDATE summary_job_items SET batch_id = %s WHERE job_id = %s AND conversation_id = ANY(%s::uuid[])",
+                    (batch.id, job_id, conv_ids))
+        logging.info(f"Summary job {job_id}: submitted {len(conv_ids)} conversations as batch {batch.id}.")
+        submitted.update(dict.fromkeys(conv_ids, batch.id))
+
+    for batch_id in set(submitted.values()):
+        while client.messages.batches.retrieve(batch_id).processing_status != "ended":
+            _update_job(job_id, "UPDATE summary_jobs SET heartbeat_at = now() WHERE id = %s", (job_id,))
+            time.sleep(poll_interval)
+        collected = set()
+        for entry in client.messages.batches.results(batch_id):
+            if submitted.get(entry.custom_id) != batch_id:
+                continue
+            collected.add(entry.custom_id)
+            if entry.result.type == "succeeded":
+                text = "".join(block.text for block in entry.result.message.content if block.type == "text")
+                on_result(entry.custom_id, text.strip(), None)
+            else:
+                on_result(entry.custom_id, None, f"Batch request {entry.result.type}")
+        # Results are kept for a limited time; anything missing is submitted again on resume
+        for conv_id in [c for c, b in submitted.items() if b == batch_id and c not in collected]:
+            on_result(conv_id, None, f"No result in batch {batch_id}")
+    return {conv_id: info for conv_id, info in todo.items() if conv_id not in submitted}
+
+
+def _run_claimed_job(job_id, use_batch_api, workers):
+    position = read_log_position()
+    changed = fetch_changed_conversations()
+    _plan_job(job_id, list(changed))
+    pending = _pending_items(job_id)
+    todo = {}
+    for conv_id in pending:
+        if conv_id in changed:
+            todo[conv_id] = changed[conv_id]
+        else:
+            # Summarized since the job was planned, e.g. just before an interruption
+            _checkpoint(job_id, conv_id)
+
+    # Conversations summarized by this run. On a resume, conversations that
+    # changed after the job was planned are not in it and stay unsummarized.
+    summarized = set()
+
+    def on_result(conv_id, summary, error):
+        if error is None and not save_conversation_summaries([summary_row(conv_id, summary, todo[conv_id])]):
+            error = "Failed to save the summary"
+        if error is None:
+            summarized.add(conv_id)
+        _checkpoint(job_id, conv_id, error)
+
+    budget = new_token_budget()
+    if use_batch_api and todo:
+        remaining = _run_batch(job_id, todo, pending, budget, on_result)
+    else:
+        remaining = todo
+    generate_summary_for_each_group(
+        {conv_id: summary_input(info) for conv_id, info in remaining.items()},
+        max_workers=workers,
+        deadline=get_setting("SUMMARY_JOB_DEADLINE", DEFAULT_SUMMARY_JOB_DEADLINE, float),
+        errors={},
+        budget=budget,
+        on_result=on_result,
+    )
+
+    advance_summary_watermark(position, changed, summarized)
+    left = len(_pending_items(job_id))
+    if left:
+        _finish(job_id, "failed", error=f"{left} conversations were not summarized; resume the job to retry them.")
+        return
+    _finish(job_id, "completed", result=compile_summaries(fetch_conversation_summaries(), budget=budget))
+
+
+# Claim and run one job (see _claim_job). Returns its id, or None if there was nothing to run.
+def run_summary_job(job_id=None, workers=None):
+    if workers is None:
+        workers = get_setting("SUMMARY_JOB_WORKERS", DEFAULT_SUMMARY_JOB_WORKERS, int)
+    try:
+        claimed = _claim_job(job_id)
+    except Exception as e:
+        logging.error(f"Error claiming summary job: {e}")
+        return None
+    if claimed is None:
+        return None
+    job_id, use_batch_api = claimed
+    logging.info(f"Running summary job {job_id}.")
+    try:
+        _run_claimed_job(job_id, use_batch_api, workers)
+    except Exception as e:
+        logging.error(f"Summary job {job_id} failed: {e}")
+        try:
+            _finish(job_id, "failed", error=str(e))
+        except Exception as finish_error:
+            # Left as running; the stale heartbeat lets a later run take it over
+            logging.error(f"Could not record the failure of summary job {job_id}: {finish_error}")
+    return job_id
+
+
+_runner_thread = None
+_runner_wake = False
+_runner_lock = threading.Lock()
+
+
+# Run queued jobs on a background thread of this process, which exits once the
+# queue is empty. Jobs queued meanwhile are picked up before it exits.
+def start_background_runner():
+    global _runner_thread, _runner_wake
+    with _runner_lock:
+        _runner_wake = True
+        if _runner_thread is None:
+            _runner_thread = threading.Thread(target=_run_queued_jobs, name="summary-jobs", daemon=True)
+            _runner_thread.start()
+
+
+def _run_queued_jobs():
+    global _runner_thread, _runner_wake
+    while True:
+        with _runner_lock:
+            _runner_wake = False
+        try:
+            while run_summary_job() is not None:
+                pass
+        except Exception as e:
+            logging.error(f"Summary job runner stopped: {e}")
+        with _runner_lock:
+            if not _runner_wake:
+                _runner_thread = None
+                return
+
+
+def _print_jobs(jobs):
+    if not jobs:
+        print("No summary jobs.")
+    for job in jobs:
+        progress = f"{job['done']}/{job['total']}" + (f", {job['failed']} failed" if job["failed"] else "")
+        mode = " (batch API)" if job["use_batch_api"] else ""
+        print(f"{job['id']:>5}  {job['status']:<9} {progress:<16} created {job['created_at']:%Y-%m-%d %H:%M}{mode}")
+        if job["error"]:
+            print(f"       {job['error']}")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Queue, run and inspect CherGPT chat log summary jobs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="queue a summary job")
+    enqueue.add_argument("--batch-api", action="store_true", help="summarize through the Message Batches API")
+    enqueue.add_argument("--run", action="store_true", help="run the job in this process right away")
+    run = commands.add_parser("run", help="run queued jobs")
+    run.add_argument("--workers", type=int, help="conversations summarized in parallel (default: SUMMARY_JOB_WORKERS)")
+    run.add_argument("--loop", action="store_true", help="keep waiting for new jobs")
+    resume = commands.add_parser("resume", help="continue a failed or interrupted job")
+    resume.add_argument("job_id", type=int)
+    resume.add_argument("--workers", type=int)
+    status = commands.add_parser("status", help="show recent jobs")
+    status.add_argument("job_id", type=int, nargs="?")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        _print_jobs(list_summary_jobs(job_id=args.job_id))
+        return 0
+    if args.command == "enqueue":
+        # Run here (--run) or by a worker, never on a thread that exits with this command
+        job_id = enqueue_summary_job(args.batch_api, run_in_process=False)
+        if job_id is None:
+            return 1
+        print(f"Summary job {job_id} is queued.")
+        if args.run:
+            run_summary_job(job_id)
+            _print_jobs(list_summary_jobs(job_id=job_id))
+        return 0
+    if args.command == "resume":
+        if run_summary_job(args.job_id, args.workers) is None:
+            print(f"Job {args.job_id} is not resumable (it is completed, or running elsewhere).")
+            return 1
+        _print_jobs(list_summary_jobs(job_id=args.job_id))
+        return 0
+
+    while True:
+        while run_summary_job(workers=args.workers) is not None:
+            pass
+        if not args.loop:
+            return 0
+        time.sleep(LOOP_POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+# for lightweight in-process timing spans, counters and latency histograms
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.config.settings import get_setting
+
+# Most recent samples kept per series for percentile estimates
+DEFAULT_RESERVOIR_SIZE = 2048
+DEFAULT_METRICS_FILE_INTERVAL = 15.0
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# Latency samples for one (name, labels) series: exact count and sum,
+# percentiles over a sliding window of recent samples
+class Histogram:
+    def __init__(self, reservoir_size):
+        self.samples = deque(maxlen=reservoir_size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentiles(self, quantiles=QUANTILES):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: None for q in quantiles}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles}
+
+
+class MetricsRegistry:
+    def __init__(self, reservoir_size=DEFAULT_RESERVOIR_SIZE):
+        self.reservoir_size = reservoir_size
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.reservoir_size)
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    # Plain rows for display: one per series
+    def snapshot(self):
+        with self._lock:
+            histograms = [(name, dict(labels), h.count, h.total, h.percentiles())
+                          for (name, labels), h in self._histograms.items()]
+            counters = [(name, dict(labels), value) for (name, labels), value in self._counters.items()]
+        return {
+            "histograms": [
+                {"name": name, "labels": labels, "count": count, "sum": total,
+                 "p50": p[0.5], "p95": p[0.95], "p99": p[0.99]}
+                for name, labels, count, total, p in sorted(histograms, key=lambda row: (row[0], str(row[1])))
+            ],
+            "counters": [
+                {"name": name, "labels": labels, "value": value}
+                for name, labels, value in sorted(counters, key=lambda row: (row[0], str(row[1])))
+            ],
+        }
+
+    # Prometheus text exposition format: histograms as summaries with quantiles
+    def render_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        seen = set()
+        for row in snapshot["histograms"]:
+            name = f"chergpt_{row['name']}"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} summary")
+            for quantile, key in ((0.5, "p50"), (0.95, "p95"), (0.99, "p99")):
+                if row[key] is not None:
+                    lines.append(f"{name}{_labels(row['labels'], quantile=quantile)} {row[key]:.6f}")
+            lines.append(f"{name}_sum{_labels(row['labels'])} {row['sum']:.6f}")
+            lines.append(f"{name}_count{_labels(row['labels'])} {row['count']}")
+        for row in snapshot["counters"]:
+            name = f"chergpt_{row['name']}_total"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels(row['labels'])} {row['value']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _labels(labels, **extra):
+    merged = {**labels, **extra}
+    if not merged:
+        return ""
+    pairs = []
+    for key, value in sorted(merged.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+metrics = MetricsRegistry(get_setting("METRICS_RESERVOIR_SIZE", DEFAULT_RESERVOIR_SIZE, int))
+
+
+# Time a block and record its duration (seconds) under `name`
+@contextmanager
+def span(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(name, time.perf_counter() - start, **labels)
+
+
+def observe(name, value, **labels):
+    metrics.observe(name, value, **labels)
+
+
+def increment(name, amount=1, **labels):
+    metrics.increment(name, amount, **labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _write_metrics_file(path, interval):
+    while True:
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(metrics.render_prometheus())
+            # Atomic replace so a scraper never reads a half-written file
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.error(f"Error writing metrics file: {e}")
+        time.sleep(interval)
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+# Start the optional exporters once per process: an HTTP endpoint on
+# METRICS_PORT and/or a text file at METRICS_FILE, both in Prometheus format.
+def start_metrics_exporters():
+    global _exporters_started
+    if _exporters_started:
+        return
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        port = get_setting("METRICS_PORT", None, int)
+        if port:
+            try:
+                server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+                threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+                logging.info(f"Serving metrics on port {port}.")
+            except OSError as e:
+                logging.error(f"Could not start metrics endpoint on port {port}: {e}")
+        path = get_setting("METRICS_FILE")
+        if path:
+            interval = get_setting("METRICS_FILE_INTERVAL", DEFAULT_METRICS_FILE_INTERVAL, float)
+            threading.Thread(target=_write_metrics_file, args=(path, interval), name="metrics-file", daemon=True).start()
@@ -0,0 +1,164 @@
+import logging
+from collections import defaultdict, deque
+
+from app.cache.ttl_cache import MISSING, metadata_cache
+from app.config.settings import get_setting
+from app.db.database_connection import notify_cache_invalidation, pooled_connection
+
+DEFAULT_RESOURCES_TOP_K = 2
+GENERAL_RESOURCES = ["Explore more at: https://www.google.com"]
+
+
+# Aho-Corasick automaton over every topic keyword: one pass over the prompt
+# finds all keyword occurrences, however many topics there are.
+class KeywordMatcher:
+    def __init__(self, keyword_topics):
+        # Trie as parallel lists: goto transitions, failure links, outputs
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for keyword, topics in keyword_topics.items():
+            self._add(keyword, topics)
+        self._build_failure_links()
+
+    def _add(self, keyword, topics):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append((keyword, topics))
+
+    def _build_failure_links(self):
+        # Breadth-first, so every failure target is finished before it is used
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    # Score every topic in a single pass. Matches must sit on word boundaries
+    # ("web" matches "web page", not "cobweb"); longer keywords weigh more.
+    def score(self, text):
+        text = text.lower()
+        scores = defaultdict(float)
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for keyword, topics in self._output[state]:
+                start = end - len(keyword) + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if end + 1 < len(text) and text[end + 1].isalnum():
+                    continue
+                for topic in topics:
+                    scores[topic] += len(keyword.split())
+        return scores
+
+
+# All resource topics as {topic: {"keywords": [...], "links": [...]}}
+def fetch_resources():
+    resources = _read_resources()
+    return {} if resources is None else resources
+
+
+# Like fetch_resources, but None when they could not be read, so a failed
+# read is never mistaken for (and cached as) an empty table
+def _read_resources():
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return None
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT topic, keywords, links FROM resources ORDER BY topic")
+                return {topic: {"keywords": list(keywords or []), "links": list(links or [])}
+                        for topic, keywords, links in cur.fetchall()}
+        except Exception as e:
+            logging.error(f"Error fetching resources: {e}")
+            return None
+
+
+def save_resource(topic, keywords, links):
+    keywords = sorted({k.strip().lower() for k in keywords if k.strip()})
+    links = [link.strip() for link in links if link.strip()]
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO resources (topic, keywords, links)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (topic)
+                    DO UPDATE SET keywords = EXCLUDED.keywords, links = EXCLUDED.links, updated_at = current_timestamp;
+                """, (topic.strip(), keywords, links))
+                notify_cache_invalidation(cur, "resource_matcher")
+                conn.commit()
+                metadata_cache.invalidate("resource_matcher")
+                logging.info("Resource topic saved successfully.")
+        except Exception as e:
+            logging.error(f"Error saving resource topic: {e}")
+
+
+def delete_resource(topic):
+    with pooled_connection() as conn:
+        if conn is None:
+            logging.error("Failed to connect to the database.")
+            return
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM resources WHERE topic = %s;", (topic,))
+                notify_cache_invalidation(cur, "resource_matcher")
+                conn.commit()
+                metadata_cache.invalidate("resource_matcher")
+                logging.info("Resource topic deleted successfully.")
+        except Exception as e:
+            logging.error(f"Error deleting resource topic: {e}")
+
+
+# Compiled matcher plus the links per topic, cached with the other app metadata.
+# An empty table is cached too; saving a topic invalidates it.
+def get_resource_matcher():
+    cached = metadata_cache.get("resource_matcher")
+    if cached is not MISSING:
+        return cached
+
+    resources = _read_resources()
+    read = resources is not None
+    resources = resources or {}
+    keyword_topics = defaultdict(list)
+    for topic, resource in resources.items():
+        for keyword in resource["keywords"]:
+            keyword_topics[keyword.lower()].append(topic)
+    compiled = (KeywordMatcher(keyword_topics), {topic: r["links"] for topic, r in resources.items()})
+    if read:
+        metadata_cache.set("resource_matcher", compiled)
+    return compiled
+
+
+# Links for the top_k best-matching topics, or a general fallback
+def recommend_resources(prompt, top_k=None):
+    if top_k is None:
+        top_k = get_setting("RESOURCES_TOP_K", DEFAULT_RESOURCES_TOP_K, int)
+    matcher, links = get_resource_matcher()
+    scores = matcher.score(prompt)
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+    recommended = [link for topic, _ in ranked for link in links.get(topic, [])]
+    return recommended or GENERAL_RESOURCES
@@ -1,25 +1,48 @@
-import datetime
-import io
-import csv
 import logging
+import os
+import time
 import uuid
-from zoneinfo import ZoneInfo
 
 import streamlit as st
-import psycopg2
-import anthropic
 
-from app.chatlog.chatlog_handler import insert_chat_log, initialize_chatlog_table
+from app.cache.config_snapshot import load_config_snapshot
+from app.cache.invalidation import start_invalidation_listener
+from app.cache.response_cache import get_response_cache
+from app.chat.context_window import build_conversation_context, fold_conversation_context, new_context_state
+from app.chat.generation import DEFAULT_REPLY_MAX_TOKENS, get_claude_client, record_usage, stream_reply
+from app.chat.history import DEFAULT_HISTORY_PAGE_MESSAGES, ChatHistory, export_conversation_csv
+from app.chat.scheduler import SchedulerBusy, billable_tokens, get_llm_scheduler
+from app.chat.stream_renderer import StreamRenderer
+from app.chatlog.chatlog_handler import insert_chat_log
+from app.chatlog.summarizer import estimate_tokens
 from sidebar import setup_sidebar
-from app.db.database_connection import get_app_description, get_app_title, initialize_db, update_app_description
+from app.db.database_connection import get_app_description, get_app_title, get_database_url, update_app_description
+from app.config.settings import get_setting
+from app.db.migrations import ensure_schema
+from app.db.warmup import ensure_database_warm, start_database_keepalive
 from app.instructions.instructions_handler import get_latest_instructions
+from app.metrics.tracing import observe, start_metrics_exporters
+from app.resources.resources_handler import recommend_resources
 
 # Configure logging to display INFO level messages.
 logging.basicConfig(level=logging.INFO)
 
+# Whole-rerun timing for the admin Performance panel; exporters start once per process
+rerun_start = time.perf_counter()
+start_metrics_exporters()
+
 # Streamlit page configuration
 st.set_page_config(page_title="Teaching & Learning Chatbot", page_icon=":books:", layout="wide")
 
+# Wake the database in the background while the page renders from the local
+# config snapshot. Without a snapshot (first run) there is nothing to render
+# from, so wait for the database and apply pending migrations first.
+start_database_keepalive()
+if not ensure_database_warm() and not load_config_snapshot():
+    ensure_schema()
+# Admin edits on any replica invalidate this process's caches within moments
+start_invalidation_listener()
+
 # Initialize app title and description
 app_title = get_app_title()
 app_description = get_app_description() or "Chatbot to support teaching and learning"
@@ -31,37 +54,27 @@ if "is_admin" not in st.session_state:
     st.session_state["is_admin"] = False
 if "conversation_id" not in st.session_state:
     st.session_state["conversation_id"] = str(uuid.uuid4())
-if "messages" not in st.session_state:
-    st.session_state["messages"] = []
+# Only the recent tail of the conversation is kept here; older turns are read back from chat_logs
+if "history" not in st.session_state:
+    st.session_state["history"] = ChatHistory(st.session_state["conversation_id"])
+if "context_state" not in st.session_state:
+    st.session_state["context_state"] = new_context_state()
 
 # Sidebar setup
 setup_sidebar()
 
-# Fetch API key and Neon DB link from secrets
+# Fetch API key from secrets
 anthropic_api_key = st.secrets.get("ANTHROPIC_API_KEY")
-neon_db_link = st.secrets.get("NEON_DB_LINK")
 
-# Neon DB Connection: using NEON_DB_LINK consistently
-conn = None
-if neon_db_link:
-    try:
-        conn = psycopg2.connect(neon_db_link)
-        st.success("Connected to Neon DB successfully!")
-    except Exception as e:
-        st.error("Failed to connect to Neon DB. Please check your connection string in secrets.")
-        logging.error(f"Neon DB connection error: {e}")
-else:
+# Database access goes through the shared connection pool; only check that it is configured
+if not get_database_url():
     st.error("Neon DB connection link is missing in secrets!")
 
-# Initialize database and chatlog
-initialize_db()
-initialize_chatlog_table()
-
-# Initialize Anthropics Claude 3.5 Sonnet Client
+# Initialize the Anthropic Claude client, model from CLAUDE_MODEL (or the local fake, see USE_FAKE_ANTHROPIC)
 claude_client = None
-if anthropic_api_key:
+if anthropic_api_key or get_setting("USE_FAKE_ANTHROPIC", False, bool):
     try:
-        claude_client = anthropic.Client(api_key=anthropic_api_key)
+        claude_client = get_claude_client()
         st.success("Anthropic API initialized successfully!")
     except Exception as e:
         st.error("Failed to initialize Anthropics API. Please check your API key in secrets.")
@@ -69,79 +82,103 @@ if anthropic_api_key:
 else:
     st.error("Anthropic API key is missing in secrets!")
 
-# Chat UI: Display existing messages
-for message in st.session_state["messages"]:
+# Chat UI: Display the most recent messages, with earlier ones loaded on request
+history = st.session_state["history"]
+history_page = get_setting("HISTORY_PAGE_MESSAGES", DEFAULT_HISTORY_PAGE_MESSAGES, int)
+if "history_visible" not in st.session_state:
+    st.session_state["history_visible"] = history_page
+visible_messages, has_earlier = history.visible(st.session_state["history_visible"])
+if has_earlier and st.button("Load earlier messages"):
+    st.session_state["history_visible"] += history_page
+    st.rerun()
+for message in visible_messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
 # Chat input handling
 if prompt := st.chat_input("What would you like to ask?"):
-    st.session_state["messages"].append({"role": "user", "content": prompt})
+    # A new question collapses the view back to the latest messages
+    st.session_state["history_visible"] = history_page
+    history.append("user", prompt)
     with st.chat_message("user"):
         st.markdown(prompt)
 
     # Generate assistant response with Claude
     if claude_client:
-        conversation_context = [{"role": "system", "content": get_latest_instructions()}]
-        conversation_context += [{"role": m["role"], "content": m["content"]} for m in st.session_state["messages"]]
-    
-        with st.chat_message("assistant"):
-            message_placeholder = st.empty()
-            full_response = ""
-            try:
-                response = claude_client.completions.create(
-                    model="claude-3.5-sonnet",
-                    messages=conversation_context,
-                    max_tokens_to_sample=500,
-                    stop_sequences=["\n\n"],
-                    stream=True,
-                )
-                for chunk in response:
-                    if "completion" in chunk:
-                        full_response += chunk["completion"]
-                        message_placeholder.markdown(full_response + "▌")
-                    else:
-                        logging.warning(f"Unexpected chunk format: {chunk}")
-            except Exception as e:
-                st.error("An error occurred while processing your request.")
-                logging.error(f"Error: {e}")
-            finally:
-                message_placeholder.markdown(full_response)
-                if full_response:
-                    insert_chat_log(prompt, full_response, st.session_state["conversation_id"])
-                    st.session_state["messages"].append({"role": "assistant", "content": full_response})
+        instructions = get_latest_instructions()
+        # An opening question doesn't depend on earlier turns, so its answer can be shared
+        response_cache = get_response_cache() if len(history) == 1 else None
+        cached_response = response_cache.lookup(prompt, instructions) if response_cache else None
+
+        if cached_response is not None:
+            with st.chat_message("assistant"):
+                st.markdown(cached_response)
+            insert_chat_log(prompt, cached_response, st.session_state["conversation_id"], cache_hit=True)
+            history.append("assistant", cached_response)
+        else:
+            # Recent turns within the token budget; older ones live on as a rolling summary
+            system_blocks, conversation_context = build_conversation_context(
+                instructions,
+                history.messages,
+                st.session_state["context_state"],
+                offset=history.offset,
+            )
+            # Charged against the shared rate limits up front; the unused part is refunded
+            estimated_tokens = (sum(estimate_tokens(block["text"]) for block in system_blocks)
+                                + sum(estimate_tokens(m["content"]) for m in conversation_context)
+                                + get_setting("REPLY_MAX_TOKENS", DEFAULT_REPLY_MAX_TOKENS, int))
+
+            with st.chat_message("assistant"):
+                reply_placeholder = st.empty()
+                renderer = StreamRenderer(reply_placeholder)
+                usage = {}
+
+                # Shown while the request is queued; the first streamed text replaces it
+                def show_queue_position(ahead):
+                    if ahead:
+                        reply_placeholder.caption(f"Lots of questions right now. {ahead} ahead of yours, please wait...")
+
+                try:
+                    for text in get_llm_scheduler().stream(
+                        lambda: stream_reply(claude_client, system_blocks, conversation_context, usage),
+                        st.session_state["conversation_id"],
+                        estimated_tokens,
+                        usage_tokens=lambda: billable_tokens(usage),
+                        on_wait=show_queue_position,
+                    ):
+                        renderer.write(text)
+                except SchedulerBusy:
+                    st.warning("The class is asking a lot of questions right now. Please try again in a minute.")
+                except Exception as e:
+                    st.error("An error occurred while processing your request.")
+                    logging.error(f"Error: {e}")
+                finally:
+                    full_response = renderer.finish()
+                    observe("stream_render_frames", renderer.frames)
+                    if full_response:
+                        insert_chat_log(prompt, full_response, st.session_state["conversation_id"])
+                        history.append("assistant", full_response)
+                        # Older turns are folded into the rolling summary after the reply, never before it
+                        fold_conversation_context(claude_client, st.session_state["context_state"], history.messages,
+                                                  history.offset, st.session_state["conversation_id"])
+                        # Only complete answers are worth reusing
+                        if response_cache and usage.get("stop_reason") == "end_turn":
+                            response_cache.store(prompt, instructions, full_response)
+                    record_usage(usage)
+                    if st.session_state["is_admin"]:
+                        context_stats = st.session_state["context_state"]["last_stats"]
+                        st.caption(f"Context: {context_stats['sent_tokens']} tokens sent, "
+                                   f"{context_stats['saved_tokens']} saved by summarizing older turns. "
+                                   f"Prompt cache: {usage.get('cache_read_input_tokens', 0)} tokens read, "
+                                   f"{usage.get('cache_creation_input_tokens', 0)} written.")
 
         # Provide resources based on user query
-        def provide_resources(topic):
-            resources = {
-                "Python": [
-                    "Python Official Docs: https://docs.python.org",
-                    "W3Schools Python Tutorial: https://www.w3schools.com/python/"
-                ],
-                "Machine Learning": [
-                    "ML Crash Course by Google: https://developers.google.com/machine-learning/crash-course",
-                    "Scikit-learn User Guide: https://scikit-learn.org/stable/user_guide.html"
-                ],
-                "Web Development": [
-                    "MDN Web Docs: https://developer.mozilla.org",
-                    "FreeCodeCamp: https://www.freecodecamp.org/"
-                ],
-            }
-            return resources.get(topic, ["Explore more at: https://www.google.com"])
-
-        topic = "General"
-        lower_prompt = prompt.lower()
-        if "python" in lower_prompt:
-            topic = "Python"
-        elif "machine learning" in lower_prompt:
-            topic = "Machine Learning"
-        elif "web" in lower_prompt:
-            topic = "Web Development"
-
-        related_resources = provide_resources(topic)
+        related_resources = recommend_resources(prompt)
         st.markdown("\n\n**Related Resources:**\n" + "\n".join(related_resources))
     else:
         st.error("Claude API is not initialized. Please check your API key.")
+    # Turns already folded into the rolling summary can leave session memory
+    history.trim(st.session_state["context_state"]["folded"])
 
 # Admin actions
 if st.session_state["is_admin"]:
@@ -153,16 +190,19 @@ if st.session_state["is_admin"]:
         update_app_description(new_description)
         st.success("Application details updated successfully!")
 
-# Save conversation option
+# Save conversation option; the full conversation is streamed back from chat_logs
 if st.button("Download Conversation"):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Role", "Message"])
-    for msg in st.session_state["messages"]:
-        writer.writerow([msg["role"], msg["content"]])
-    st.download_button(
-        "Download Chat Log",
-        output.getvalue(),
-        file_name="chat_log.csv",
-        mime="text/csv",
-    )
+    conversation_path = export_conversation_csv(st.session_state["conversation_id"])
+    if conversation_path:
+        with open(conversation_path, "rb") as conversation_file:
+            st.download_button(
+                "Download Chat Log",
+                conversation_file,
+                file_name="chat_log.csv",
+                mime="text/csv",
+            )
+        os.remove(conversation_path)
+    else:
+        st.info("There is no conversation to download yet.")
+
+observe("rerun_seconds", time.perf_counter() - rerun_start)
@@ -1,19 +1,50 @@
+import os
+
 import streamlit as st
-from app.chatlog.chatlog_handler import compile_summaries, delete_all_chatlogs, export_chat_logs_to_csv, drop_chatlog_table, fetch_and_batch_chatlogs, generate_summary_for_each_group
+from app.analytics.analytics_handler import clear_activity_rollup, get_activity_analytics
+from app.chatlog.chatlog_handler import delete_all_chatlogs, export_chat_logs_to_csv, drop_chatlog_table, search_chat_logs
+from app.chat.scheduler import get_llm_scheduler
+from app.chatlog.retention import DEFAULT_RETENTION_DAYS, apply_retention
+from app.chatlog.summary_store import clear_conversation_summaries
+from app.jobs.job_runner import enqueue_summary_job, get_summary_job, requeue_summary_job, summary_jobs_in_process
 from app.instructions.instructions_handler import get_latest_instructions, update_instructions
-from app.db.database_connection import  drop_instructions_table, get_app_description, update_app_description, get_app_title, update_app_title
+from app.cache.invalidation import get_invalidation_listener_status
+from app.cache.response_cache import get_response_cache
+from app.cache.ttl_cache import get_metadata_cache_stats
+from app.config.settings import get_setting
+from app.metrics.tracing import metrics
+from app.db.migrations import run_migrations
+from app.resources.resources_handler import delete_resource, fetch_resources, save_resource
+from app.db.database_connection import  drop_instructions_table, get_app_description, update_app_description, get_app_title, update_app_title, get_pool, get_query_count
 custominstructions_area_height = 300
-app_title = get_app_title()
-app_description = get_app_description()
 
-def load_summaries():
-    # Placeholder function call - replace with actual function logic
-    batches = fetch_and_batch_chatlogs()
-    group_summaries = generate_summary_for_each_group(batches) 
-    final_summary_output = compile_summaries(group_summaries)
-    return final_summary_output
+# Latest summary job: progress while it runs, a resume button if it failed, the summary once done
+def show_summary_job(job):
+    if job is None:
+        return
+    if job["status"] in ("queued", "running"):
+        done = job["done"] + job["failed"]
+        if job["status"] == "running":
+            text = f"Summarized {done} of {job['total']} updated conversations"
+        elif summary_jobs_in_process():
+            text = "Summary job queued..."
+        else:
+            text = "Summary job queued; it starts once a worker runs `python -m app.jobs.job_runner run --loop`."
+        st.progress(done / job["total"] if job["total"] else 0.0, text=text)
+        st.button("Refresh status", key="refresh_summary_job")
+    elif job["status"] == "failed":
+        st.warning(f"Summary job {job['id']} stopped after {job['done']} of {job['total']} conversations: {job['error']}")
+        if st.button("Resume job", key="resume_summary_job"):
+            requeue_summary_job(job["id"])
+            st.rerun()
+    else:
+        st.caption(f"Summary job {job['id']} finished {job['finished_at']:%Y-%m-%d %H:%M}; {job['done']} conversations refreshed.")
+        st.write(job["result"])
 
 def setup_sidebar():
+    # Served from the metadata cache, so this is cheap on every rerun
+    app_title = get_app_title()
+    app_description = get_app_description()
     with st.sidebar:
         st.title("Settings")
         with st.expander("🔑 Admin login"):
@@ -53,29 +84,174 @@ def setup_sidebar():
                     st.success("Instructions updated successfully")
                     st.rerun()
 
-            with st.expander("💬 Chatlog and insights"):
-                csv_data = export_chat_logs_to_csv()
-                if st.button("View Summary"):
-                    # Generate or fetch summaries
-                    summaries_text = load_summaries()
-                    # Store the summaries in session state to persist the data
-                    st.session_state["summaries_text"] = summaries_text
-                    st.success("Summaries loaded.")
+            with st.expander("📚 Related resources"):
+                resources = fetch_resources()
+                selected_topic = st.selectbox("Topic", ["New topic"] + list(resources), key="resource_topic")
+                existing = resources.get(selected_topic, {"keywords": [], "links": []})
+                topic_name = st.text_input("Topic name", value="" if selected_topic == "New topic" else selected_topic, key=f"resource_name_{selected_topic}")
+                keywords = st.text_input("Keywords (comma-separated)", value=", ".join(existing["keywords"]), key=f"resource_keywords_{selected_topic}")
+                links = st.text_area("Resources (one per line)", value="\n".join(existing["links"]), key=f"resource_links_{selected_topic}")
+                if st.button("Save topic", key="save_resource"):
+                    if topic_name.strip():
+                        save_resource(topic_name, keywords.split(","), links.splitlines())
+                        st.success("Resource topic saved")
+                        st.rerun()
+                    else:
+                        st.error("Topic name is required")
+                if selected_topic != "New topic" and st.button("Delete topic", key="delete_resource"):
+                    delete_resource(selected_topic)
+                    st.success("Resource topic deleted")
+                    st.rerun()
 
-                    # Immediately display the summaries after loading
-                    # Use a modal-like expander to show the summaries
-                    st.write(st.session_state["summaries_text"])
-                if csv_data:
-                    st.download_button(label="Download Chat Logs", data=csv_data, file_name='chat_logs.csv', mime='text/csv',)
+            with st.expander("💬 Chatlog and insights"):
+                # Summaries are produced by a background job, so the page never waits on them
+                use_batch_api = st.checkbox("Use the Message Batches API (cheaper, slower)", key="summary_batch_api")
+                job = get_summary_job()
+                # One job at a time: it already covers every conversation changed so far
+                active = job is not None and job["status"] in ("queued", "running")
+                if st.button("Summarize chat logs", disabled=active):
+                    if enqueue_summary_job(use_batch_api) is None:
+                        st.error("Could not queue the summary job.")
+                    job = get_summary_job()
+                show_summary_job(job)
+                # The export only runs when requested, never on a plain rerun
+                export_start = st.date_input("Export from", value=None, key="export_start_date")
+                export_end = st.date_input("Export to", value=None, key="export_end_date")
+                export_conversation_id = st.text_input("Conversation ID (optional)", key="export_conversation_id")
+                export_compressed = st.checkbox("Compress export (gzip)", key="export_compressed")
+                if st.button("Prepare chat log export"):
+                    export_path = export_chat_logs_to_csv(
+                        start_date=export_start,
+                        end_date=export_end,
+                        conversation_id=export_conversation_id.strip() or None,
+                        compress=export_compressed,
+                    )
+                    if export_path:
+                        with open(export_path, "rb") as export_file:
+                            if export_compressed:
+                                st.download_button(label="Download Chat Logs", data=export_file, file_name='chat_logs.csv.gz', mime='application/gzip',)
+                            else:
+                                st.download_button(label="Download Chat Logs", data=export_file, file_name='chat_logs.csv', mime='text/csv',)
+                        os.remove(export_path)
+                    else:
+                        st.info("No chat logs to export for the selected filters.")
                 if st.button("Delete All Chat Logs"):
                     delete_all_chatlogs()
+                    clear_conversation_summaries()
+                    clear_activity_rollup()
+            with st.expander("🔎 Search chat logs"):
+                search_query = st.text_input("Search prompts and responses", key="search_query",
+                                             help='e.g. recursion, "for loop", list -tuple')
+                search_start = st.date_input("From", value=None, key="search_start_date")
+                search_end = st.date_input("To", value=None, key="search_end_date")
+                search_conversation_id = st.text_input("Conversation ID (optional)", key="search_conversation_id")
+                if st.button("Search"):
+                    # cursors holds the keyset position of every page visited, for paging back
+                    st.session_state["chatlog_search"] = {
+                        "query": search_query,
+                        "start_date": search_start,
+                        "end_date": search_end,
+                        "conversation_id": search_conversation_id.strip() or None,
+                        "cursors": [None],
+                    }
+                search = st.session_state.get("chatlog_search")
+                if search:
+                    page = search_chat_logs(search["query"], search["start_date"], search["end_date"],
+                                            search["conversation_id"], after=search["cursors"][-1])
+                    if page is None:
+                        st.error("Search failed. Check the conversation ID and try again.")
+                    elif not page["rows"]:
+                        st.info("No matching chat logs.")
+                    else:
+                        st.caption(f"Page {len(search['cursors'])}")
+                        for log in page["rows"]:
+                            st.markdown(f"**{log['timestamp']:%Y-%m-%d %H:%M}** · `{log['conversation_id']}`")
+                            st.markdown(f"Q: {log['prompt']}")
+                            st.markdown(f"A: {log['response']}")
+                            st.divider()
+                        if len(search["cursors"]) > 1 and st.button("Previous page"):
+                            search["cursors"].pop()
+                            st.rerun()
+                        if page["next_cursor"] and st.button("Next page"):
+                            search["cursors"].append(page["next_cursor"])
+                            st.rerun()
+            with st.expander("📊 Activity"):
+                analytics_days = st.selectbox("Period", [7, 30, 90], index=1, format_func=lambda d: f"Last {d} days", key="analytics_days")
+                analytics = get_activity_analytics(analytics_days)
+                if analytics is None:
+                    st.error("Could not load activity analytics.")
+                elif not analytics["messages_per_day"]:
+                    st.info("No chat activity in this period.")
+                else:
+                    turns = analytics["turns"]
+                    st.caption(f"{turns['conversations']} conversations, {turns['average_turns']:.1f} turns on average "
+                               f"(longest {turns['max_turns']}).")
+                    st.caption("Messages per day")
+                    st.bar_chart(analytics["messages_per_day"], x="day", y="messages")
+                    st.caption("Active conversations per hour (last 3 days at most)")
+                    st.line_chart(analytics["conversations_per_hour"], x="hour", y="conversations")
+                    st.caption("Busiest periods")
+                    st.dataframe(analytics["busiest_periods"], hide_index=True)
+            with st.expander("📈 Performance"):
+                snapshot = metrics.snapshot()
+                if snapshot["histograms"]:
+                    st.caption("Latencies in seconds (p50/p95/p99 over recent samples)")
+                    st.dataframe(
+                        [{"metric": row["name"],
+                          "labels": ", ".join(f"{k}={v}" for k, v in row["labels"].items()),
+                          "count": row["count"], "p50": row["p50"], "p95": row["p95"], "p99": row["p99"]}
+                         for row in snapshot["histograms"]],
+                        hide_index=True,
+                    )
+                if snapshot["counters"]:
+                    st.dataframe(
+                        [{"counter": row["name"],
+                          "labels": ", ".join(f"{k}={v}" for k, v in row["labels"].items()),
+                          "value": row["value"]}
+                         for row in snapshot["counters"]],
+                        hide_index=True,
+                    )
+                pool_size = get_pool().size()
+                st.caption(f"DB pool: {pool_size['in_use']} in use, {pool_size['idle']} idle, max {pool_size['max_size']}. "
+                           f"Queries this process: {get_query_count()}.")
+                scheduler = get_llm_scheduler()
+                scheduler_size = scheduler.size()
+                st.caption(f"Claude requests: {scheduler_size['running']} running, {scheduler_size['waiting']} queued "
+                           f"(max {scheduler_size['max_concurrency']} at once). {scheduler.stats}")
+                cache_stats = get_metadata_cache_stats()
+                st.caption(f"Config cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses.")
+                listener_status = get_invalidation_listener_status()
+                st.caption(f"Cross-replica invalidation: {'listening' if listener_status['connected'] else 'not connected'}"
+                           f" (cache TTL {cache_stats['ttl']:.0f}s).")
+                response_cache = get_response_cache()
+                if response_cache:
+                    st.caption(f"Response cache: {response_cache.stats}")
+                st.download_button("Download metrics (Prometheus format)", metrics.render_prometheus(),
+                                   file_name="chergpt_metrics.txt", mime="text/plain")
+
             with st.expander("⚠️ Warning: destructive actions"):
+                retention_days = st.number_input("Keep chat logs for (days)", min_value=1,
+                                                 value=get_setting("CHATLOG_RETENTION_DAYS", DEFAULT_RETENTION_DAYS, int),
+                                                 key="retention_days")
+                if st.button("Archive and delete older chat logs"):
+                    with st.spinner("Archiving and deleting expired chat logs..."):
+                        retention = apply_retention(keep_days=int(retention_days))
+                    if retention is None:
+                        st.error("Retention failed; see the logs. Nothing was deleted unless it was archived.")
+                    else:
+                        st.success(f"Removed chat logs before {retention['cutoff']}: {retention['archived']} archived, "
+                                   f"{retention['deleted']} deleted, {len(retention['partitions_dropped'])} partitions dropped.")
                 if st.button("Drop chatlog table"):
                     drop_chatlog_table()
+                    clear_conversation_summaries()
+                    clear_activity_rollup()
+                    # Recreate the (now empty) table right away
+                    run_migrations(reapply=True)
                     st.success("Chatlog table dropped")
                     st.rerun()
                 if st.button("Drop instructions table"):
                     drop_instructions_table()
+                    run_migrations(reapply=True)
                     st.success("Instructions table dropped")
                     st.rerun()
 
@@ -0,0 +1,49 @@
+import psycopg2
+import pytest
+
+from app.cache import config_snapshot
+from app.cache.ttl_cache import metadata_cache
+from app.chat import generation
+from app.chat.fake_client import FakeAnthropicClient
+from app.chatlog.chatlog_writer import flush_chat_logs
+from app.db import database_connection
+from app.db.migrations import run_migrations
+from tests.database import TEST_DATABASE_URL
+
+
+# An empty test database, reached through a fresh pool, with nothing migrated
+# and a config snapshot of its own
+@pytest.fixture
+def empty_database(monkeypatch, tmp_path):
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    monkeypatch.setenv("NEON_DB_LINK", TEST_DATABASE_URL)
+    monkeypatch.delenv("DB_CONNECTION", raising=False)
+    monkeypatch.setenv("CONFIG_SNAPSHOT_PATH", str(tmp_path / "config_snapshot.json"))
+    monkeypatch.setattr(config_snapshot, "_snapshot", None)
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    conn.close()
+    monkeypatch.setattr(database_connection, "_pool", None)
+    metadata_cache.invalidate()
+    yield
+    # Chat logs queued by the test must not reach the next test's schema
+    flush_chat_logs(timeout=5)
+    database_connection.get_pool().close_all()
+    metadata_cache.invalidate()
+
+
+# The test database with every migration applied
+@pytest.fixture
+def database(empty_database):
+    assert run_migrations()
+
+
+# The fake Claude client in place of the process-wide Anthropic client
+@pytest.fixture
+def fake_claude(monkeypatch):
+    client = FakeAnthropicClient(reply="A summary.")
+    monkeypatch.setattr(generation, "_client", client)
+    return client
@@ -0,0 +1,15 @@
+import os
+
+from app.db.database_connection import pooled_connection
+
+# Tests using the database fixtures (see conftest.py) run against this Postgres
+# database and are skipped without it. Its public schema is dropped before every
+# such test, so never point it at a database holding real data.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+# Run one statement in its own transaction; returns the rows, if any
+def execute(sql, params=None):
+    with pooled_connection() as conn, conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall() if cur.description else None
@@ -0,0 +1,84 @@
+import psycopg2
+import pytest
+
+from app.analytics.analytics_handler import clear_activity_rollup, refresh_activity_rollup
+from app.db.database_connection import pooled_connection
+
+from tests.database import TEST_DATABASE_URL, execute
+
+
+@pytest.fixture
+def rollup(database, monkeypatch):
+    monkeypatch.setenv("ANALYTICS_ROLLUP_LAG", "0")
+
+
+def log(timestamp, conversation_id=None):
+    execute("INSERT INTO chat_logs (timestamp, prompt, response, conversation_id) VALUES (%s, 'q', 'a', %s)",
+            (timestamp, conversation_id))
+
+
+def refresh():
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            refresh_activity_rollup(cur)
+
+
+def hourly():
+    return {str(hour): messages for hour, messages in execute("SELECT hour, messages FROM chat_activity_hourly")}
+
+
+def test_rollup_counts_messages_per_hour(rollup):
+    log("2024-05-06 09:10")
+    log("2024-05-06 09:50")
+    log("2024-05-06 10:05")
+    refresh()
+    assert hourly() == {"2024-05-06 09:00:00": 2, "2024-05-06 10:00:00": 1}
+
+
+def test_late_rows_are_counted_however_late(rollup):
+    log("2024-05-06 09:10")
+    refresh()
+    log("2024-05-08 15:00")
+    refresh()
+    refresh()
+    # Written days after its timestamp, e.g. after the writer's retries
+    log("2024-05-06 09:20")
+    refresh()
+    assert hourly() == {"2024-05-06 09:00:00": 2, "2024-05-08 15:00:00": 1}
+
+
+def test_settled_hours_are_not_recomputed(rollup):
+    log("2024-05-06 09:10")
+    refresh()
+    refresh()
+    execute("UPDATE chat_activity_hourly SET messages = 99")
+    log("2024-05-06 10:10")
+    refresh()
+    assert hourly() == {"2024-05-06 09:00:00": 99, "2024-05-06 10:00:00": 1}
+
+
+def test_rows_committed_out_of_id_order_are_not_skipped(rollup, monkeypatch):
+    monkeypatch.setenv("ANALYTICS_ROLLUP_LAG", "0.2")
+    slow_writer = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        with slow_writer.cursor() as cur:
+            cur.execute("INSERT INTO chat_logs (timestamp, prompt, response) VALUES ('2024-05-06 09:30', 'late', 'late')")
+        log("2024-05-06 10:10")
+        refresh()
+        refresh()
+        slow_writer.commit()
+    finally:
+        slow_writer.close()
+    execute("SELECT pg_sleep(0.3)")
+    refresh()
+    assert hourly() == {"2024-05-06 09:00:00": 1, "2024-05-06 10:00:00": 1}
+
+
+def test_clearing_the_rollup_recomputes_from_scratch(rollup):
+    log("2024-05-06 09:10")
+    refresh()
+    refresh()
+    clear_activity_rollup()
+    assert hourly() == {}
+    refresh()
+    assert hourly() == {"2024-05-06 09:00:00": 1}
@@ -0,0 +1,72 @@
+import uuid
+from datetime import date
+
+import pytest
+
+from app.chatlog.chatlog_handler import SEARCH_DOCUMENT, search_chat_logs
+
+from tests.database import execute
+
+CONVERSATION = uuid.UUID("00000000-0000-0000-0000-000000000001")
+
+
+# 25 rows a day apart from 2024-01-01; every fifth is about recursion and in CONVERSATION
+@pytest.fixture
+def chat_logs(database):
+    for n in range(25):
+        topic = "recursion" if n % 5 == 0 else "loops"
+        execute(
+            "INSERT INTO chat_logs (timestamp, prompt, response, conversation_id) VALUES (%s, %s, %s, %s)",
+            (f"2024-01-{n + 1:02d} 12:00", f"Question {n} about {topic}", f"Answer {n}",
+             str(CONVERSATION) if topic == "recursion" else None),
+        )
+
+
+def all_pages(**filters):
+    pages = []
+    after = None
+    while True:
+        page = search_chat_logs(after=after, page_size=4, **filters)
+        pages.append([row["id"] for row in page["rows"]])
+        after = page["next_cursor"]
+        if after is None:
+            return pages
+
+
+def test_keyset_pages_cover_every_row_once_newest_first(chat_logs):
+    pages = all_pages()
+    ids = [log_id for page in pages for log_id in page]
+    assert [len(page) for page in pages] == [4, 4, 4, 4, 4, 4, 1]
+    assert ids == list(range(25, 0, -1))
+
+
+def test_search_matches_stems_and_highlights(chat_logs):
+    page = search_chat_logs("recursive", page_size=10)
+    assert [row["id"] for row in page["rows"]] == [21, 16, 11, 6, 1]
+    assert "**recursion**" in page["rows"][0]["prompt"]
+    assert page["next_cursor"] is None
+
+
+def test_search_pages_through_matches(chat_logs):
+    assert all_pages(query="recursion") == [[21, 16, 11, 6], [1]]
+
+
+def test_filters_by_date_range_and_conversation(chat_logs):
+    page = search_chat_logs(start_date=date(2024, 1, 3), end_date=date(2024, 1, 5))
+    assert [row["id"] for row in page["rows"]] == [5, 4, 3]
+    page = search_chat_logs(conversation_id=CONVERSATION)
+    assert {row["conversation_id"] for row in page["rows"]} == {str(CONVERSATION)}
+    assert len(page["rows"]) == 5
+
+
+def test_invalid_conversation_id(chat_logs):
+    assert search_chat_logs(conversation_id="not-a-uuid") is None
+
+
+def test_search_uses_the_expression_index(chat_logs):
+    execute("ANALYZE chat_logs")
+    plan = execute(
+        "SET LOCAL enable_seqscan = off; EXPLAIN SELECT id FROM chat_logs WHERE "
+        + SEARCH_DOCUMENT + " @@ websearch_to_tsquery('english', 'recursion')"
+    )
+    assert "chat_logs_search_idx" in " ".join(line for (line,) in plan)
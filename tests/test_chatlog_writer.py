@@ -0,0 +1,159 @@
+import threading
+import time
+
+from app.chatlog.chatlog_writer import ChatLogWriter
+
+
+class RecordingWriter:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self._lock = threading.Lock()
+
+    def __call__(self, records):
+        with self._lock:
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("database unavailable")
+            self.batches.append(list(records))
+
+    @property
+    def records(self):
+        return [record for batch in self.batches for record in batch]
+
+
+def record(n, conversation_id="c1"):
+    return (f"prompt {n}", f"response {n}", None, conversation_id, False)
+
+
+def make_writer(write_batch, batch_size=3, flush_interval=10.0, queue_size=100, max_retries=0):
+    return ChatLogWriter(write_batch, batch_size=batch_size, flush_interval=flush_interval,
+                         queue_size=queue_size, max_retries=max_retries)
+
+
+def test_full_batches_are_written_together():
+    sink = RecordingWriter()
+    writer = make_writer(sink, batch_size=3)
+    for n in range(6):
+        writer.enqueue(record(n))
+    assert writer.flush(timeout=2)
+    assert [len(batch) for batch in sink.batches] == [3, 3]
+    assert sink.records == [record(n) for n in range(6)]
+    assert writer.stats["written"] == 6
+
+
+def test_flush_does_not_wait_out_the_batching_window():
+    sink = RecordingWriter()
+    writer = make_writer(sink, batch_size=50, flush_interval=10.0)
+    writer.enqueue(record(1))
+    start = time.monotonic()
+    assert writer.flush(timeout=5)
+    assert time.monotonic() - start < 1.0
+    assert sink.records == [record(1)]
+
+
+def test_flush_waits_only_for_records_queued_before_it():
+    sink = RecordingWriter()
+    writer = make_writer(sink, batch_size=50, flush_interval=0.3)
+    stop = threading.Event()
+
+    def other_sessions():
+        n = 0
+        while not stop.is_set():
+            writer.enqueue(record(n, "other"))
+            n += 1
+            time.sleep(0.01)
+
+    load = threading.Thread(target=other_sessions)
+    load.start()
+    try:
+        time.sleep(0.1)
+        writer.enqueue(record("mine", "mine"))
+        start = time.monotonic()
+        assert writer.flush(timeout=3, conversation_id="mine")
+        assert time.monotonic() - start < 1.0
+        assert record("mine", "mine") in sink.records
+        assert writer.flush(timeout=3)
+    finally:
+        stop.set()
+        load.join()
+
+
+def test_flush_of_an_unknown_conversation_returns_at_once():
+    writer = make_writer(RecordingWriter())
+    assert writer.flush(timeout=0, conversation_id="never-logged")
+
+
+def test_failed_batches_are_retried():
+    sink = RecordingWriter(failures=1)
+    writer = make_writer(sink, batch_size=1, max_retries=2)
+    writer._write_with_retry([record(1)])
+    assert sink.records == [record(1)]
+    assert writer.stats["retries"] == 1
+
+
+def test_batches_are_dropped_after_the_last_retry():
+    sink = RecordingWriter(failures=5)
+    writer = make_writer(sink, batch_size=1, max_retries=0)
+    writer.enqueue(record(1))
+    assert not writer.flush(timeout=2)
+    assert sink.records == []
+    assert writer.stats["dropped"] == 1
+    # Reported once; later records are written again
+    writer.enqueue(record(2))
+    sink.failures = 0
+    assert writer.flush(timeout=2)
+    assert sink.records == [record(2)]
+
+
+def test_a_conversation_flush_reports_only_its_own_drops():
+    sink = RecordingWriter(failures=1)
+    writer = make_writer(sink, batch_size=1, max_retries=0)
+    writer.enqueue(record(1, "lost"))
+    writer.enqueue(record(2, "kept"))
+    assert writer.flush(timeout=2, conversation_id="kept")
+    assert not writer.flush(timeout=2, conversation_id="lost")
+    assert writer.flush(timeout=2, conversation_id="lost")
+    assert writer.flush(timeout=2)
+
+
+def test_stats_are_exact_under_concurrent_enqueues():
+    writer = make_writer(RecordingWriter(), batch_size=10)
+    threads = [threading.Thread(target=lambda: [writer.enqueue(record(n)) for n in range(500)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert writer.flush(timeout=5)
+    assert writer.stats["enqueued"] == writer.stats["written"] == 4000
+
+
+def test_full_queue_writes_inline():
+    sink = RecordingWriter()
+    # Keep the background thread busy so the one-slot queue stays full
+    blocker = threading.Event()
+
+    def slow_write(records):
+        blocker.wait(2)
+        sink(records)
+
+    writer = make_writer(slow_write, batch_size=1, queue_size=1)
+    writer.enqueue(record(1))
+    time.sleep(0.3)  # taken by the background thread, which now waits
+    writer.enqueue(record(2))  # fills the queue
+    assert writer.pending() == 1
+    inline = threading.Thread(target=writer.enqueue, args=(record(3),))
+    inline.start()
+    blocker.set()
+    inline.join(2)
+    assert writer.flush(timeout=2)
+    assert sorted(sink.records) == [record(1), record(2), record(3)]
+
+
+def test_shutdown_drains_the_queue():
+    sink = RecordingWriter()
+    writer = make_writer(sink, batch_size=50, flush_interval=10.0)
+    for n in range(5):
+        writer.enqueue(record(n))
+    writer.shutdown(timeout=2)
+    assert sink.records == [record(n) for n in range(5)]
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from app.cache import config_snapshot
+from app.cache.config_snapshot import get_snapshot_value, load_config_snapshot, update_config_snapshot
+from app.cache.ttl_cache import MISSING
+
+
+@pytest.fixture
+def path(monkeypatch, tmp_path):
+    path = tmp_path / "cache" / "config_snapshot.json"
+    monkeypatch.setenv("CONFIG_SNAPSHOT_PATH", str(path))
+    monkeypatch.setattr(config_snapshot, "_snapshot", None)
+    return path
+
+
+def reload():
+    config_snapshot._snapshot = None
+
+
+def test_no_snapshot_yet(path):
+    assert load_config_snapshot() == {}
+    assert get_snapshot_value("app_title") is MISSING
+
+
+def test_values_survive_a_restart(path):
+    update_config_snapshot("app_title", "CherGPT")
+    update_config_snapshot("app_description", "Ask me about Python")
+    reload()
+    assert load_config_snapshot() == {"app_title": "CherGPT", "app_description": "Ask me about Python"}
+    assert not path.with_name(path.name + ".tmp").exists()
+
+
+def test_unchanged_values_are_not_rewritten(path):
+    update_config_snapshot("app_title", "CherGPT")
+    path.write_text(json.dumps({"app_title": "CherGPT", "marker": True}), encoding="utf-8")
+    update_config_snapshot("app_title", "CherGPT")
+    assert json.loads(path.read_text(encoding="utf-8"))["marker"]
+
+
+def test_unreadable_snapshot_is_ignored(path):
+    path.parent.mkdir(parents=True)
+    path.write_text("{not json", encoding="utf-8")
+    assert load_config_snapshot() == {}
+    update_config_snapshot("app_title", "CherGPT")
+    assert json.loads(path.read_text(encoding="utf-8")) == {"app_title": "CherGPT"}
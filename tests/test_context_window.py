@@ -0,0 +1,101 @@
+from app.chat.context_window import build_conversation_context, fold_conversation_context, new_context_state
+from app.chat.fake_client import FakeAnthropicClient
+
+
+def conversation(turns, words=50):
+    messages = []
+    for n in range(turns):
+        messages.append({"role": "user", "content": f"question {n} " + "word " * words})
+        messages.append({"role": "assistant", "content": f"answer {n} " + "word " * words})
+    return messages
+
+
+def ask(messages, n):
+    return messages + [{"role": "user", "content": f"new question {n}"}]
+
+
+def fold(client, state, messages, offset=0):
+    thread = fold_conversation_context(client, state, messages, offset)
+    if thread:
+        thread.join(5)
+    return thread
+
+
+def test_short_conversation_is_sent_whole():
+    state = new_context_state()
+    messages = ask(conversation(2), 1)
+    system, window = build_conversation_context("Be helpful.", messages, state, token_budget=4000)
+    assert window == messages
+    assert [block["text"] for block in system] == ["Be helpful."]
+    assert fold(FakeAnthropicClient(), state, messages) is None
+
+
+def test_older_turns_are_folded_after_the_reply():
+    client = FakeAnthropicClient(reply="They asked about loops.")
+    state = new_context_state()
+    messages = ask(conversation(10), 1)
+    _, window = build_conversation_context("Be helpful.", messages, state, token_budget=300)
+    # Nothing is dropped before it has been summarized
+    assert window == messages
+    assert 0 < state["fold_to"] < len(messages)
+
+    assert fold(client, state, messages)
+    assert state["summary"] == "They asked about loops."
+    assert state["folded"] == state["fold_to"]
+    system, window = build_conversation_context("Be helpful.", messages, state, token_budget=300)
+    assert window == messages[state["folded"]:]
+    assert window[0]["role"] == "user"
+    assert "They asked about loops." in system[-1]["text"]
+    assert state["last_stats"]["saved_tokens"] > 0
+
+
+def test_folding_is_incremental():
+    client = FakeAnthropicClient(reply="Summary.")
+    state = new_context_state()
+    messages = ask(conversation(10), 1)
+    build_conversation_context("", messages, state, token_budget=300)
+    fold(client, state, messages)
+    first = state["folded"]
+    messages = ask(messages[:-1] + [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a " * 200}], 2)
+    build_conversation_context("", messages, state, token_budget=300)
+    fold(client, state, messages)
+    assert state["folded"] > first
+    # Only the newly folded turns and the summary so far are sent to be summarized
+    text = client.requests[-1]["messages"][0]["content"]
+    assert text.startswith("Summary so far:\nSummary.")
+    assert "question 0 " not in text
+
+
+def test_recent_messages_are_always_sent():
+    state = new_context_state()
+    messages = ask(conversation(3, words=500), 1)
+    _, window = build_conversation_context("", messages, state, token_budget=10)
+    assert window == messages
+    assert state["fold_to"] == len(messages) - 3
+
+
+def test_failed_fold_is_retried_next_turn():
+    def fail(messages):
+        raise ConnectionError("overloaded")
+
+    state = new_context_state()
+    messages = ask(conversation(10), 1)
+    build_conversation_context("", messages, state, token_budget=300)
+    fold(FakeAnthropicClient(reply=fail), state, messages)
+    assert (state["summary"], state["folded"], state["folding"]) == ("", 0, False)
+    fold(FakeAnthropicClient(reply="Summary."), state, messages)
+    assert state["summary"] == "Summary."
+
+
+def test_tail_with_an_offset():
+    client = FakeAnthropicClient(reply="Summary.")
+    state = new_context_state()
+    messages = ask(conversation(10), 1)
+    build_conversation_context("", messages, state, token_budget=300)
+    fold(client, state, messages)
+    assert state["folded"] >= 4
+    # The history dropped the first four (already folded) messages
+    tail = messages[4:]
+    _, window = build_conversation_context("", tail, state, token_budget=300, offset=4)
+    assert window == messages[state["folded"]:]
+    assert state["last_stats"]["summarized_messages"] == state["folded"]
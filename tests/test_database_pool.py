@@ -0,0 +1,140 @@
+import psycopg2.extensions
+
+from app.db.database_connection import ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, vars=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.queries.append(query)
+
+
+# Just enough of a psycopg2 connection for the pool
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.in_transaction = False
+        self.rollbacks = 0
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(max_size=2, checkout_timeout=0.05, health_check_interval=30.0):
+    connections = []
+
+    def connect():
+        conn = FakeConnection()
+        connections.append(conn)
+        return conn
+
+    pool = ConnectionPool(connect, max_size=max_size, checkout_timeout=checkout_timeout,
+                          health_check_interval=health_check_interval)
+    return pool, connections
+
+
+def test_released_connection_is_reused():
+    pool, connections = make_pool()
+    conn = pool.checkout()
+    pool.release(conn)
+    assert pool.checkout() is conn
+    assert pool.stats["connects"] == 1
+    assert pool.stats["checkouts"] == 2
+    assert pool.last_activity is not None
+
+
+def test_release_rolls_back_an_open_transaction():
+    pool, _ = make_pool()
+    conn = pool.checkout()
+    conn.in_transaction = True
+    pool.release(conn)
+    assert conn.rollbacks == 1
+    assert pool.size() == {"idle": 1, "in_use": 0, "max_size": 2}
+
+
+def test_discarded_connection_is_closed_and_replaced():
+    pool, connections = make_pool()
+    conn = pool.checkout()
+    pool.release(conn, discard=True)
+    assert conn.closed
+    assert pool.stats["discarded"] == 1
+    assert pool.checkout() is not conn
+    assert len(connections) == 2
+
+
+def test_checkout_times_out_when_exhausted():
+    pool, _ = make_pool(max_size=1)
+    conn = pool.checkout()
+    assert pool.checkout() is None
+    assert pool.stats["timeouts"] == 1
+    pool.release(conn)
+    assert pool.checkout() is conn
+    assert pool.stats["peak_in_use"] == 1
+
+
+def test_failed_connect_frees_the_slot():
+    pool = ConnectionPool(lambda: None, max_size=1, checkout_timeout=0.05, health_check_interval=30.0)
+    assert pool.checkout() is None
+    assert pool.checkout() is None
+    # Both attempts got the slot, so neither waited for it
+    assert pool.stats["timeouts"] == 0
+
+
+def test_recently_used_connection_skips_the_health_check():
+    pool, _ = make_pool(health_check_interval=30.0)
+    conn = pool.checkout()
+    pool.release(conn)
+    assert pool.checkout() is conn
+    assert conn.queries == []
+
+
+def test_health_check_pings_idle_connections():
+    pool, _ = make_pool(health_check_interval=0.0)
+    conn = pool.checkout()
+    pool.release(conn)
+    assert pool.checkout() is conn
+    assert conn.queries == ["SELECT 1"]
+
+
+def test_health_check_discards_dead_connections():
+    pool, connections = make_pool(health_check_interval=0.0)
+    conn = pool.checkout()
+    pool.release(conn)
+    conn.broken = True
+    replacement = pool.checkout()
+    assert replacement is not conn
+    assert conn.closed
+    assert pool.stats["discarded"] == 1
+    assert len(connections) == 2
+
+
+def test_closed_connection_is_never_handed_out():
+    pool, _ = make_pool()
+    conn = pool.checkout()
+    pool.release(conn)
+    conn.closed = 1
+    assert pool.checkout() is not conn
@@ -0,0 +1,81 @@
+import csv
+import os
+import uuid
+
+from app.chat.history import ChatHistory, export_conversation_csv
+from app.chatlog.chatlog_handler import insert_chat_log
+
+CONVERSATION = str(uuid.UUID(int=7))
+
+
+def chat(history, turns, start=0):
+    for n in range(start, start + turns):
+        history.append("user", f"q{n}")
+        history.append("assistant", f"a{n}")
+        insert_chat_log(f"q{n}", f"a{n}", CONVERSATION)
+
+
+def contents(messages):
+    return [m["content"] for m in messages]
+
+
+def test_trim_spills_whole_exchanges():
+    history = ChatHistory(CONVERSATION, max_messages=4)
+    for n in range(5):
+        history.append("user", f"q{n}")
+        history.append("assistant", f"a{n}")
+    history.trim(keep_from=len(history))
+    assert contents(history.messages) == ["q3", "a3", "q4", "a4"]
+    assert (history.offset, history.spilled_rows, len(history)) == (6, 3, 10)
+
+
+def test_trim_keeps_what_the_context_window_needs():
+    history = ChatHistory(CONVERSATION, max_messages=2)
+    for n in range(4):
+        history.append("user", f"q{n}")
+        history.append("assistant", f"a{n}")
+    history.trim(keep_from=3)
+    # Position 3 is inside the second exchange, so only the first one goes
+    assert history.offset == 2
+    assert contents(history.messages)[0] == "q1"
+
+
+def test_unanswered_question_is_dropped_not_spilled():
+    history = ChatHistory(CONVERSATION, max_messages=2)
+    history.append("user", "lost")
+    history.append("user", "q0")
+    history.append("assistant", "a0")
+    history.trim(keep_from=len(history))
+    assert (history.offset, history.spilled_rows) == (1, 0)
+
+
+def test_visible_pages_through_spilled_exchanges(database):
+    history = ChatHistory(CONVERSATION, max_messages=4)
+    chat(history, 5)
+    history.trim(keep_from=len(history))
+
+    shown, more = history.visible(2)
+    assert (contents(shown), more) == (["q4", "a4"], True)
+    shown, more = history.visible(8)
+    assert (contents(shown), more) == (["q1", "a1", "q2", "a2", "q3", "a3", "q4", "a4"], True)
+    shown, more = history.visible(10)
+    assert contents(shown) == [f"{r}{n}" for n in range(5) for r in "qa"]
+    assert not more
+
+
+def test_export_includes_spilled_exchanges(database):
+    history = ChatHistory(CONVERSATION, max_messages=2)
+    chat(history, 3)
+    history.trim(keep_from=len(history))
+    path = export_conversation_csv(CONVERSATION)
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f))
+    finally:
+        os.remove(path)
+    assert rows[0] == ["Role", "Message"]
+    assert [message for _, message in rows[1:]] == ["q0", "a0", "q1", "a1", "q2", "a2"]
+
+
+def test_export_of_an_empty_conversation(database):
+    assert export_conversation_csv(str(uuid.UUID(int=8))) is None
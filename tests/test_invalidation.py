@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from app.cache import invalidation
+from app.cache.invalidation import InvalidationListener
+from app.cache.ttl_cache import MISSING, metadata_cache
+from app.db.database_connection import get_app_title, notify_cache_invalidation, pooled_connection
+
+from tests.database import TEST_DATABASE_URL
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def cache():
+    metadata_cache.invalidate()
+    yield metadata_cache
+    metadata_cache.invalidate()
+
+
+def test_a_new_version_invalidates_only_its_key(cache):
+    listener = InvalidationListener("unused", listening_ttl=3600)
+    cache.set("app_title", "Old title")
+    cache.set("app_description", "Description")
+    listener._handle("app_title:5")
+    assert cache.get("app_title") is MISSING
+    assert cache.get("app_description") == "Description"
+
+
+def test_repeated_older_and_malformed_versions_are_ignored(cache):
+    listener = InvalidationListener("unused", listening_ttl=3600)
+    listener._handle("app_title:5")
+    cache.set("app_title", "New title")
+    listener._handle("app_title:5")
+    listener._handle("app_title:4")
+    listener._handle("app_title:not-a-number")
+    assert cache.get("app_title") == "New title"
+    assert listener.versions == {"app_title": 5}
+
+
+def test_connecting_and_disconnecting_clear_the_cache_and_switch_ttl(cache):
+    base_ttl = cache.ttl
+    listener = InvalidationListener("unused", listening_ttl=base_ttl + 100)
+    cache.set("app_title", "Title")
+    listener._set_connected(True)
+    assert cache.ttl == base_ttl + 100
+    assert cache.get("app_title") is MISSING
+    cache.set("app_title", "Title")
+    listener._set_connected(False)
+    assert cache.ttl == base_ttl
+    assert cache.get("app_title") is MISSING
+
+
+@pytest.fixture
+def class_hours(monkeypatch):
+    hours = {"open": True}
+    monkeypatch.setattr(invalidation, "in_class_hours", lambda: hours["open"])
+    monkeypatch.setattr(invalidation, "is_database_warm", lambda: False)
+    monkeypatch.setattr(invalidation, "LISTENER_POLL_INTERVAL", 0.05)
+    return hours
+
+
+def test_no_connection_outside_class_hours(class_hours, monkeypatch):
+    class_hours["open"] = False
+    connects = []
+    monkeypatch.setattr(invalidation.psycopg2, "connect", connects.append)
+    listener = InvalidationListener("postgresql://unused", listening_ttl=3600)
+    listener.start()
+    time.sleep(0.2)
+    listener.stop()
+    listener.join(2)
+    assert connects == []
+    assert not listener.connected
+
+
+def test_change_on_another_replica_arrives_and_listener_lets_go_after_hours(database, class_hours, cache):
+    listener = InvalidationListener(TEST_DATABASE_URL, listening_ttl=3600)
+    listener.start()
+    try:
+        wait_until(lambda: listener.connected)
+        cache.set("app_title", "Cached before the change")
+        # What update_app_title does on another replica
+        with pooled_connection() as conn, conn, conn.cursor() as cur:
+            cur.execute("UPDATE app_title SET description = 'Renamed' WHERE id = 1")
+            notify_cache_invalidation(cur, "app_title")
+        wait_until(lambda: cache.get("app_title") is MISSING)
+        assert get_app_title() == "Renamed"
+        class_hours["open"] = False
+        wait_until(lambda: not listener.connected)
+    finally:
+        listener.stop()
+        listener.join(2)
@@ -0,0 +1,128 @@
+import uuid
+
+import pytest
+
+from app.chatlog.summary_store import fetch_conversation_summaries
+from app.jobs import job_runner
+from app.jobs.job_runner import (
+    enqueue_summary_job,
+    get_summary_job,
+    list_summary_jobs,
+    requeue_summary_job,
+    run_summary_job,
+)
+
+from tests.database import execute
+
+A, B, C = (str(uuid.UUID(int=n)) for n in (1, 2, 3))
+
+
+@pytest.fixture
+def jobs(database, fake_claude, monkeypatch):
+    started = []
+    monkeypatch.setattr(job_runner, "start_background_runner", lambda: started.append(1))
+    return started
+
+
+def log(*conversation_ids):
+    for conv_id in conversation_ids:
+        execute("INSERT INTO chat_logs (prompt, response, conversation_id) VALUES ('q', 'a', %s)", (conv_id,))
+
+
+def items(job_id):
+    return dict(execute("SELECT conversation_id::text, status FROM summary_job_items WHERE job_id = %s", (job_id,)))
+
+
+def failing_for(*failed):
+    real = job_runner.generate_summary_for_each_group
+
+    def generate(batches, on_result=None, **kwargs):
+        for conv_id in failed:
+            on_result(conv_id, None, "rate limited")
+        return real({c: b for c, b in batches.items() if c not in failed}, on_result=on_result, **kwargs)
+
+    return generate
+
+
+def test_job_checkpoints_each_conversation(jobs, fake_claude):
+    log(A, B, C)
+    job_id = run_summary_job(enqueue_summary_job())
+    job = get_summary_job(job_id)
+    assert (job["status"], job["total"], job["done"], job["failed"]) == ("completed", 3, 3, 0)
+    assert set(items(job_id).values()) == {"done"}
+    assert set(fetch_conversation_summaries()) == {A, B, C}
+    assert job["result"]
+
+
+def test_resume_only_redoes_unfinished_conversations(jobs, fake_claude, monkeypatch):
+    log(A, B, C)
+    real = job_runner.generate_summary_for_each_group
+    monkeypatch.setattr(job_runner, "generate_summary_for_each_group", failing_for(B))
+    job_id = run_summary_job(enqueue_summary_job())
+    job = get_summary_job(job_id)
+    assert (job["status"], job["done"], job["failed"]) == ("failed", 2, 1)
+    assert items(job_id)[B] != "done"
+
+    monkeypatch.setattr(job_runner, "generate_summary_for_each_group", real)
+    fake_claude.requests.clear()
+    assert requeue_summary_job(job_id)
+    assert run_summary_job() == job_id
+    assert get_summary_job(job_id)["status"] == "completed"
+    assert set(items(job_id).values()) == {"done"}
+    # One summary for B and one for the compiled result; A and C are not summarized again
+    assert len(fake_claude.requests) == 2
+
+
+def test_interrupted_job_is_taken_over(jobs):
+    log(A)
+    job_id = enqueue_summary_job()
+    execute("UPDATE summary_jobs SET status = 'running', heartbeat_at = now() - interval '1 hour' WHERE id = %s", (job_id,))
+    assert run_summary_job() == job_id
+    assert get_summary_job(job_id)["status"] == "completed"
+
+
+def test_running_job_is_not_claimed_twice(jobs):
+    log(A)
+    job_id = enqueue_summary_job()
+    execute("UPDATE summary_jobs SET status = 'running', heartbeat_at = now() WHERE id = %s", (job_id,))
+    assert run_summary_job() is None
+    assert run_summary_job(job_id) is None
+
+
+def test_no_second_job_while_one_is_active(jobs):
+    log(A)
+    job_id = enqueue_summary_job()
+    assert enqueue_summary_job() == job_id
+    execute("UPDATE summary_jobs SET status = 'running', heartbeat_at = now() WHERE id = %s", (job_id,))
+    assert enqueue_summary_job(use_batch_api=True) == job_id
+    assert len(list_summary_jobs()) == 1
+    execute("UPDATE summary_jobs SET status = 'completed' WHERE id = %s", (job_id,))
+    assert enqueue_summary_job() != job_id
+
+
+def test_failed_job_is_not_requeued_while_another_is_active(jobs):
+    execute("INSERT INTO summary_jobs (status) VALUES ('failed')")
+    failed = list_summary_jobs()[0]["id"]
+    active = enqueue_summary_job()
+    assert not requeue_summary_job(failed)
+    assert get_summary_job(failed)["status"] == "failed"
+    execute("UPDATE summary_jobs SET status = 'completed' WHERE id = %s", (active,))
+    assert requeue_summary_job(failed)
+
+
+def test_background_runner_is_opt_in(jobs, monkeypatch):
+    enqueue_summary_job()
+    assert jobs == []
+    execute("UPDATE summary_jobs SET status = 'completed'")
+    monkeypatch.setenv("SUMMARY_JOBS_IN_PROCESS", "true")
+    enqueue_summary_job()
+    assert jobs == [1]
+
+
+def test_cli_enqueue_never_starts_the_background_runner(jobs, monkeypatch, capsys):
+    monkeypatch.setenv("SUMMARY_JOBS_IN_PROCESS", "true")
+    log(A)
+    assert job_runner.main(["enqueue", "--run"]) == 0
+    assert jobs == []
+    assert get_summary_job()["status"] == "completed"
+    assert "completed" in capsys.readouterr().out
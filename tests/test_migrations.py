@@ -0,0 +1,106 @@
+import psycopg2
+import pytest
+
+from app.db import migrations
+from app.db.database_connection import pooled_connection
+from app.db.migrations import MIGRATIONS, ensure_schema, get_applied_versions, run_migrations
+
+from tests.database import execute
+
+
+def tables():
+    return {name for (name,) in execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")}
+
+
+def topics():
+    return {topic for (topic,) in execute("SELECT topic FROM resources")}
+
+
+def test_fresh_database_gets_every_migration(empty_database):
+    assert run_migrations()
+    assert get_applied_versions() == {version for version, _, _ in MIGRATIONS}
+    assert {"chat_logs", "conversation_summaries", "response_cache", "resources", "summary_jobs"} <= tables()
+    assert topics() == {"Python", "Machine Learning", "Web Development"}
+
+
+def test_applied_migrations_are_skipped(database, monkeypatch):
+    calls = []
+    monkeypatch.setattr(migrations, "MIGRATIONS", [(v, d, lambda cur, v=v: calls.append(v)) for v, d, _ in MIGRATIONS])
+    assert run_migrations()
+    assert calls == []
+
+
+def test_reapply_recreates_a_dropped_table(database):
+    execute("DROP TABLE chat_logs")
+    assert run_migrations(reapply=True)
+    assert "chat_logs" in tables()
+    execute("INSERT INTO chat_logs (prompt, response) VALUES ('p', 'r')")
+
+
+def test_reapply_does_not_reseed_deleted_resources(database):
+    execute("DELETE FROM resources WHERE topic = 'Python'")
+    assert run_migrations(reapply=True)
+    assert topics() == {"Machine Learning", "Web Development"}
+
+
+def test_partitioned_chat_logs(empty_database, monkeypatch):
+    monkeypatch.setenv("CHATLOG_PARTITIONING", "true")
+    assert run_migrations()
+    partitions = execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'chat_logs'::regclass
+    """)
+    assert ("chat_logs_default",) in partitions
+    assert len(partitions) > 1
+    execute("INSERT INTO chat_logs (prompt, response) VALUES ('p', 'r')")
+    assert execute("SELECT count(*) FROM chat_logs_default") == [(0,)]
+
+
+def test_ensure_schema_migrates_once_per_process(empty_database, monkeypatch):
+    calls = []
+    monkeypatch.setattr(migrations, "_schema_ready", False)
+    monkeypatch.setattr(migrations, "run_migrations", lambda: calls.append(1) or True)
+    ensure_schema()
+    ensure_schema()
+    assert calls == [1]
+
+
+def test_auto_migrate_off_leaves_the_schema_alone(empty_database, monkeypatch):
+    monkeypatch.setenv("AUTO_MIGRATE", "false")
+    monkeypatch.setattr(migrations, "_schema_ready", False)
+    ensure_schema()
+    assert "chat_logs" not in tables()
+
+
+def valid_indexes(table):
+    return {name for (name,) in execute("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass AND i.indisvalid
+    """, (table,))}
+
+
+def test_search_indexes_are_built_on_every_partition(empty_database, monkeypatch):
+    monkeypatch.setenv("CHATLOG_PARTITIONING", "true")
+    assert run_migrations()
+    assert {"chat_logs_search_idx", "chat_logs_timestamp_id_idx"} <= valid_indexes("chat_logs")
+    assert {"chat_logs_default_search_idx", "chat_logs_default_timestamp_id_idx"} <= valid_indexes("chat_logs_default")
+    assert run_migrations(reapply=True)
+
+
+def test_an_interrupted_concurrent_build_is_redone(database):
+    execute("INSERT INTO chat_logs (prompt, response) VALUES ('same', 'a'), ('same', 'b')")
+    execute("DROP INDEX chat_logs_timestamp_id_idx")
+    # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind under the same name
+    with pytest.raises(psycopg2.IntegrityError):
+        with pooled_connection() as conn:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("CREATE UNIQUE INDEX CONCURRENTLY chat_logs_timestamp_id_idx ON chat_logs (prompt)")
+            finally:
+                conn.autocommit = False
+    assert "chat_logs_timestamp_id_idx" not in valid_indexes("chat_logs")
+    assert run_migrations(reapply=True)
+    assert "chat_logs_timestamp_id_idx" in valid_indexes("chat_logs")
+    definition = execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'chat_logs_timestamp_id_idx'")
+    assert "(\"timestamp\", id)" in definition[0][0]
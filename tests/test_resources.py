@@ -0,0 +1,81 @@
+import pytest
+
+from app.cache.ttl_cache import metadata_cache
+from app.resources import resources_handler
+from app.resources.resources_handler import GENERAL_RESOURCES, KeywordMatcher, recommend_resources
+
+
+def test_keywords_match_on_word_boundaries():
+    matcher = KeywordMatcher({"web": ["Web"], "loop": ["Loops"]})
+    assert dict(matcher.score("How do I build a web page?")) == {"Web": 1}
+    assert dict(matcher.score("A cobweb in the loophole")) == {}
+    assert dict(matcher.score("web")) == {"Web": 1}
+
+
+def test_matching_ignores_case_and_counts_every_occurrence():
+    matcher = KeywordMatcher({"loop": ["Loops"]})
+    assert matcher.score("LOOP inside a Loop")["Loops"] == 2
+
+
+def test_longer_keywords_weigh_more():
+    matcher = KeywordMatcher({"for loop": ["Loops"], "list": ["Lists"]})
+    scores = matcher.score("a for loop over a list")
+    assert scores == {"Loops": 2, "Lists": 1}
+
+
+def test_overlapping_keywords_are_all_found():
+    matcher = KeywordMatcher({"machine learning": ["ML"], "learning": ["Study skills"], "machine": ["Hardware"]})
+    scores = matcher.score("how does machine learning work")
+    assert scores == {"ML": 2, "Study skills": 1, "Hardware": 1}
+
+
+def test_keyword_shared_by_several_topics():
+    matcher = KeywordMatcher({"python": ["Python basics", "Data science"]})
+    assert set(matcher.score("python")) == {"Python basics", "Data science"}
+
+
+@pytest.fixture
+def resources(monkeypatch):
+    metadata_cache.invalidate("resource_matcher")
+    monkeypatch.setattr(resources_handler, "_read_resources", lambda: {
+        "Loops": {"keywords": ["loop", "for loop", "while loop"], "links": ["https://example.com/loops"]},
+        "Lists": {"keywords": ["list"], "links": ["https://example.com/lists"]},
+        "Web": {"keywords": ["html"], "links": ["https://example.com/web"]},
+    })
+    yield
+    metadata_cache.invalidate("resource_matcher")
+
+
+def test_recommend_resources_ranks_topics(resources):
+    assert recommend_resources("Why does my while loop never stop? Is it the list?", top_k=1) == ["https://example.com/loops"]
+    assert recommend_resources("for loop over a list", top_k=2) == ["https://example.com/loops", "https://example.com/lists"]
+
+
+def test_recommend_resources_falls_back_to_general_links(resources):
+    assert recommend_resources("Tell me a joke") == GENERAL_RESOURCES
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    metadata_cache.invalidate("resource_matcher")
+    results = []
+    monkeypatch.setattr(resources_handler, "_read_resources", lambda: results.pop(0))
+    yield results
+    metadata_cache.invalidate("resource_matcher")
+
+
+def test_an_empty_table_is_cached(reads):
+    reads.append({})
+    assert recommend_resources("for loop") == GENERAL_RESOURCES
+    assert recommend_resources("for loop") == GENERAL_RESOURCES
+    assert reads == []
+    # Until a save or delete invalidates it
+    metadata_cache.invalidate("resource_matcher")
+    reads.append({"Loops": {"keywords": ["loop"], "links": ["https://example.com/loops"]}})
+    assert recommend_resources("for loop") == ["https://example.com/loops"]
+
+
+def test_a_failed_read_is_not_cached(reads):
+    reads.extend([None, {"Loops": {"keywords": ["loop"], "links": ["https://example.com/loops"]}}])
+    assert recommend_resources("for loop") == GENERAL_RESOURCES
+    assert recommend_resources("for loop") == ["https://example.com/loops"]
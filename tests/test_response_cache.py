@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from app.cache.response_cache import ResponseCache, normalize_prompt
+
+from tests.database import execute
+
+
+@pytest.mark.parametrize("prompt, normalized", [
+    ("What is a for loop?", "what is a for loop"),
+    ("  WHAT is a   for loop ?!", "what is a for loop"),
+    ("What is 2+2?", "what is 2+2"),
+    ("print(x).", "print(x)"),
+    ("...", ""),
+])
+def test_normalize_prompt(prompt, normalized):
+    assert normalize_prompt(prompt) == normalized
+
+
+@pytest.mark.parametrize("a, b", [
+    ("What is 2+2?", "What is 2-2?"),
+    ("Is a == b true?", "Is a = b true?"),
+    ("What does x++ do?", "What does x-- do?"),
+    ("What is list[0]?", "What is list(0)?"),
+])
+def test_different_questions_get_different_keys(a, b):
+    assert normalize_prompt(a) != normalize_prompt(b)
+    cache = ResponseCache(ttl=60, max_entries=10)
+    cache.store(a, "instructions", "answer to a")
+    assert cache.lookup(b, "instructions") is None
+    assert cache.lookup(a, "instructions") == "answer to a"
+
+
+def test_trivially_different_spellings_share_an_answer():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    cache.store("What is 2+2?", "instructions", "It is 4.")
+    assert cache.lookup("what is 2+2", "instructions") == "It is 4."
+    assert cache.lookup("  What  is 2+2 ?? ", "instructions") == "It is 4."
+    assert cache.stats["exact_hits"] == 2
+
+
+def test_answers_never_cross_instruction_versions():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    cache.store("What is recursion?", "old instructions", "old answer")
+    assert cache.lookup("What is recursion?", "new instructions") is None
+
+
+def test_entries_expire():
+    cache = ResponseCache(ttl=0.05, max_entries=10)
+    cache.store("What is recursion?", "instructions", "answer")
+    time.sleep(0.1)
+    assert cache.lookup("What is recursion?", "instructions") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(ttl=60, max_entries=2)
+    cache.store("first question", "instructions", "1")
+    cache.store("second question", "instructions", "2")
+    cache.lookup("first question", "instructions")
+    cache.store("third question", "instructions", "3")
+    assert cache.lookup("second question", "instructions") is None
+    assert cache.lookup("first question", "instructions") == "1"
+    assert cache.lookup("third question", "instructions") == "3"
+
+
+def shared_prompts():
+    return {prompt for (prompt,) in execute("SELECT normalized_prompt FROM response_cache")}
+
+
+def test_shared_answers_are_read_by_other_replicas(database):
+    ResponseCache(ttl=60, max_entries=10, shared=True).store("What is recursion?", "instructions", "answer")
+    other = ResponseCache(ttl=60, max_entries=10, shared=True)
+    assert other.lookup("what is recursion", "instructions") == "answer"
+    assert other.stats["shared_hits"] == 1
+
+
+def test_shared_table_is_pruned_to_max_entries(database):
+    cache = ResponseCache(ttl=60, max_entries=2, shared=True, prune_interval=0)
+    for n in range(4):
+        execute("INSERT INTO response_cache (cache_key, instructions_version, normalized_prompt, response, created_at) "
+                "VALUES (%s, 'v', %s, 'r', now() - make_interval(secs => %s))", (f"key {n}", f"old {n}", 10 - n))
+    cache.store("new question", "instructions", "answer")
+    assert shared_prompts() == {"new question", "old 3"}
+
+
+def test_expired_shared_answers_are_pruned(database):
+    cache = ResponseCache(ttl=60, max_entries=10, shared=True, prune_interval=0)
+    execute("INSERT INTO response_cache (cache_key, instructions_version, normalized_prompt, response, created_at) "
+            "VALUES ('expired', 'v', 'expired', 'r', now() - interval '2 minutes')")
+    cache.store("new question", "instructions", "answer")
+    assert shared_prompts() == {"new question"}
+
+
+def test_pruning_waits_for_the_interval(database):
+    cache = ResponseCache(ttl=60, max_entries=1, shared=True, prune_interval=3600)
+    cache.store("first question", "instructions", "1")
+    cache.store("second question", "instructions", "2")
+    assert shared_prompts() == {"first question", "second question"}
@@ -0,0 +1,104 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.chatlog import chatlog_handler, retention
+from app.chatlog.retention import apply_retention, archive_expired_chat_logs, retention_cutoff
+from app.db.database_connection import pooled_connection
+from app.db.migrations import run_migrations
+
+from tests.database import execute
+
+TODAY = datetime.combine(retention_cutoff(0), datetime.min.time())
+OLD = TODAY - timedelta(days=200)
+RECENT = TODAY - timedelta(days=1)
+
+
+def log(timestamp, prompt="q"):
+    execute("INSERT INTO chat_logs (timestamp, prompt, response) VALUES (%s, %s, 'a')", (timestamp, prompt))
+
+
+def prompts():
+    return sorted(prompt for (prompt,) in execute("SELECT prompt FROM chat_logs"))
+
+
+def archived(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_expired_rows_are_archived_then_deleted(database, tmp_path):
+    log(OLD, "old 1")
+    log(OLD + timedelta(hours=1), "old 2")
+    log(RECENT, "recent")
+    result = apply_retention(keep_days=90, archive_dir=str(tmp_path))
+    assert (result["expired"], result["archived"], result["deleted"]) == (2, 2, 2)
+    assert prompts() == ["recent"]
+    (path,) = result["files"]
+    assert os.path.basename(path) == f"chat_logs_{OLD:%Y-%m}.jsonl.gz"
+    assert [row["prompt"] for row in archived(path)] == ["old 1", "old 2"]
+
+
+def test_dry_run_changes_nothing(database, tmp_path):
+    log(OLD)
+    result = apply_retention(keep_days=90, archive_dir=str(tmp_path), dry_run=True)
+    assert result["expired"] == 1
+    assert prompts() == ["q"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_rerun_does_not_duplicate_archived_rows(database, tmp_path):
+    log(OLD, "old 1")
+    cutoff = retention_cutoff(90)
+    archive_expired_chat_logs(cutoff, str(tmp_path))
+    # The delete failed; the next run archives the same rows plus a new one
+    log(OLD, "old 2")
+    count, (path,) = archive_expired_chat_logs(cutoff, str(tmp_path))
+    assert count == 2
+    assert sorted(row["prompt"] for row in archived(path)) == ["old 1", "old 2"]
+
+
+def test_failed_archive_keeps_the_old_file_and_the_rows(database, tmp_path, monkeypatch):
+    log(OLD, "old 1")
+    (path,) = apply_retention(keep_days=90, archive_dir=str(tmp_path))["files"]
+    log(OLD, "old 2")
+    rows = list(chatlog_handler.iter_chat_logs(end_date=retention_cutoff(90) - timedelta(days=1)))
+
+    def interrupted(**kwargs):
+        yield rows[0]
+        raise ConnectionError("connection lost")
+
+    monkeypatch.setattr(retention, "iter_chat_logs", interrupted)
+    assert apply_retention(keep_days=90, archive_dir=str(tmp_path)) is None
+    assert [row["prompt"] for row in archived(path)] == ["old 1"]
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+    assert prompts() == ["old 2"]
+
+
+def test_nothing_is_deleted_unless_every_row_was_archived(database, tmp_path, monkeypatch):
+    log(OLD)
+    monkeypatch.setattr(retention, "archive_expired_chat_logs", lambda cutoff, archive_dir: (0, []))
+    assert apply_retention(keep_days=90, archive_dir=str(tmp_path)) is None
+    assert prompts() == ["q"]
+
+
+@pytest.fixture
+def partitioned_database(empty_database, monkeypatch):
+    monkeypatch.setenv("CHATLOG_PARTITIONING", "true")
+    assert run_migrations()
+
+
+def test_expired_partitions_are_dropped(partitioned_database, tmp_path):
+    start = OLD.date().replace(day=1)
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            chatlog_handler._create_month_partition(cur, start, chatlog_handler._month_start(start, 1))
+    log(OLD, "old")
+    log(RECENT, "recent")
+    result = apply_retention(keep_days=90, archive_dir=str(tmp_path))
+    assert result["partitions_dropped"] == [f"chat_logs_y{start:%Y}m{start:%m}"]
+    assert result["archived"] == 1
+    assert prompts() == ["recent"]
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+from app.chat.fake_client import FakeAnthropicClient
+from app.chat.generation import complete
+from app.chat.scheduler import BACKGROUND, INTERACTIVE, LLMScheduler, SchedulerBusy, billable_tokens
+
+
+def make_scheduler(max_concurrency=1, queue_timeout=5.0):
+    return LLMScheduler(max_concurrency=max_concurrency, tokens_per_minute=1_000_000,
+                        session_tokens_per_minute=1_000_000, queue_timeout=queue_timeout)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.005)
+
+
+# Queue requests one by one behind a held slot, in a known order, and return
+# the order in which they were granted once the slot is released
+def granted_order(scheduler, requests):
+    order = []
+    threads = []
+    release = threading.Event()
+    holder_ready = threading.Event()
+
+    def hold():
+        with scheduler.slot("holder", 1):
+            holder_ready.set()
+            release.wait()
+
+    def request(key, priority):
+        with scheduler.slot(key, 1, priority):
+            order.append(key)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    holder_ready.wait()
+    for waiting, (key, priority) in enumerate(requests, start=1):
+        thread = threading.Thread(target=request, args=(key, priority))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: scheduler.size()["waiting"] == waiting)
+    release.set()
+    for thread in [holder] + threads:
+        thread.join()
+    return order
+
+
+def test_conversations_take_turns():
+    order = granted_order(make_scheduler(), [("a", INTERACTIVE), ("a", INTERACTIVE), ("a", INTERACTIVE), ("b", INTERACTIVE)])
+    assert order == ["a", "b", "a", "a"]
+
+
+def test_student_requests_go_before_background_work():
+    order = granted_order(make_scheduler(), [("summaries", BACKGROUND), ("student", INTERACTIVE)])
+    assert order == ["student", "summaries"]
+
+
+def test_timeout_raises_and_leaves_no_ticket_behind():
+    scheduler = make_scheduler(queue_timeout=0.1)
+    with scheduler.slot("a", 1):
+        with pytest.raises(SchedulerBusy):
+            with scheduler.slot("b", 1):
+                pass
+        assert scheduler.size()["waiting"] == 0
+    assert scheduler.stats["timeouts"] == 1
+    assert scheduler.size()["running"] == 0
+
+
+def test_abandoned_wait_does_not_hold_a_slot():
+    scheduler = make_scheduler()
+
+    class Rerun(BaseException):
+        pass
+
+    def on_wait(ahead):
+        raise Rerun()
+
+    with scheduler.slot("a", 1):
+        with pytest.raises(Rerun):
+            with scheduler.slot("b", 1, on_wait=on_wait):
+                pass
+        assert scheduler.size()["waiting"] == 0
+    assert scheduler.size()["running"] == 0
+    # Later callers get a slot straight away
+    with scheduler.slot("c", 1, timeout=0.5):
+        assert scheduler.size()["running"] == 1
+
+
+def test_on_wait_reports_requests_ahead():
+    scheduler = make_scheduler(queue_timeout=0.2)
+    positions = []
+    with scheduler.slot("a", 1):
+        with pytest.raises(SchedulerBusy):
+            with scheduler.slot("b", 1, on_wait=positions.append):
+                pass
+    assert positions == [0]
+
+
+def test_call_refunds_unused_tokens():
+    scheduler = LLMScheduler(max_concurrency=2, tokens_per_minute=1000, session_tokens_per_minute=1000, queue_timeout=1.0)
+    client = FakeAnthropicClient(reply="Recursion is a function calling itself.")
+    usage = {}
+    reply = scheduler.call(lambda: complete(client, "You are a tutor.", "What is recursion?", 900, usage),
+                           "conversation", 900, usage_tokens=lambda: billable_tokens(usage))
+    assert reply == "Recursion is a function calling itself."
+    assert len(client.requests) == 1
+    # Only the tokens actually used stay charged, so a second large request fits at once
+    with scheduler.slot("conversation", 900, timeout=0.1):
+        pass
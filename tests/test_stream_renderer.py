@@ -0,0 +1,66 @@
+from app.chat import stream_renderer
+from app.chat.stream_renderer import StreamRenderer
+
+
+class Placeholder:
+    def __init__(self):
+        self.rendered = []
+
+    def markdown(self, text):
+        self.rendered.append(text)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def make_renderer(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(stream_renderer, "time", clock)
+    placeholder = Placeholder()
+    return StreamRenderer(placeholder, **kwargs), placeholder, clock
+
+
+def test_first_chunk_is_shown_at_once(monkeypatch):
+    renderer, placeholder, _ = make_renderer(monkeypatch, max_fps=10, flush_bytes=1000)
+    renderer.write("Hello")
+    assert placeholder.rendered == ["Hello▌"]
+
+
+def test_frames_are_capped(monkeypatch):
+    renderer, placeholder, clock = make_renderer(monkeypatch, max_fps=10, flush_bytes=1000)
+    for _ in range(50):
+        renderer.write("x")
+        clock.now += 0.01
+    # Half a second at 10 frames per second
+    assert renderer.frames == 5
+    assert placeholder.rendered[-1] == "x" * 41 + "▌"
+
+
+def test_a_large_backlog_is_flushed_early(monkeypatch):
+    renderer, placeholder, _ = make_renderer(monkeypatch, max_fps=1, flush_bytes=10)
+    renderer.write("a")
+    renderer.write("b" * 5)
+    renderer.write("c" * 5)
+    assert placeholder.rendered == ["a▌", "a" + "b" * 5 + "c" * 5 + "▌"]
+
+
+def test_finish_renders_the_full_text_once(monkeypatch):
+    renderer, placeholder, _ = make_renderer(monkeypatch, max_fps=1, flush_bytes=1000)
+    for word in ["one ", "two ", "three"]:
+        renderer.write(word)
+    assert renderer.finish() == "one two three"
+    assert renderer.finish() == "one two three"
+    assert placeholder.rendered == ["one ▌", "one two three"]
+
+
+def test_empty_chunks_are_ignored(monkeypatch):
+    renderer, placeholder, _ = make_renderer(monkeypatch, max_fps=0, flush_bytes=1000)
+    renderer.write("")
+    renderer.write(None)
+    assert placeholder.rendered == []
+    assert renderer.finish() == ""
@@ -0,0 +1,137 @@
+import uuid
+
+import psycopg2
+import pytest
+
+from app.chatlog import summary_store
+from app.chatlog.summary_store import (
+    clear_conversation_summaries,
+    fetch_changed_conversations,
+    fetch_conversation_summaries,
+    refresh_conversation_summaries,
+)
+from app.jobs import job_runner
+from app.jobs.job_runner import enqueue_summary_job, get_summary_job, run_summary_job
+
+from tests.database import TEST_DATABASE_URL, execute
+
+A, B, C = (str(uuid.UUID(int=n)) for n in (1, 2, 3))
+
+
+@pytest.fixture
+def store(database, fake_claude, monkeypatch):
+    monkeypatch.setenv("SUMMARY_JOBS_IN_PROCESS", "false")
+
+
+def log(conversation_id, n=1):
+    for i in range(n):
+        execute("INSERT INTO chat_logs (prompt, response, conversation_id) VALUES (%s, %s, %s)",
+                (f"question {i}", f"answer {i}", conversation_id))
+    return execute("SELECT max(id) FROM chat_logs")[0][0]
+
+
+def watermark():
+    return execute("SELECT last_log_id FROM summary_watermark")[0][0]
+
+
+def test_refresh_summarizes_only_new_rows(store):
+    log(A, 3)
+    log(B)
+    assert refresh_conversation_summaries() == (2, 2)
+    assert refresh_conversation_summaries() == (0, 0)
+    log(B)
+    assert list(fetch_changed_conversations()) == [B]
+    assert refresh_conversation_summaries() == (1, 1)
+    assert set(fetch_conversation_summaries()) == {A, B}
+
+
+def test_watermark_settles_one_lag_after_it_was_proposed(store, monkeypatch):
+    last = log(A, 3)
+    refresh_conversation_summaries()
+    refresh_conversation_summaries()
+    # Proposed, but not yet old enough to take effect
+    assert watermark() == 0
+    monkeypatch.setenv("SUMMARY_WATERMARK_LAG", "0")
+    refresh_conversation_summaries()
+    assert watermark() == last
+
+
+def test_rows_committed_out_of_id_order_are_not_skipped(store, monkeypatch):
+    monkeypatch.setenv("SUMMARY_WATERMARK_LAG", "0.2")
+    # Another replica's batch takes the lower id but commits last
+    slow_writer = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        with slow_writer.cursor() as cur:
+            cur.execute("INSERT INTO chat_logs (prompt, response, conversation_id) VALUES ('late', 'late', %s)", (A,))
+        log(B)
+        assert refresh_conversation_summaries() == (1, 1)
+        # Still within the lag, so B's id cannot become the watermark yet
+        assert refresh_conversation_summaries() == (0, 0)
+        assert watermark() == 0
+        slow_writer.commit()
+    finally:
+        slow_writer.close()
+    execute("SELECT pg_sleep(0.3)")
+    assert refresh_conversation_summaries() == (1, 1)
+    assert set(fetch_conversation_summaries()) == {A, B}
+
+
+def test_failed_conversation_holds_the_watermark_back(store, monkeypatch):
+    monkeypatch.setenv("SUMMARY_WATERMARK_LAG", "0")
+    log(A)
+    first_b = log(B)
+    log(C)
+    real = summary_store.generate_summary_for_each_group
+
+    def without_b(batches, **kwargs):
+        summaries = real(batches, **kwargs)
+        summaries.pop(B)
+        return summaries
+
+    monkeypatch.setattr(summary_store, "generate_summary_for_each_group", without_b)
+    refresh_conversation_summaries()
+    refresh_conversation_summaries()
+    assert watermark() == first_b - 1
+    monkeypatch.setattr(summary_store, "generate_summary_for_each_group", real)
+    assert refresh_conversation_summaries() == (1, 1)
+    assert set(fetch_conversation_summaries()) == {A, B, C}
+
+
+def test_resumed_job_leaves_conversations_it_did_not_plan(store, monkeypatch):
+    monkeypatch.setenv("SUMMARY_WATERMARK_LAG", "0")
+    log(A)
+    real = job_runner.generate_summary_for_each_group
+
+    def failing(batches, on_result=None, **kwargs):
+        for conv_id in batches:
+            on_result(conv_id, None, "rate limited")
+        return {}
+
+    monkeypatch.setattr(job_runner, "generate_summary_for_each_group", failing)
+    job_id = enqueue_summary_job()
+    run_summary_job(job_id)
+    assert get_summary_job(job_id)["status"] == "failed"
+
+    # B changes after the job was planned; resuming it only covers A
+    first_b = log(B)
+    monkeypatch.setattr(job_runner, "generate_summary_for_each_group", real)
+    run_summary_job(job_id)
+    run_summary_job(job_id)
+    assert get_summary_job(job_id)["status"] == "completed"
+    assert set(fetch_conversation_summaries()) == {A}
+    assert watermark() < first_b
+
+    assert list(fetch_changed_conversations()) == [B]
+    run_summary_job(enqueue_summary_job())
+    assert set(fetch_conversation_summaries()) == {A, B}
+
+
+def test_clearing_summaries_rewinds_the_watermark(store, monkeypatch):
+    monkeypatch.setenv("SUMMARY_WATERMARK_LAG", "0")
+    log(A)
+    refresh_conversation_summaries()
+    refresh_conversation_summaries()
+    assert watermark() > 0
+    clear_conversation_summaries()
+    assert watermark() == 0
+    assert list(fetch_changed_conversations()) == [A]
@@ -0,0 +1,58 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from app.cache.config_snapshot import get_snapshot_value, update_config_snapshot
+from app.cache.ttl_cache import metadata_cache
+from app.db.database_connection import get_app_title, get_pool, is_database_warm
+from app.db import migrations
+from app.db.migrations import get_applied_versions
+from app.db.warmup import in_class_hours, warm_up_database
+from app.metrics.tracing import metrics
+
+from tests.database import execute
+
+
+@pytest.mark.parametrize("now, expected", [
+    (datetime(2024, 5, 6, 9, 30), True),    # Monday morning
+    (datetime(2024, 5, 6, 6, 59), False),   # before class
+    (datetime(2024, 5, 6, 18, 0), False),   # end is exclusive
+    (datetime(2024, 5, 11, 10, 0), False),  # Saturday
+])
+def test_default_class_hours(monkeypatch, now, expected):
+    monkeypatch.delenv("DB_KEEPALIVE_HOURS", raising=False)
+    monkeypatch.delenv("DB_KEEPALIVE_DAYS", raising=False)
+    assert in_class_hours(now) is expected
+
+
+def test_configured_class_hours(monkeypatch):
+    monkeypatch.setenv("DB_KEEPALIVE_HOURS", "13:00-15:30")
+    monkeypatch.setenv("DB_KEEPALIVE_DAYS", "Sat, Sun")
+    assert in_class_hours(datetime(2024, 5, 11, 15, 29))
+    assert not in_class_hours(datetime(2024, 5, 11, 15, 30))
+    assert not in_class_hours(datetime(2024, 5, 6, 14, 0))
+
+
+def test_warm_up_migrates_and_saves_the_snapshot(empty_database, monkeypatch):
+    monkeypatch.setattr(migrations, "_schema_ready", False)
+    assert not is_database_warm()
+    assert warm_up_database(connections=2) is not None
+    assert is_database_warm()
+    assert get_applied_versions()
+    assert get_pool().stats["connects"] >= 2
+    assert get_snapshot_value("app_title") == get_app_title()
+    assert "db_warmup_seconds" in {row["name"] for row in metrics.snapshot()["histograms"]}
+
+
+def test_snapshot_is_served_while_the_database_is_cold(database, monkeypatch):
+    update_config_snapshot("app_title", "Last known title")
+    metadata_cache.invalidate()
+    monkeypatch.setattr(get_pool(), "last_activity", None)
+    assert get_app_title() == "Last known title"
+
+    # Once the database is warm, the stored value replaces it
+    monkeypatch.setattr(get_pool(), "last_activity", time.monotonic())
+    execute("UPDATE app_title SET description = 'New title' WHERE id = 1")
+    assert get_app_title() == "New title"
+    assert get_snapshot_value("app_title") == "New title"